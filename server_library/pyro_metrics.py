@@ -0,0 +1,170 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Per-method latency instrumentation for objects exposed with Pyro.
+
+The rpc_metrics class decorator wraps every public method of the class (the ones
+Pyro exposes) and records call counts, a latency histogram and the number of calls
+in flight. The daemons of this repo are multiplexed (pyro_tools sets SERVERTYPE = "multiplex"):
+the calls are served one at a time by the thread of the daemon, the only one calling the wrapped
+methods, so the counters are plain attributes without a lock.
+
+The instrumentation is only installed when the environment variable PYRO_RPC_METRICS
+is set to 1 before the class is imported, otherwise the methods are left untouched and
+there is no overhead at all. get_metrics() and dump_metrics() are always available.
+
+    example of usage:
+        from server_library.pyro_metrics import rpc_metrics
+
+        @Pyro4.expose
+        @rpc_metrics
+        class MyServer:
+            def query(self):
+                ...
+
+        server = MyServer()
+        server.start_metrics_dump(60.)  #print a table with the statistics every minute
+        #remotely: Pyro4.Proxy(uri).get_metrics()
+
+'''
+
+import os
+import time
+import threading
+import inspect
+import functools
+from datetime import datetime
+
+METRICS_ENABLED = os.environ.get('PYRO_RPC_METRICS', '0') == '1'
+
+#upper edges of the latency histogram bins in seconds, the last bin collects everything above
+LATENCY_BINS = (0.001, 0.003, 0.01, 0.03, 0.1, 0.3, 1., 3., 10.)
+
+
+class methodMetrics():
+    def __init__(self, name):
+        self.name = name
+        self.in_flight = 0
+        self.clear()
+
+    def clear(self):
+        #in_flight is not reset, calls running right now still have to leave
+        self.calls = 0
+        self.errors = 0
+        self.max_in_flight = self.in_flight
+        self.total_time = 0.
+        self.max_time = 0.
+        self.histogram = [0]*(len(LATENCY_BINS)+1)
+
+    def enter(self):
+        self.in_flight += 1
+        if self.in_flight > self.max_in_flight:
+            self.max_in_flight = self.in_flight
+
+    def record(self, duration, failed):
+        idx = 0
+        for edge in LATENCY_BINS:
+            if duration <= edge:
+                break
+            idx += 1
+        self.in_flight -= 1
+        self.calls += 1
+        if failed:
+            self.errors += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+        self.histogram[idx] += 1
+
+    def as_dict(self):
+        calls = self.calls
+        return {'calls'         : calls,
+                'errors'        : self.errors,
+                'in_flight'     : self.in_flight,
+                'max_in_flight' : self.max_in_flight,
+                'mean_time'     : self.total_time/calls if calls else 0.,
+                'max_time'      : self.max_time,
+                'histogram'     : list(self.histogram)}
+
+
+def _timed(method, metrics):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        metrics.enter()
+        failed = True
+        st = time.perf_counter()
+        try:
+            ret = method(*args, **kwargs)
+            failed = False
+            return ret
+        finally:
+            metrics.record(time.perf_counter() - st, failed)
+    wrapper._rpc_original = method
+    return wrapper
+
+
+def get_metrics(self):
+    #return the statistics of all the instrumented methods, keyed on the method name
+    metrics = {'enabled' : METRICS_ENABLED,
+               'latency_bins' : list(LATENCY_BINS),
+               'methods' : {}}
+    for name, m in self._rpc_metrics.items():
+        metrics['methods'][name] = m.as_dict()
+    return metrics
+
+def reset_metrics(self):
+    for m in self._rpc_metrics.values():
+        m.clear()
+
+def dump_metrics(self):
+    #text table with the statistics, one line per method that was called at least once
+    t = datetime.now().strftime("%H:%M:%S")
+    lines = [f"{t}: RPC metrics of {type(self).__name__}",
+             f"{'method':<30}{'calls':>8}{'errors':>8}{'mean ms':>10}{'max ms':>10}{'max busy':>10}"]
+    for name, m in sorted(self._rpc_metrics.items()):
+        if m.calls == 0:
+            continue
+        d = m.as_dict()
+        lines.append(f"{name:<30}{d['calls']:>8d}{d['errors']:>8d}{d['mean_time']*1e3:>10.2f}{d['max_time']*1e3:>10.2f}{d['max_in_flight']:>10d}")
+    return '\n'.join(lines)
+
+def start_metrics_dump(self, interval = 60., output = print):
+    #print the metrics table every interval seconds in a background thread
+    def loop():
+        while True:
+            time.sleep(interval)
+            output(self.dump_metrics())
+    threading.Thread(None, loop, None, daemon=True).start()
+
+
+_METRICS_METHODS = ('get_metrics', 'reset_metrics', 'dump_metrics', 'start_metrics_dump')
+
+def rpc_metrics(cls):
+    '''
+    class decorator adding get_metrics(), reset_metrics(), dump_metrics() and start_metrics_dump() to the class,
+    and wrapping all the public methods with the latency counters if METRICS_ENABLED
+    '''
+    cls._rpc_metrics = {}
+    if METRICS_ENABLED:
+        #also the inherited methods, a subclass gets its own counters
+        for name in dir(cls):
+            attr = inspect.getattr_static(cls, name)
+            if name.startswith('_') or name in _METRICS_METHODS or not inspect.isfunction(attr):
+                continue
+            attr = getattr(attr, '_rpc_original', attr)
+            metrics = methodMetrics(name)
+            cls._rpc_metrics[name] = metrics
+            setattr(cls, name, _timed(attr, metrics))
+
+    cls.get_metrics = get_metrics
+    cls.reset_metrics = reset_metrics
+    cls.dump_metrics = dump_metrics
+    cls.start_metrics_dump = start_metrics_dump
+    return cls
@@ -122,6 +122,18 @@ class Wavelengthmeter:
         Freq = GetFrequency(0)
         return Freq
 
+#Exposure (ms) of the CCD arrays (arr = 1 or 2)
+    def getExposure(self, arr=1):
+        #negative values are errors (ErrWlmMissing, ErrNotAvailable ...)
+        return self.dll.GetExposureNum(1, arr, 0)
+
+    def setExposure(self, value, arr=1):
+        #ResERR_NoErr if set
+        return self.dll.SetExposureNum(1, arr, int(value))
+
+    def setExposureMode(self, auto):
+        return self.dll.SetExposureMode(bool(auto))
+
         
 if __name__ == '__main__': 
     """Usage example"""
@@ -32,9 +32,15 @@ import time
 
 class PID:
     """PID Controller
+    time_source: function returning the current time in seconds (time.time by default),
+    replace it with a virtual clock to run the controller in simulations
     """
 
-    def __init__(self, P=0.0, I=0.0, D=0.0):
+    def __init__(self, P=0.0, I=0.0, D=0.0, time_source=time.time):
+
+        self.time_source = time_source
+        # Time step used by every update if not None, instead of the time source
+        self.fixed_step = None
 
         self.Kp = P
         self.Ki = I
@@ -44,6 +50,10 @@ class PID:
         
         self.max_update_time = 0.1
 
+        # True interval mode (see setTrueInterval)
+        self.true_interval = False
+        self.max_sample_interval = 1.
+
         self.sample_time = 0.00
         
         self.clear()
@@ -57,12 +67,12 @@ class PID:
         self.DTerm = 0.0
         self.last_error = 0.0
 
-        self.current_time = time.time()
+        self.current_time = self.time_source()
         self.last_time = self.current_time
 
         self.output = 0.0
 
-    def update(self, feedback_value):
+    def update(self, feedback_value, delta_time=None):
         """Calculates PID value for given reference feedback
 
         .. math::
@@ -73,11 +83,21 @@ class PID:
 
            Test PID with Kp=1.2, Ki=1, Kd=0.001 (test_pid.py)
 
+        If delta_time is given (or a fixed step is set with setFixedStep) it is used as the time
+        since the last update, instead of the time source, and it is not limited to max_update_time.
+        In true interval mode the time from the time source is limited to max_sample_interval instead.
+
         """
         error = self.SetPoint - feedback_value
 
-        self.current_time = time.time()
-        delta_time = min(self.current_time - self.last_time, self.max_update_time)
+        if delta_time is None:
+            delta_time = self.fixed_step
+        if delta_time is None:
+            self.current_time = self.time_source()
+            max_time = self.max_sample_interval if self.true_interval else self.max_update_time
+            delta_time = min(self.current_time - self.last_time, max_time)
+        else:
+            self.current_time = self.last_time + delta_time
         delta_error = error - self.last_error
 
         if (delta_time >= self.sample_time):
@@ -101,6 +121,17 @@ class PID:
             self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
         return self.output
 
+    def feedForward(self, delta_output):
+        """Moves the output by delta_output through the integral term (within the windup guard), so the next
+        updates continue from the moved output. Used to apply corrections predicted between two feedback values.
+        """
+        if self.Ki == 0:
+            return self.output
+        ITerm = min(max(self.ITerm + delta_output / self.Ki, -self.windup_guard), self.windup_guard)
+        self.output += self.Ki * (ITerm - self.ITerm)
+        self.ITerm = ITerm
+        return self.output
+
     def change_setpoint(self, setpt):
         self.SetPoint = setpt
 
@@ -128,6 +159,27 @@ class PID:
         """
         self.windup_guard = windup
 
+    def setTimeSource(self, time_source):
+        """Function returning the time in seconds, e.g. the time of a virtual clock in simulations"""
+        self.time_source = time_source
+        self.current_time = self.time_source()
+        self.last_time = self.current_time
+
+    def setTrueInterval(self, true_interval, max_sample_interval=1.):
+        """Integrate over the real time between the updates (limited to max_sample_interval) instead of
+        at most max_update_time. For feedback values sampled at irregular intervals, e.g. the readings of a
+        time multiplexed wavemeter: the integral gain is then per second, whatever the interval between readings.
+        The caller should only update the PID with new samples.
+        """
+        self.true_interval = true_interval
+        self.max_sample_interval = max_sample_interval
+
+    def setFixedStep(self, fixed_step):
+        """Time step used by every update regardless of the clock, None to use the time source again.
+        Makes the behaviour exactly reproducible, e.g. in tests or when tuning on recorded data.
+        """
+        self.fixed_step = fixed_step
+
     def setSampleTime(self, sample_time):
         """PID that should be updated at a regular interval.
         Based on a pre-determined sampe time, the PID decides if it should compute or return immediately.
@@ -0,0 +1,280 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Bank of PID controllers with the state in numpy arrays, updated all together in one vectorized call.
+The update rules are the same as in PID.py (integral limited by the windup guard, time step limited
+to max_update_time when it comes from the clock, or to max_sample_interval in true interval mode).
+
+Used to:
+    - evaluate many gain combinations at once on a recorded or simulated disturbance (sweep_gains)
+    - hold the controllers of several lasers (e.g. in laserLockHost), every laser uses a row of the
+      bank through bank.controller(i), which has the same interface as PID. The rows are updated from
+      the threads of the lasers: an update only computes and writes the rows in its mask, under the
+      lock of the bank
+
+    example of usage:
+        kp, ki = np.meshgrid([0., 100., 200.], np.linspace(-2000., -200., 10), indexing='ij')
+        rms = sweep_gains(kp, ki, disturbance_MHz, sample_interval = 0.6, mhz_per_volt = 400.)
+        best = np.unravel_index(np.argmin(rms), rms.shape)
+
+'''
+
+import time
+import threading
+import numpy as np
+
+
+SPEED_OF_LIGHT = 299792458
+
+
+class PIDBank:
+    def __init__(self, n, P=0.0, I=0.0, D=0.0, windup_guard=0.01, time_source=time.time):
+        self.n = n
+        self.time_source = time_source
+        self._lock = threading.Lock()
+        self.max_update_time = 0.1
+        self.true_interval = np.zeros(n, dtype=bool)
+        self.max_sample_interval = self._array(1.)
+
+        self.Kp = self._array(P)
+        self.Ki = self._array(I)
+        self.Kd = self._array(D)
+        self.windup_guard = self._array(windup_guard)
+
+        self.SetPoint = np.zeros(n)
+        self.PTerm = np.zeros(n)
+        self.ITerm = np.zeros(n)
+        self.DTerm = np.zeros(n)
+        self.last_error = np.zeros(n)
+        self.output = np.zeros(n)
+        self.last_time = np.zeros(n)
+        self.clear()
+
+    def _array(self, value):
+        return np.array(np.broadcast_to(np.asarray(value, dtype=float), (self.n,)))
+
+    def clear(self, mask=None):
+        """Clears the computations of all the controllers (or of the ones in mask)"""
+        idx = self._indices(mask)
+        with self._lock:
+            for state in (self.PTerm, self.ITerm, self.DTerm, self.last_error, self.output):
+                state[idx] = 0.
+            self.last_time[idx] = self.time_source()
+
+    def _indices(self, mask):
+        #rows selected by mask (boolean mask or indices), all of them if None
+        if mask is None:
+            return slice(None)
+        mask = np.asarray(mask)
+        return np.flatnonzero(mask) if mask.dtype == bool else mask
+
+    def update(self, feedback_values, delta_time=None, mask=None):
+        """Update all the controllers (or only the ones in mask, boolean or indices) with the feedback values
+
+        feedback_values and delta_time are scalars or arrays of length n.
+        delta_time as in PID.update: if None the time since the last update of every controller is taken from
+        the time source and limited to max_update_time (max_sample_interval for the controllers in true interval mode)
+        Returns the outputs of the updated controllers
+        """
+        idx = self._indices(mask)
+        feedback_values = np.broadcast_to(np.asarray(feedback_values, dtype=float), (self.n,))[idx]
+
+        with self._lock:
+            last_time = self.last_time[idx]
+            if delta_time is None:
+                now = self.time_source()
+                max_time = np.where(self.true_interval[idx], self.max_sample_interval[idx], self.max_update_time)
+                delta_time = np.minimum(now - last_time, max_time)
+                current_time = now
+            else:
+                delta_time = np.broadcast_to(np.asarray(delta_time, dtype=float), (self.n,))[idx]
+                current_time = last_time + delta_time
+
+            error = self.SetPoint[idx] - feedback_values
+            delta_error = error - self.last_error[idx]
+
+            PTerm = self.Kp[idx] * error
+            windup_guard = self.windup_guard[idx]
+            ITerm = np.clip(self.ITerm[idx] + error * delta_time, -windup_guard, windup_guard)
+            DTerm = np.divide(delta_error, delta_time, out=np.zeros(len(error)), where=delta_time > 0)
+            output = PTerm + (self.Ki[idx] * ITerm) + (self.Kd[idx] * DTerm)
+
+            self.PTerm[idx] = PTerm
+            self.ITerm[idx] = ITerm
+            self.DTerm[idx] = DTerm
+            self.last_error[idx] = error
+            self.last_time[idx] = current_time
+            self.output[idx] = output
+        return output
+
+    def controller(self, i):
+        """Controller i of the bank, with the interface of PID"""
+        return bankedPID(self, i)
+
+
+class bankedPID:
+    """View on a row of a PIDBank, can be used in place of a PID (e.g. laserWLMLock.pid)"""
+
+    def __init__(self, bank, i):
+        self.bank = bank
+        self.i = i
+        self.fixed_step = None
+        self._index = np.array([i])
+
+    @property
+    def SetPoint(self):
+        return self.bank.SetPoint[self.i]
+
+    @property
+    def output(self):
+        return self.bank.output[self.i]
+
+    @property
+    def ITerm(self):
+        return self.bank.ITerm[self.i]
+
+    @ITerm.setter
+    def ITerm(self, value):
+        self.bank.ITerm[self.i] = value
+
+    @property
+    def Kp(self):
+        return self.bank.Kp[self.i]
+
+    @property
+    def Ki(self):
+        return self.bank.Ki[self.i]
+
+    @property
+    def windup_guard(self):
+        return self.bank.windup_guard[self.i]
+
+    @property
+    def max_update_time(self):
+        return self.bank.max_update_time
+
+    @property
+    def true_interval(self):
+        return self.bank.true_interval[self.i]
+
+    @property
+    def max_sample_interval(self):
+        return self.bank.max_sample_interval[self.i]
+
+    def clear(self):
+        self.bank.clear(self._index)
+        self.bank.SetPoint[self.i] = 0.
+
+    def update(self, feedback_value, delta_time=None):
+        if delta_time is None:
+            delta_time = self.fixed_step
+        return self.bank.update(feedback_value, delta_time, mask=self._index)[0]
+
+    def feedForward(self, delta_output):
+        bank, i = self.bank, self.i
+        with bank._lock:
+            if bank.Ki[i] == 0:
+                return bank.output[i]
+            ITerm = min(max(bank.ITerm[i] + delta_output / bank.Ki[i], -bank.windup_guard[i]), bank.windup_guard[i])
+            bank.output[i] += bank.Ki[i] * (ITerm - bank.ITerm[i])
+            bank.ITerm[i] = ITerm
+            return bank.output[i]
+
+    def change_setpoint(self, setpt):
+        self.bank.SetPoint[self.i] = setpt
+
+    def setKp(self, proportional_gain):
+        self.bank.Kp[self.i] = proportional_gain
+
+    def setKi(self, integral_gain):
+        self.bank.Ki[self.i] = integral_gain
+
+    def setKd(self, derivative_gain):
+        self.bank.Kd[self.i] = derivative_gain
+
+    def setWindup(self, windup):
+        self.bank.windup_guard[self.i] = windup
+
+    def setTrueInterval(self, true_interval, max_sample_interval=1.):
+        self.bank.true_interval[self.i] = true_interval
+        self.bank.max_sample_interval[self.i] = max_sample_interval
+
+    def setFixedStep(self, fixed_step):
+        self.fixed_step = fixed_step
+
+
+def disturbance_from_trace(error_MHz, feedback_V, mhz_per_volt, delay_samples=1):
+    '''
+    free running frequency deviation (MHz) of a recorded lock: the measured error minus the effect of the feedback
+    applied delay_samples readings before (the feedback computed from a reading acts on the next ones)
+    '''
+    error_MHz = np.asarray(error_MHz, dtype=float)
+    feedback_V = np.asarray(feedback_V, dtype=float)
+    applied = np.concatenate([np.zeros(delay_samples), feedback_V[:len(feedback_V)-delay_samples]])
+    return error_MHz - mhz_per_volt*applied
+
+
+def _closed_loop(kp, ki, disturbance_MHz, sample_interval, mhz_per_volt, setpoint_wavelength, \
+                 delay_samples, windup_guard, min_out, max_out, max_update_time):
+    #yields the frequency error (MHz) of all the gain combinations at every reading
+    bank = PIDBank(kp.size, kp.ravel(), ki.ravel(), windup_guard=windup_guard, time_source=lambda: 0.)
+    bank.SetPoint[:] = setpoint_wavelength
+
+    #MHz to nm close to the setpoint
+    nm_per_MHz = -(setpoint_wavelength*1e-9)**2*1e6/SPEED_OF_LIGHT*1e9
+    dt = min(sample_interval, max_update_time)
+
+    #the feedback computed from a reading can only act on the next ones
+    delay_samples = max(delay_samples, 1)
+    applied = [np.zeros(kp.size) for i in range(delay_samples)]
+    for disturbance in np.asarray(disturbance_MHz, dtype=float):
+        error_MHz = disturbance + mhz_per_volt*applied[0]
+        yield error_MHz
+        out = np.clip(bank.update(setpoint_wavelength + nm_per_MHz*error_MHz, dt), min_out, max_out)
+        applied = applied[1:] + [out]
+
+
+def sweep_gains(kp, ki, disturbance_MHz, sample_interval, mhz_per_volt, setpoint_wavelength=1550., \
+                delay_samples=1, windup_guard=0.01, min_out=-10., max_out=10., max_update_time=0.1, settle_samples=0):
+    '''
+    closed loop of all the gain combinations (kp and ki arrays of the same shape) on the same disturbance,
+    one vectorized PIDBank update per wavemeter reading.
+    The error is computed in nm as in laserWLMLock and the time step is limited as in PID
+    returns the rms frequency error (MHz) of every combination, with the shape of kp
+    '''
+    kp = np.asarray(kp, dtype=float)
+    ki = np.asarray(ki, dtype=float)
+    sum_sq = np.zeros(kp.size)
+    loop = _closed_loop(kp, ki, disturbance_MHz, sample_interval, mhz_per_volt, setpoint_wavelength,
+                        delay_samples, windup_guard, min_out, max_out, max_update_time)
+    for k, error_MHz in enumerate(loop):
+        if k >= settle_samples:
+            sum_sq += error_MHz**2
+    n = max(len(disturbance_MHz) - settle_samples, 1)
+    return np.sqrt(sum_sq/n).reshape(kp.shape)
+
+
+def settling_times(kp, ki, step_MHz, n_samples, sample_interval, mhz_per_volt, band=0.05, setpoint_wavelength=1550., \
+                   delay_samples=1, windup_guard=0.01, min_out=-10., max_out=10., max_update_time=0.1):
+    '''
+    response of all the gain combinations to a frequency step of step_MHz
+    returns the settling time (s) of every combination, the time after which the error stays within band*step_MHz,
+    np.inf if it does not settle within n_samples readings
+    '''
+    kp = np.asarray(kp, dtype=float)
+    ki = np.asarray(ki, dtype=float)
+    last_outside = np.zeros(kp.size)
+    loop = _closed_loop(kp, ki, np.full(n_samples, step_MHz), sample_interval, mhz_per_volt, setpoint_wavelength,
+                        delay_samples, windup_guard, min_out, max_out, max_update_time)
+    for k, error_MHz in enumerate(loop):
+        last_outside = np.where(np.abs(error_MHz) > band*abs(step_MHz), k, last_outside)
+    settling = (last_outside + 1)*sample_interval
+    settling[last_outside >= n_samples - 1] = np.inf
+    return settling.reshape(kp.shape)
@@ -10,14 +10,44 @@ All rights reserved.
 
 Driver for a 1xN optical switch from Sercalo
 
+The messages of all the channels are built once, and every reply is read into a preallocated buffer with
+two reads: the header, then exactly the length given by the header, so a short reply (e.g. an error without
+data) does not wait for the timeout of the port. The time of every switch is kept in switch_stats
+(get_switch_stats).
+
+The driver keeps the channel of the switch: set_channel does not send anything if the switch is already on
+the channel. After a fault (no reply, unexpected or incomplete reply, failed checksum, error of the switch)
+the channel is unknown, the input buffer is flushed and the position is read back with get_channel
+(verify_on_fault) before trying again, instead of opening the port again.
+
+set_channel_async sends the switch command from the thread of the switch and returns a
+concurrent.futures.Future with the result of set_channel, so the caller can do something else meanwhile.
+The commands of both threads are serialized by a lock.
+
 '''
 
+import time
+import threading
 import serial
 import logging
-import math
+from concurrent.futures import ThreadPoolExecutor
 
 WRITE_MESSAGE_PRE = b'\xEF\xEF'
 READ_MESSAGE_PRE = b'\xfe\xfe'
+READ_BUFFER_SIZE = 259 #header + largest reply (length on one byte)
+
+
+def _checksum(m):
+    #low byte of the sum of the bytes
+    return sum(m) & 0xFF
+
+def _message(command):
+    m = WRITE_MESSAGE_PRE + command
+    return m + bytes((_checksum(m),))
+
+PRODUCT_INFO_MESSAGE = _message(b'\x03\xFF\x01')
+GET_CHANNEL_MESSAGE = _message(b'\x03\xFF\x02')
+RESET_MESSAGE = _message(b'\x03\xFF\x03')
 
 
 class SercaloSwitch():
@@ -52,15 +82,27 @@ class SercaloSwitch():
         self.com_port = com_port
         self.timeout=timeout
         self.number_of_channels = number_of_channels
+        #message of every channel, index 0 is not a channel
+        self._channel_messages = [None] + [_message(bytes((0x04, 0xFF, 0x04, channel)))
+                                           for channel in range(1, number_of_channels + 1)]
+        self._buffer = bytearray(READ_BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self.retries = 2 #after a fault
+        self.verify_on_fault = True #read the channel back after a fault
+        self.flush_delay = 0.01 #s, for the rest of a bad reply to arrive before flushing
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Sercalo switch')
+        self.clear_switch_stats()
         self.connect()
         
     def connect(self):
         logging.debug(f'Opening com port {self.com_port}')
         self.ser =  serial.Serial(self.com_port,115200, timeout=self.timeout) 
+        self.channel = None #unknown until set or read
+        self.fault_suspected = False
 
     def get_product_info(self):
-        product_info_m = WRITE_MESSAGE_PRE + b'\x03\xFF\x01\xE1'
-        data,_ = self._write_and_read(product_info_m)
+        data,_ = self._write_and_read(PRODUCT_INFO_MESSAGE)
         vendor = data[0:10].decode('ascii').strip(';')
         s_type = data[10:20].decode('ascii').strip(';')
         hw_maj = int(data[21])
@@ -80,66 +122,145 @@ class SercaloSwitch():
                \n s/n {sn}')
 
     def get_channel(self):
-        get_channel_m = WRITE_MESSAGE_PRE + b'\x03\xFF\x02\xE2'
-        data,_ = self._write_and_read(get_channel_m)
-        return int(data[0])
+        #None if the reply is not valid
+        with self._lock:
+            return self._get_channel()
+
+    def _get_channel(self):
+        self.fault_suspected = False
+        ret = self._write_and_read(GET_CHANNEL_MESSAGE)
+        if ret is None or ret[1] != 0 or not ret[0] or self.fault_suspected:
+            self.fault_suspected = True
+            self.channel = None
+            return None
+        self.channel = int(ret[0][0])
+        return self.channel
+
+    def set_channel_async(self,channel):
+        #Future with the result of set_channel
+        return self._executor.submit(self.set_channel, channel)
 
     def set_channel(self,channel):
         channel=int(channel)
         if channel < 1 or channel > self.number_of_channels:
             logging.error(f'Invalid channel {channel}.')
             return
-        ch_m = b'\x04\xFF\x04' + bytes(channel.to_bytes(1,'big'))
-        checksum = self._get_checksum(WRITE_MESSAGE_PRE+ch_m)
-        set_channel_m = WRITE_MESSAGE_PRE + ch_m + bytes(checksum.to_bytes(1,'big'))
-        _,error = self._write_and_read(set_channel_m)
-        return (error == 0)
+        with self._lock:
+            return self._set_channel(channel)
+
+    def _set_channel(self,channel):
+        if channel == self.channel and not self.fault_suspected:
+            self.switch_stats['skipped'] += 1
+            return True
+        st = time.perf_counter()
+        switched = False
+        for i in range(self.retries + 1):
+            self.fault_suspected = False
+            ret = self._write_and_read(self._channel_messages[channel])
+            if ret is not None and ret[1] == 0 and not self.fault_suspected:
+                self.channel = channel
+                switched = True
+                break
+            #the switch may or may not have moved
+            self.channel = None
+            self.fault_suspected = True
+            self.switch_stats['resyncs'] += 1
+            if self.verify_on_fault:
+                if self.resync() == channel:
+                    switched = True
+                    break
+            else:
+                self._flush()
+        if not switched:
+            self.switch_stats['failures'] += 1
+        self._log_switch(time.perf_counter() - st)
+        return switched
+
+    def resync(self):
+        #flush what is left of a bad reply and read the channel back, None if it still fails
+        with self._lock:
+            self._flush()
+            return self._get_channel()
 
     def reset(self):
-        reset_m = WRITE_MESSAGE_PRE + b'\x03\xFF\x03\xE3'
-        _,error = self._write_and_read(reset_m)
-        return (error == 0)
+        self.channel = None
+        ret = self._write_and_read(RESET_MESSAGE)
+        return ret is not None and ret[1] == 0
+
+    def clear_switch_stats(self):
+        self.switch_stats = {'switches' : 0, 'mean_time' : 0., 'max_time' : 0., 'last_time' : None, #s
+                             'skipped' : 0, 'resyncs' : 0, 'failures' : 0}
+
+    def get_switch_stats(self):
+        return dict(self.switch_stats)
+
+    def _log_switch(self, duration):
+        stats = self.switch_stats
+        n = stats['switches'] = stats['switches'] + 1
+        stats['mean_time'] += (duration - stats['mean_time'])/n
+        stats['max_time'] = max(stats['max_time'], duration)
+        stats['last_time'] = duration
 
     def close(self):
+        self.channel = None
         self.ser.close()
 
+    def _flush(self):
+        time.sleep(self.flush_delay)
+        self.ser.reset_input_buffer()
+
     def _write_and_read(self,message):
-        #to send command to the switch as messages
-        if self.ser.is_open:
-            ser=self.ser
-            logging.debug(f'Sending message {message}')
-            ser.write(message)
-
-            r=ser.read(3)
-            if r[:2]==READ_MESSAGE_PRE:
-                ret_size = r[2]
-                ret=ser.read(ret_size)
-                logging.debug(f'Reading {ret_size} bytes')
-            elif r == b'':
-                logging.error('Nothing returned')
-                return None
-            else:
-                logging.error(f'Unexpected return {r} clearing buffer')
-                ret = ser.readline()
-                logging.debug(f'buffer content {ret}')
-                return None
-        else:
+        with self._lock:
+            return self._write_and_read_locked(message)
+
+    def _write_and_read_locked(self,message):
+        #to send command to the switch as messages, the reply is read in self._buffer
+        ser=self.ser
+        if not ser.is_open:
             logging.error('Serial port not open')
+            self.fault_suspected = True
+            return None
+        logging.debug('Sending message %s', message)
+        ser.write(message)
 
-        logging.debug(f'Received message {ret}')
+        #header (with the length of the rest of the reply), then exactly the rest
+        command = message[4]
+        view = self._view
+        n = ser.readinto(view[:3])
+        if n == 0:
+            logging.error('Nothing returned')
+            self.fault_suspected = True
+            return None
+        if n < 3 or view[:2] != READ_MESSAGE_PRE:
+            logging.error('Unexpected return %s clearing buffer', bytes(view[:n]))
+            self._flush()
+            self.fault_suspected = True
+            return None
+        length = 3 + view[2]
+        n += ser.readinto(view[3:length])
+        if n < length or length < 7:
+            logging.error('Incomplete return %s', bytes(view[:n]))
+            self.fault_suspected = True
+            return None
+        if view[4] != command:
+            #reply to another command (e.g. left from a timed out one)
+            logging.error('Unexpected return %s clearing buffer', bytes(view[:n]))
+            self._flush()
+            self.fault_suspected = True
+            return None
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            logging.debug('Received message %s', bytes(view[3:length]))
 
-        address = ret[0]
-        command = ret[1]
-        error = ret[2]
-        data = ret[3:-1]
-        checksum = ret[-1]
+        error = view[5]
+        data = bytes(view[6:length-1])
+        checksum = view[length-1]
 
-        if self._get_checksum(r+ret[:-1]) != checksum:
+        if _checksum(view[:length-1]) != checksum:
             logging.error('Communication error: failed checksum')
-        else:
-            logging.debug('Checksum ok')
+            self.fault_suspected = True
 
-        self._check_error(error)
+        if error:
+            self._check_error(error)
         return data,error
 
 
@@ -155,8 +276,3 @@ class SercaloSwitch():
         elif error == 4:
             logging.error('Device error: Checksum error')
 
-    def _get_checksum(self,m):
-        sum_m = sum(m)
-        min_size = int(math.log(sum_m,2))+2
-        return sum_m.to_bytes(min_size,'big')[-1]
-
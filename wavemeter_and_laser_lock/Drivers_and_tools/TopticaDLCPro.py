@@ -11,24 +11,310 @@ All rights reserved.
 Driver implementing some useful commands for Toptical DLC Pro controllers.
 using the Python builtin Telnet library and some string formatting.
 
+Several commands can be sent at once with ask_many / write_many: they are written back to back on a
+second, persistent connection to the command line (DLCProSession) and the replies are matched in order,
+so reading N parameters costs one round trip instead of N.
+    e.g. state, wavelength = laser.ask_many(['laser1:ctl:state', 'laser1:ctl:wavelength-act'])
+
+The limits of the wavelength, piezo voltage and scan speed do not change for a controller, they are kept
+in a json file (DEFAULT_LIMITS_CACHE, limits_cache = None to not use it) under the serial number and firmware
+version of the controller. Connecting to a known controller only reads these two, the cached limits are
+checked against the controller (validate_limits) by the validators of the parameters (dlcProLimits), before
+the first value is validated.
+
+Parameters can be monitored on the monitoring port of the controller (1999, DLCProMonitor): their changes are
+pushed by the controller, get_laser_state returns the pushed state and wait_for_idle returns as soon as the
+motor is idle, without polling.
+    e.g. laser.subscribe(['laser1:ctl:state', 'laser1:ctl:wavelength-act'])
+A controller whose monitoring port failed once is polled by the following instruments of the same process
+(subscribe(retry=True) tries again), a reconnection does not wait for the timeout of the monitor every time.
+
 Needs to have the qcodes repository cloned (https://github.com/QCoDeS/Qcodes/tree/master/qcodes)
 
 """
 
+import os
+import time
+import socket
+import threading
+
 from qcodes.instrument.base import Instrument, InstrumentBase
 from qcodes.logger.instrument_logger import get_instrument_logger
 from qcodes.utils.validators import Numbers,Enum,MultiType
 
 from .TelnetInstrument import TelnetInstrument
+from .calibration_store import calibrationStore
+
+
+DEFAULT_LIMITS_CACHE = os.path.join(os.path.expanduser('~'), '.laser_lock', 'dlcpro_limits.json')
+
+LIMIT_PARAMETERS = {'wavelength_min' : 'laser1:ctl:wavelength-min',
+                    'wavelength_max' : 'laser1:ctl:wavelength-max',
+                    'piezo_min'      : 'laser1:dl:pc:voltage-min',
+                    'piezo_max'      : 'laser1:dl:pc:voltage-max',
+                    'scan_speed_min' : 'laser1:ctl:scan:speed-min',
+                    'scan_speed_max' : 'laser1:ctl:scan:speed-max'}
+
+#validated parameters and the keys of their limits
+LIMITED_PARAMETERS = {'wavelength'            : ('wavelength_min', 'wavelength_max'),
+                      'piezo_voltage_setting' : ('piezo_min', 'piezo_max'),
+                      'scan_start'            : ('wavelength_min', 'wavelength_max'),
+                      'scan_stop'             : ('wavelength_min', 'wavelength_max'),
+                      'scan_speed'            : ('scan_speed_min', 'scan_speed_max')}
+
+LASER_STATES = {'-100' : "ERROR", \
+                '-8' : "Motor referencing and FLOW initialization in progress", \
+                '-7' : "FLOW initialization in progress", \
+                '-6' : "Motor not referenced, yet", \
+                '-5' : "Motor referencing in progress", \
+                '-4' : "Motor referenced", \
+                '-3' : "Drift compensation in progress", \
+                '-2' : "FLOW optimization in progreress", \
+                '-1' : "SMILE optimization in progreress", \
+                '0'  : "Idle/Stopped", \
+                '1'  : "Target set wavelength is about to be reached", \
+                '2'  : "Starting motor scan", \
+                '3'  : "Scan in progress", \
+                '4'  : "Restarting scan", \
+                '5'  : "Paused", \
+                '6'  : "Remotely controlled"}
+
+STATE_PARAMETER = 'laser1:ctl:state'
+
+
+class DLCProSession():
+    """
+    Persistent connection to the command line of the DLC pro with pipelined commands:
+    all the commands of execute() are sent in one write and the replies, each one terminated
+    by the prompt of the command line, are read back in the same order.
+    """
+    prompt = b'> '
+
+    def __init__(self, address, port=1998, timeout=5.):
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self._sock = None
+        self._buffer = b''
+        self._lock = threading.Lock()
+
+    def connect(self):
+        self._sock = socket.create_connection((self.address, self.port), self.timeout)
+        self._buffer = b''
+        self._read_reply() #welcome message up to the first prompt
+
+    def close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+    def execute(self, commands):
+        """Send the commands back to back, return their replies in the same order"""
+        with self._lock:
+            try:
+                if self._sock is None:
+                    self.connect()
+                self._sock.sendall(('\n'.join(commands) + '\n').encode())
+                replies = [self._read_reply() for cmd in commands]
+            except OSError:
+                #the replies of this batch can not be matched anymore, start again with a new connection
+                self.close()
+                raise
+        #all the replies are read before raising the errors, the next batch starts in sync
+        return [self._parse(cmd, reply) for cmd, reply in zip(commands, replies)]
+
+    def _read_reply(self):
+        #everything up to the next prompt (at the beginning of a line)
+        while True:
+            if self._buffer.startswith(self.prompt):
+                end = 0
+            else:
+                end = self._buffer.find(b'\n' + self.prompt)
+                end = end + 1 if end >= 0 else -1
+            if end >= 0:
+                reply = self._buffer[:end]
+                self._buffer = self._buffer[end + len(self.prompt):]
+                return reply.decode(errors='replace')
+            data = self._sock.recv(4096)
+            if not data:
+                raise ConnectionError('DLC pro closed the connection')
+            self._buffer += data
+
+    @staticmethod
+    def _parse(cmd, reply):
+        lines = [l.strip() for l in reply.strip().splitlines()]
+        #the command line can echo the command before the reply
+        if lines and lines[0] == cmd:
+            lines = lines[1:]
+        value = '\n'.join(lines)
+        if value.startswith('Error'):
+            raise RuntimeError(f'{cmd}: {value}')
+        return value
+
+
+class DLCProMonitor():
+    """
+    Connection to the monitoring port of the DLC pro: the subscribed parameters are pushed by the controller
+    when they change, as lines (timestamp 'name value), and kept with the number of updates received.
+    wait_for() waits for a pushed value instead of polling the parameter.
+    """
+
+    def __init__(self, address, port=1999, timeout=5.):
+        self.address = address
+        self.port = port
+        self.timeout = timeout
+        self.values = {}
+        self.updates = {}
+        self.connected = False
+        self._sock = None
+        self._condition = threading.Condition()
+
+    def connect(self):
+        self._sock = socket.create_connection((self.address, self.port), self.timeout)
+        self._sock.settimeout(None) #the reading thread waits for the pushes
+        self.connected = True
+        threading.Thread(target=self._run, name='DLC pro monitor {}'.format(self.address), daemon=True).start()
+
+    def close(self):
+        self.connected = False
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        with self._condition:
+            self._condition.notify_all()
+
+    def subscribe(self, names, timeout=None):
+        """
+        The controller pushes the current value of every parameter added, wait for them (timeout in s, by default
+        the timeout of the connection) so the values and update counts are valid once subscribed.
+        False if some values did not arrive.
+        """
+        if not self.connected:
+            self.connect()
+        with self._condition:
+            for name in names:
+                self.updates.setdefault(name, 0)
+        self._sock.sendall(''.join("(add '{})\n".format(name) for name in names).encode())
+        timeout = self.timeout if timeout is None else timeout
+        with self._condition:
+            return self._condition.wait_for(lambda: not self.connected or all(self.updates.get(name, 0) > 0 for name in names),
+                                            timeout) and self.connected
+
+    def unsubscribe(self, names):
+        if self.connected:
+            self._sock.sendall(''.join("(remove '{})\n".format(name) for name in names).encode())
+        with self._condition:
+            for name in names:
+                self.updates.pop(name, None)
+                self.values.pop(name, None)
+
+    def get(self, name):
+        with self._condition:
+            return self.values.get(name)
+
+    def update_count(self, name):
+        with self._condition:
+            return self.updates.get(name, 0)
+
+    def wait_for(self, name, condition, timeout, since=None):
+        """
+        Wait until the value of name fulfills condition (and was pushed after update_count() was since),
+        returns the value or None on timeout or if the connection is lost
+        """
+        def done():
+            if not self.connected:
+                return True
+            if since is not None and self.updates.get(name, 0) <= since:
+                return False
+            return name in self.values and condition(self.values[name])
+        with self._condition:
+            if not self._condition.wait_for(done, timeout) or not self.connected:
+                return None
+            return self.values[name]
+
+    def _run(self):
+        buffer = b''
+        try:
+            while True:
+                data = self._sock.recv(4096)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    self._parse(line.decode(errors='replace').strip())
+        except (OSError, AttributeError):
+            pass
+        self.connected = False
+        with self._condition:
+            self._condition.notify_all()
+
+    def _parse(self, line):
+        #(timestamp 'name value), anything else (prompt, replies to add/remove) is ignored
+        if not (line.startswith('(') and line.endswith(')')):
+            return
+        fields = line[1:-1].split(' ', 2)
+        if len(fields) < 3:
+            return
+        name, value = fields[1].strip("'"), fields[2].strip().strip('"')
+        with self._condition:
+            if name in self.updates:
+                self.values[name] = value
+                self.updates[name] += 1
+                self._condition.notify_all()
+
+
+class dlcProLimits(Numbers):
+    """
+    Validator of a parameter with limits of the controller: if the limits come from the cache they are
+    checked against the controller before the first validation (TopticaDLCPro.validate_limits)
+    """
+
+    def __init__(self, instrument, min_key, max_key):
+        self._instrument = instrument
+        self._keys = (min_key, max_key)
+        super().__init__(min_value=instrument.limits[min_key], max_value=instrument.limits[max_key])
+
+    def validate(self, value, context=''):
+        instrument = self._instrument
+        if not instrument._limits_validated:
+            instrument.validate_limits()
+        #the limits of the instrument, they can have been updated since this validator was made
+        Numbers(min_value=instrument.limits[self._keys[0]],
+                max_value=instrument.limits[self._keys[1]]).validate(value, context)
 
 
 class TopticaDLCPro(TelnetInstrument):
+    #(address, monitoring port) of the controllers whose monitoring failed in this process
+    _unmonitored = set()
 
-    def __init__(self, name, address, port=1998, **kwargs):
+    def __init__(self, name, address, port=1998, monitor_port=1999, limits_cache=DEFAULT_LIMITS_CACHE, **kwargs):
         super().__init__(name, address, port, **kwargs)
+        self._address = address
+        self._port = port
+        self._monitor_port = monitor_port
+        self._session = None
+        self._monitor = None
+
+        #static limits of the controller, from the cache if it is known
+        self.limits_cache = calibrationStore(limits_cache)
+        self.serial_number, self.firmware = [v.strip('"') for v in self.ask_many(['serial-number', 'fw-ver'])]
+        self._limits_key = '{} {}'.format(self.serial_number, self.firmware)
+        self.limits = self.limits_cache.get(self._limits_key, 'limits')
+        self._limits_validated = self.limits is None
+        if self.limits is None:
+            self.limits = self._read_limits()
+            self.limits_cache.set(self._limits_key, 'limits', self.limits)
 
-        self.minimum_wavelength = float(self.ask('laser1:ctl:wavelength-min'))
-        self.maximum_wavelength = float(self.ask('laser1:ctl:wavelength-max'))
+        self.minimum_wavelength = self.limits['wavelength_min']
+        self.maximum_wavelength = self.limits['wavelength_max']
 
         self.add_parameter(name='wavelength',
                          label='Laser wavelength setting',
@@ -36,8 +322,7 @@ class TopticaDLCPro(TelnetInstrument):
                          get_cmd='laser1:ctl:wavelength-act',
                          set_cmd='laser1:ctl:wavelength-set {:f}',
                          get_parser=float,
-                         vals=Numbers(min_value=self.minimum_wavelength,
-                                      max_value=self.maximum_wavelength))
+                         vals=dlcProLimits(self, 'wavelength_min', 'wavelength_max'))
 
         self.add_parameter(name='piezo_voltage_setting',
                          label='Set piezo voltage',
@@ -45,8 +330,7 @@ class TopticaDLCPro(TelnetInstrument):
                          get_cmd='laser1:dl:pc:voltage-set',
                          set_cmd='laser1:dl:pc:voltage-set {:f}',
                          get_parser=float,
-                         vals=Numbers(min_value=float(self.ask('laser1:dl:pc:voltage-min')),
-                                      max_value=float(self.ask('laser1:dl:pc:voltage-max'))))
+                         vals=dlcProLimits(self, 'piezo_min', 'piezo_max'))
 
         self.add_parameter(name='piezo_voltage_actual',
                          label='Actual piezo voltage output',
@@ -61,24 +345,21 @@ class TopticaDLCPro(TelnetInstrument):
                          get_cmd='laser1:ctl:scan:wavelength-begin',
                          set_cmd='laser1:ctl:scan:wavelength-begin {:f}',
                          get_parser=float,
-                         vals=Numbers(min_value=self.minimum_wavelength,
-                                      max_value=self.maximum_wavelength))
+                         vals=dlcProLimits(self, 'wavelength_min', 'wavelength_max'))
         self.add_parameter(name='scan_stop',
                          label='Wavelength scan stop',
                          unit='nm',
                          get_cmd='laser1:ctl:scan:wavelength-end',
                          set_cmd='laser1:ctl:scan:wavelength-end {:f}',
                          get_parser=float,
-                         vals=Numbers(min_value=self.minimum_wavelength,
-                                      max_value=self.maximum_wavelength))
+                         vals=dlcProLimits(self, 'wavelength_min', 'wavelength_max'))
         self.add_parameter(name='scan_speed',
                          label='Wavelength scan speed',
                          unit='nm',
                          get_cmd='laser1:ctl:scan:speed',
                          set_cmd='laser1:ctl:scan:speed {:f}',
                          get_parser=float,
-                         vals=Numbers(min_value=float(self.ask('laser1:ctl:scan:speed-min')),
-                                      max_value=float(self.ask('laser1:ctl:scan:speed-max'))))
+                         vals=dlcProLimits(self, 'scan_speed_min', 'scan_speed_max'))
 
 
     def ask_raw(self,cmd):
@@ -89,8 +370,115 @@ class TopticaDLCPro(TelnetInstrument):
         cmd_raw = "(param-set! '{})".format(cmd)
         super().write_raw(cmd_raw)
 
+    @property
+    def session(self):
+        #second connection for the pipelined commands, opened at the first use
+        if self._session is None:
+            self._session = DLCProSession(self._address, self._port)
+        return self._session
+
+    def ask_many(self, cmds):
+        """Values (strings) of several parameters in one round trip"""
+        return self.session.execute(["(param-ref '{})".format(cmd) for cmd in cmds])
+
+    def write_many(self, cmds):
+        """Several settings ('parameter value' as for write) in one round trip, returns the status codes"""
+        return self.session.execute(["(param-set! '{})".format(cmd) for cmd in cmds])
+
+    def get_status(self):
+        """Laser state, actual wavelength and piezo voltage in one round trip"""
+        state, wavelength, voltage = self.ask_many(['laser1:ctl:state', 'laser1:ctl:wavelength-act',
+                                                    'laser1:dl:pc:voltage-act'])
+        return {'state' : state, 'wavelength' : float(wavelength), 'piezo_voltage' : float(voltage)}
+
+    @property
+    def monitor(self):
+        #connection to the monitoring port, opened at the first subscription
+        if self._monitor is None:
+            self._monitor = DLCProMonitor(self._address, self._monitor_port)
+        return self._monitor
+
+    def subscribe(self, names=(STATE_PARAMETER, 'laser1:ctl:wavelength-act'), retry=False):
+        """
+        Have the controller push the changes of these parameters, False if the monitoring port is not available
+        (or was not before, unless retry)
+        """
+        key = (self._address, self._monitor_port)
+        if key in TopticaDLCPro._unmonitored and not retry:
+            return False
+        try:
+            subscribed = self.monitor.subscribe(list(names))
+        except OSError as e:
+            print('WARNING: could not subscribe to the parameters of {}, polling them'.format(self.name))
+            print(e)
+            subscribed = None
+        if subscribed is False:
+            print('WARNING: no values pushed by {} after the subscription, polling them'.format(self.name))
+            self.monitor.unsubscribe(list(names))
+        if not subscribed:
+            TopticaDLCPro._unmonitored.add(key)
+            return False
+        TopticaDLCPro._unmonitored.discard(key)
+        return True
+
+    def is_monitored(self, name):
+        return self._monitor is not None and self._monitor.connected and name in self._monitor.updates
+
+    def wait_for_idle(self, since=None, timeout=5., start_timeout=0.5):
+        """
+        Wait until the motor is idle, since is the monitor.update_count of the state before the command
+        that moves the motor (e.g. a wavelength setting). True when idle, False on timeout.
+        """
+        st = time.time()
+        if self.is_monitored(STATE_PARAMETER):
+            #small moves may never leave the idle state, then there is no push
+            if self.monitor.wait_for(STATE_PARAMETER, lambda value: True, start_timeout, since) is not None:
+                remaining = max(timeout - (time.time() - st), 0.)
+                if self.monitor.wait_for(STATE_PARAMETER, lambda value: value == '0', remaining) is not None:
+                    return True
+                if self.is_monitored(STATE_PARAMETER):
+                    return False
+        #polling, also without a push of the state or if the monitoring line was lost
+        while not self.get_laser_state() == '0':
+            time.sleep(.1)
+            if time.time() - st > timeout:
+                return False
+        return True
+
+    def _read_limits(self):
+        values = self.ask_many(list(LIMIT_PARAMETERS.values()))
+        return {key : float(value) for key, value in zip(LIMIT_PARAMETERS, values)}
+
+    def validate_limits(self):
+        """Check the cached limits against the controller, update them if they changed. True if unchanged"""
+        self._limits_validated = True
+        try:
+            limits = self._read_limits()
+        except (OSError, RuntimeError, ValueError) as e:
+            print('WARNING: could not check the limits of {}, using the cached ones'.format(self.name))
+            print(e)
+            return True
+        if limits == self.limits:
+            return True
+        print('WARNING: the limits of {} changed, updating the cache'.format(self.name))
+        self.limits = limits
+        self.limits_cache.set(self._limits_key, 'limits', limits)
+        self.minimum_wavelength = limits['wavelength_min']
+        self.maximum_wavelength = limits['wavelength_max']
+        #new validators, to show the new limits
+        for param, keys in LIMITED_PARAMETERS.items():
+            self.parameters[param].vals = dlcProLimits(self, *keys)
+        return False
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+        if self._monitor is not None:
+            self._monitor.close()
+        super().close()
+
     def exec(self,cmd):
-        cmd_raw = "(exec '{}".format(cmd)
+        cmd_raw = "(exec '{})".format(cmd)
         super().write_raw(cmd_raw)
 
     def scan_wavelength(self,start=1500,stop=1550,speed= 5.0,extra=1.0):
@@ -102,24 +490,10 @@ class TopticaDLCPro(TelnetInstrument):
         self.exec('laser1:ctl:scan:start')
 
     def get_laser_state(self):
-        self.states = {'-100' : "ERROR", \
-                    '-8' : "Motor referencing and FLOW initialization in progress", \
-                    '-7' : "FLOW initialization in progress", \
-                    '-6' : "Motor not referenced, yet", \
-                    '-5' : "Motor referencing in progress", \
-                    '-4' : "Motor referenced", \
-                    '-3' : "Drift compensation in progress", \
-                    '-2' : "FLOW optimization in progreress", \
-                    '-1' : "SMILE optimization in progreress", \
-                    '0'  : "Idle/Stopped", \
-                    '1'  : "Target set wavelength is about to be reached", \
-                    '2'  : "Starting motor scan", \
-                    '3'  : "Scan in progress", \
-                    '4'  : "Restarting scan", \
-                    '5'  : "Paused", \
-                    '6'  : "Remotely controlled"}
-
-        msg = self.ask_raw('laser1:ctl:state')
+        #pushed by the controller if the state is monitored, description in LASER_STATES
+        if self.is_monitored(STATE_PARAMETER):
+            state = self._monitor.get(STATE_PARAMETER)
+            if state is not None:
+                return state
+        msg = self.ask_raw(STATE_PARAMETER)
         return msg
-        
-
@@ -0,0 +1,317 @@
+"""
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Asyncio client for Toptica DLC pro controllers, with the parameters of TopticaDLCPro (wavelength, piezo
+voltage, scan settings, state), to command several lasers concurrently from one thread: setting the coarse
+wavelength of N lasers takes as long as the slowest one instead of the sum of all of them.
+
+The commands of one call are pipelined on the command line (port 1998), the state is pushed by the monitoring
+line (port 1999) so waiting for the motor does not poll the controller. Does not need qcodes.
+
+    example of usage:
+        async def retune():
+            lasers = [AsyncDLCPro('CTL1', '192.168.1.XXX'), AsyncDLCPro('CTL2', '192.168.1.YYY')]
+            await asyncio.gather(*[laser.connect() for laser in lasers])
+            results = await set_wavelengths_coarse(lasers, [1550.1, 1551.2])
+            await asyncio.gather(*[laser.close() for laser in lasers])
+        asyncio.run(retune())
+
+    or from blocking code:
+        run_coarse_settings({'192.168.1.XXX' : 1550.1, '192.168.1.YYY' : 1551.2})
+
+"""
+
+import asyncio
+
+
+PROMPT = b'> '
+STATE_PARAMETER = 'laser1:ctl:state'
+LIMIT_PARAMETERS = {'wavelength_min' : 'laser1:ctl:wavelength-min',
+                    'wavelength_max' : 'laser1:ctl:wavelength-max',
+                    'piezo_min'      : 'laser1:dl:pc:voltage-min',
+                    'piezo_max'      : 'laser1:dl:pc:voltage-max',
+                    'scan_speed_min' : 'laser1:ctl:scan:speed-min',
+                    'scan_speed_max' : 'laser1:ctl:scan:speed-max'}
+
+
+class AsyncDLCPro():
+
+    def __init__(self, name, address, port=1998, monitor_port=1999, timeout=5., monitor=True):
+        self.name = name
+        self.address = address
+        self.port = port
+        self.monitor_port = monitor_port
+        self.timeout = timeout
+        self.use_monitor = monitor
+        self.limits = None
+        self.values = {} #parameters pushed by the monitoring line
+
+        self._reader = self._writer = None
+        self._monitor_reader = self._monitor_writer = None
+        self._monitor_task = None
+        self._lock = None
+        self._condition = None
+        self._updates = {}
+
+    async def connect(self):
+        self._lock = asyncio.Lock()
+        self._condition = asyncio.Condition()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port), self.timeout)
+        await self._read_reply() #welcome message up to the first prompt
+        values = await self.ask_many(list(LIMIT_PARAMETERS.values()))
+        self.limits = {key : float(value) for key, value in zip(LIMIT_PARAMETERS, values)}
+        if self.use_monitor:
+            try:
+                await self.subscribe([STATE_PARAMETER, 'laser1:ctl:wavelength-act'])
+            except (OSError, asyncio.TimeoutError) as e:
+                print('WARNING: no monitoring line for {}, polling the state'.format(self.name))
+                print(e)
+
+    async def close(self):
+        await self._close_monitor()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
+        self._writer = None
+
+    async def _close_monitor(self):
+        if self._monitor_task is not None:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        if self._monitor_writer is not None:
+            self._monitor_writer.close()
+            try:
+                await self._monitor_writer.wait_closed()
+            except OSError:
+                pass
+        self._monitor_writer = None
+        self._updates = {}
+        self.values = {}
+
+    #--------COMMAND LINE----------
+    async def execute(self, commands):
+        """Send the commands back to back, return their replies in the same order"""
+        async with self._lock:
+            try:
+                self._writer.write(('\n'.join(commands) + '\n').encode())
+                await self._writer.drain()
+                replies = [await asyncio.wait_for(self._read_reply(), self.timeout) for cmd in commands]
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                #the replies can not be matched anymore
+                await self.close()
+                raise
+        return [self._parse(cmd, reply) for cmd, reply in zip(commands, replies)]
+
+    async def _read_reply(self):
+        reply = await self._reader.readuntil(b'\n' + PROMPT)
+        return reply[:-len(PROMPT)].decode(errors='replace')
+
+    @staticmethod
+    def _parse(cmd, reply):
+        lines = [l.strip() for l in reply.strip().splitlines()]
+        #the command line can echo the command before the reply
+        if lines and lines[0] == cmd:
+            lines = lines[1:]
+        value = '\n'.join(lines)
+        if value.startswith('Error'):
+            raise RuntimeError('{}: {}'.format(cmd, value))
+        return value
+
+    async def ask_many(self, params):
+        return await self.execute(["(param-ref '{})".format(param) for param in params])
+
+    async def write_many(self, settings):
+        """settings: list of (parameter, value)"""
+        return await self.execute(["(param-set! '{} {})".format(param, self._format(value))
+                                   for param, value in settings])
+
+    async def ask(self, param):
+        return (await self.ask_many([param]))[0]
+
+    async def write(self, param, value):
+        return (await self.write_many([(param, value)]))[0]
+
+    async def exec(self, cmd):
+        return (await self.execute(["(exec '{})".format(cmd)]))[0]
+
+    @staticmethod
+    def _format(value):
+        if isinstance(value, bool):
+            return '#t' if value else '#f'
+        return '{:f}'.format(value) if isinstance(value, float) else str(value)
+
+    def _check(self, value, low, high):
+        if self.limits is not None and not self.limits[low] <= value <= self.limits[high]:
+            raise ValueError('{}: {} is outside [{}, {}]'.format(self.name, value, self.limits[low], self.limits[high]))
+
+    #--------PARAMETERS----------
+    async def get_wavelength(self):
+        return float(await self.ask('laser1:ctl:wavelength-act'))
+
+    async def set_wavelength(self, wavelength):
+        self._check(wavelength, 'wavelength_min', 'wavelength_max')
+        return await self.write('laser1:ctl:wavelength-set', float(wavelength))
+
+    async def get_piezo_voltage_setting(self):
+        return float(await self.ask('laser1:dl:pc:voltage-set'))
+
+    async def set_piezo_voltage(self, voltage):
+        self._check(voltage, 'piezo_min', 'piezo_max')
+        return await self.write('laser1:dl:pc:voltage-set', float(voltage))
+
+    async def get_piezo_voltage_actual(self):
+        return float(await self.ask('laser1:dl:pc:voltage-act'))
+
+    async def get_scan_settings(self):
+        start, stop, speed = await self.ask_many(['laser1:ctl:scan:wavelength-begin', 'laser1:ctl:scan:wavelength-end',
+                                                  'laser1:ctl:scan:speed'])
+        return {'start' : float(start), 'stop' : float(stop), 'speed' : float(speed)}
+
+    async def set_scan_settings(self, start, stop, speed):
+        for wavelength in (start, stop):
+            self._check(wavelength, 'wavelength_min', 'wavelength_max')
+        self._check(speed, 'scan_speed_min', 'scan_speed_max')
+        return await self.write_many([('laser1:ctl:scan:wavelength-begin', float(start)),
+                                      ('laser1:ctl:scan:wavelength-end', float(stop)),
+                                      ('laser1:ctl:scan:speed', float(speed))])
+
+    async def scan_wavelength(self, start=1500, stop=1550, speed=5.0, extra=1.0):
+        await self.set_scan_settings(start, stop, speed)
+        await self.write_many([('laser1:ctl:scan:trigger:output-enabled', True),
+                               ('laser1:ctl:scan:trigger:output-threshold', float(start + extra))])
+        return await self.exec('laser1:ctl:scan:start')
+
+    async def get_laser_state(self):
+        #pushed by the controller if the state is monitored, description in TopticaDLCPro.LASER_STATES
+        if self._monitor_task is not None and STATE_PARAMETER in self.values:
+            return self.values[STATE_PARAMETER]
+        return await self.ask(STATE_PARAMETER)
+
+    #--------MONITORING LINE----------
+    async def subscribe(self, names):
+        """
+        Returns once the controller pushed the current value of every parameter, so the values and update
+        counts are valid. The monitoring line is closed and asyncio.TimeoutError raised if they do not arrive
+        """
+        if self._monitor_writer is None:
+            self._monitor_reader, self._monitor_writer = await asyncio.wait_for(
+                asyncio.open_connection(self.address, self.monitor_port), self.timeout)
+            self._monitor_task = asyncio.ensure_future(self._monitor())
+        for name in names:
+            self._updates.setdefault(name, 0)
+        self._monitor_writer.write(''.join("(add '{})\n".format(name) for name in names).encode())
+        await self._monitor_writer.drain()
+        def pushed():
+            return self._monitor_task is None or all(self._updates.get(name, 0) > 0 for name in names)
+        try:
+            async with self._condition:
+                await asyncio.wait_for(self._condition.wait_for(pushed), self.timeout)
+            if self._monitor_task is None:
+                raise asyncio.TimeoutError('monitoring line closed')
+        except asyncio.TimeoutError:
+            await self._close_monitor()
+            raise
+
+    async def _monitor(self):
+        try:
+            while True:
+                line = (await self._monitor_reader.readline()).decode(errors='replace').strip()
+                if not line:
+                    if self._monitor_reader.at_eof():
+                        break
+                    continue
+                #(timestamp 'name value), anything else is ignored
+                if not (line.startswith('(') and line.endswith(')')):
+                    continue
+                fields = line[1:-1].split(' ', 2)
+                if len(fields) < 3 or fields[1].strip("'") not in self._updates:
+                    continue
+                name = fields[1].strip("'")
+                async with self._condition:
+                    self.values[name] = fields[2].strip().strip('"')
+                    self._updates[name] += 1
+                    self._condition.notify_all()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        self._monitor_task = None
+        async with self._condition:
+            self._condition.notify_all()
+
+    async def _wait_for(self, name, condition, timeout, since=None):
+        def done():
+            if self._monitor_task is None:
+                return True
+            if since is not None and self._updates.get(name, 0) <= since:
+                return False
+            return name in self.values and condition(self.values[name])
+        try:
+            async with self._condition:
+                await asyncio.wait_for(self._condition.wait_for(done), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return self.values.get(name) if self._monitor_task is not None else None
+
+    async def wait_for_idle(self, since=None, timeout=5., start_timeout=0.5):
+        """Wait until the motor is idle (see TopticaDLCPro.wait_for_idle), True when idle, False on timeout"""
+        loop = asyncio.get_event_loop()
+        st = loop.time()
+        if self._monitor_task is not None:
+            #small moves may never leave the idle state, then there is no push
+            if await self._wait_for(STATE_PARAMETER, lambda value: True, start_timeout, since) is not None:
+                remaining = max(timeout - (loop.time() - st), 0.)
+                if await self._wait_for(STATE_PARAMETER, lambda value: value == '0', remaining) is not None:
+                    return True
+                if self._monitor_task is not None:
+                    return False
+        #polling, also without a push of the state or if the monitoring line was lost
+        while not await self.get_laser_state() == '0':
+            await asyncio.sleep(.1)
+            if loop.time() - st > timeout:
+                return False
+        return True
+
+    async def set_wavelength_coarse(self, wavelength, piezo_offset=70., timeout=5.):
+        """Same as lockTopticaCTL.set_wavelength_coarse: 1 once the motor is idle at the wavelength, -1 on timeout"""
+        await self.set_piezo_voltage(piezo_offset)
+        since = self._updates.get(STATE_PARAMETER, 0)
+        await self.set_wavelength(wavelength)
+        if not await self.wait_for_idle(since, timeout):
+            return -1
+        return 1
+
+
+async def set_wavelengths_coarse(lasers, wavelengths, piezo_offset=70., timeout=5.):
+    """Coarse setting of all the lasers at once, returns the result of every laser (1, -1 or the exception)"""
+    return await asyncio.gather(*[laser.set_wavelength_coarse(wavelength, piezo_offset, timeout)
+                                  for laser, wavelength in zip(lasers, wavelengths)], return_exceptions=True)
+
+
+def run_coarse_settings(targets, piezo_offset=70., timeout=5., **kwargs):
+    """
+    Blocking coarse setting of several lasers, targets: {address : wavelength}, kwargs of AsyncDLCPro.
+    Returns {address : result}
+    """
+    async def run():
+        lasers = [AsyncDLCPro(address, address, **kwargs) for address in targets]
+        connected = await asyncio.gather(*[laser.connect() for laser in lasers], return_exceptions=True)
+        results = {}
+        try:
+            ready = [(laser, targets[laser.address]) for laser, c in zip(lasers, connected) if c is None]
+            done = await set_wavelengths_coarse([l for l, w in ready], [w for l, w in ready], piezo_offset, timeout)
+            results = {laser.address : result for (laser, w), result in zip(ready, done)}
+        finally:
+            await asyncio.gather(*[laser.close() for laser in lasers], return_exceptions=True)
+        results.update({laser.address : c for laser, c in zip(lasers, connected) if c is not None})
+        return results
+    return asyncio.run(run())
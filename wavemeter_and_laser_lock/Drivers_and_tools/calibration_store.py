@@ -0,0 +1,113 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Persistent store for the calibrations of the lasers (coarse tuning, PID gains, piezo response ...),
+kept across sessions in a json file, one entry per laser.
+
+    example of usage:
+        store = calibrationStore()    #default file ~/.laser_lock/calibration.json
+        store.set('CTL2', 'pid_gains', {'pid_p' : 0., 'pid_i' : -1000.})
+        store.get('CTL2', 'pid_gains')
+
+    With path = None the calibrations are only kept in memory (e.g. in simulations).
+
+Several stores can use the same file (e.g. one laser_lock.py per laser): save re-reads the file under a
+file lock and only replaces the entries set in this store, so the calibrations of the other lasers are kept.
+
+'''
+
+import os
+import json
+import threading
+import contextlib
+try:
+    import fcntl
+except ImportError: #windows
+    fcntl = None
+    import msvcrt
+
+
+DEFAULT_CALIBRATION_FILE = os.path.join(os.path.expanduser('~'), '.laser_lock', 'calibration.json')
+
+
+class calibrationStore():
+    def __init__(self, path = DEFAULT_CALIBRATION_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._changed = set() #(name, key) set since the last save
+        self.data = {}
+        self.load()
+
+    def load(self):
+        if self.path is None:
+            return
+        self.data = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            print(f'WARNING: could not read calibration file {self.path}, starting from scratch')
+            print(e)
+            return {}
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        #lock between the processes using the same file
+        with open(self.path + '.lock', 'a+') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+                else:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def save(self):
+        #write to a temporary file first, so a crash never leaves a half written file
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._changed:
+                return
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with self._file_lock():
+                #merge with the file, the entries saved meanwhile by other stores are kept
+                data = self._read()
+                for name, key in self._changed:
+                    data.setdefault(name, {})[key] = self.data[name][key]
+                tmp_path = self.path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f, indent=1)
+                os.replace(tmp_path, self.path)
+            self.data = data
+            self._changed.clear()
+
+    def get(self, name, key, default = None):
+        with self._lock:
+            return self.data.get(name, {}).get(key, default)
+
+    def set(self, name, key, value, save = True):
+        with self._lock:
+            self.data.setdefault(name, {})[key] = value
+            self._changed.add((name, key))
+        if save:
+            self.save()
@@ -0,0 +1,56 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Model of the coarse tuning of a laser, used in laserWLMLock.set_coarse_wavelength.
+
+Every coarse setting records the pairs (commanded wavelength, measured wavelength) in the
+calibrationStore, so the pairs are kept across sessions (saved with save() once the setting is done). The offset between the measured and
+the commanded wavelength is fitted (linear in the commanded wavelength if the points cover a
+large enough range, otherwise the mean of the last offsets) to predict the wavelength to
+command to reach a given setpoint.
+
+'''
+
+import numpy as np
+
+
+class coarseTuningModel():
+    def __init__(self, store, laser_name, max_points = 100, min_fit_span = 1.):
+        self.store = store
+        self.laser_name = laser_name
+        self.max_points = max_points
+        self.min_fit_span = min_fit_span #nm, range of commanded wavelengths needed for a linear fit
+        self.n_recent = 5 #number of last points used for the offset if no fit is possible
+
+        self.points = [list(p) for p in self.store.get(laser_name, 'coarse_tuning', [])]
+
+    def add_point(self, commanded_wavelength, measured_wavelength):
+        self.points.append([float(commanded_wavelength), float(measured_wavelength)])
+        self.points = self.points[-self.max_points:]
+        self.store.set(self.laser_name, 'coarse_tuning', self.points, save = False)
+
+    def save(self):
+        self.store.save()
+
+    def predict_offset(self, commanded_wavelength):
+        #expected measured - commanded wavelength
+        if len(self.points) == 0:
+            return 0.
+        points = np.array(self.points)
+        offsets = points[:,1] - points[:,0]
+        if len(points) >= 3 and np.ptp(points[:,0]) > self.min_fit_span:
+            slope, intercept = np.polyfit(points[:,0], offsets, 1)
+            return slope*commanded_wavelength + intercept
+        return np.mean(offsets[-self.n_recent:])
+
+    def predict_command(self, setpoint):
+        #wavelength to command to have setpoint on the wavemeter, one fixed point iteration is enough as the offset changes slowly
+        command = setpoint - self.predict_offset(setpoint)
+        return setpoint - self.predict_offset(command)
@@ -0,0 +1,328 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Local emulator of a Toptica DLC pro with a CTL, to run TopticaDLCPro and lockTopticaCTL without a controller
+on the network (tests, benchmarks of the telnet driver and of the lock loops).
+
+    - command line (port, 1998 by default): param-ref, param-set! and exec of the ctl, scan and pc parameters
+      used by the driver, one reply per command terminated by the prompt
+    - monitoring line (monitor_port, 1999 by default): (add 'name) / (remove 'name), the subscribed parameters
+      are pushed as (timestamp 'name value) when they change
+    - motor: a wavelength setting moves the motor at motor_speed (nm/s) after motor_settle_time, the state is 1
+      during the move and 0 once the wavelength is reached (with a coarse error of coarse_error MHz rms);
+      laser1:ctl:scan:start scans from wavelength-begin to wavelength-end at the scan speed (state 2 then 3)
+    - piezo: the actual wavelength moves by piezo_mhz_per_volt with the piezo voltage (from piezo_offset V)
+    - latency: every packet received waits latency (s) before the replies, every command command_time (s),
+      so pipelined commands pay the latency once
+
+    example of usage:
+        emulator = dlcProEmulator(latency = 0.005)
+        emulator.start()
+        laser = TopticaDLCPro('CTL', '127.0.0.1', port = emulator.port, monitor_port = emulator.monitor_port,
+                              limits_cache = None)
+        ...
+        emulator.stop()
+
+    Run the file to have an emulator listening on the ports of a real controller.
+
+'''
+
+import time
+import random
+import threading
+import socketserver
+
+
+SPEED_OF_LIGHT = 299792458
+
+READ_ONLY = ('serial-number', 'fw-ver', 'laser1:ctl:state', 'laser1:ctl:wavelength-act',
+             'laser1:ctl:wavelength-min', 'laser1:ctl:wavelength-max', 'laser1:dl:pc:voltage-act',
+             'laser1:dl:pc:voltage-min', 'laser1:dl:pc:voltage-max', 'laser1:ctl:scan:speed-min',
+             'laser1:ctl:scan:speed-max')
+
+PROMPT = '> '
+
+
+class _commandLineHandler(socketserver.BaseRequestHandler):
+    banner = 'DeCoF Command Line\n'
+
+    def handle(self):
+        emulator = self.server.emulator
+        self.request.sendall((self.banner + PROMPT).encode())
+        buffer = b''
+        while emulator.running:
+            try:
+                data = self.request.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            time.sleep(emulator.latency)
+            replies = []
+            for line in lines:
+                command = line.decode(errors = 'replace').strip()
+                if command:
+                    replies.append(self.reply(emulator, command))
+            if replies:
+                self.request.sendall(''.join(replies).encode())
+
+    def reply(self, emulator, command):
+        time.sleep(emulator.command_time)
+        echo = command + '\n' if emulator.echo else ''
+        return echo + emulator.execute(command) + '\n' + PROMPT
+
+
+class _monitoringLineHandler(_commandLineHandler):
+    banner = 'DeCoF Monitoring Line\n'
+
+    def setup(self):
+        self.subscriptions = set()
+        self.server.emulator._add_monitor(self)
+
+    def finish(self):
+        self.server.emulator._remove_monitor(self)
+
+    def reply(self, emulator, command):
+        name = command[1:-1].split(' ', 1)[-1].strip("'") if command.startswith('(') else ''
+        if command.startswith('(add '):
+            if name not in emulator.params:
+                return 'Error: -1 unknown parameter\n'
+            self.subscriptions.add(name)
+            value = emulator.get(name)
+            emulator._pushed[(id(self), name)] = value
+            return '0\n' + emulator._push_line(name, value)
+        if command.startswith('(remove '):
+            self.subscriptions.discard(name)
+            return '0\n'
+        return 'Error: -2 unknown command\n'
+
+    def push(self, lines):
+        try:
+            self.request.sendall(''.join(lines).encode())
+        except OSError:
+            pass
+
+
+class _server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class dlcProEmulator():
+    def __init__(self, host = '127.0.0.1', port = 1998, monitor_port = 1999, latency = 0., command_time = 0., \
+                 echo = False, wavelength = 1550., motor_speed = 10., motor_settle_time = 0.5, coarse_error = 50., \
+                 piezo_mhz_per_volt = 100., piezo_offset = 70., serial_number = 'EMU-0001', firmware = '2.5.0', \
+                 tick = 0.01, seed = None):
+        self.host = host
+        self.port = port
+        self.monitor_port = monitor_port
+        self.latency = latency #s, per packet received
+        self.command_time = command_time #s, per command
+        self.echo = echo #the command line repeats the command before the reply
+        self.motor_speed = motor_speed #nm/s
+        self.motor_settle_time = motor_settle_time #s, before the motor moves
+        self.coarse_error = coarse_error #MHz rms, error of the motor position
+        self.piezo_mhz_per_volt = piezo_mhz_per_volt
+        self.piezo_offset = piezo_offset #V, piezo voltage without wavelength shift
+        self.tick = tick #s, update of the motor and of the pushed parameters
+        self.rng = random.Random(seed)
+        self.running = False
+        self.commands = 0
+
+        self._lock = threading.RLock()
+        self._monitors = []
+        self._servers = []
+        self.params = {'serial-number'                          : '"{}"'.format(serial_number),
+                       'fw-ver'                                 : '"{}"'.format(firmware),
+                       'laser1:ctl:state'                       : '0',
+                       'laser1:ctl:wavelength-set'              : wavelength,
+                       'laser1:ctl:wavelength-act'              : wavelength,
+                       'laser1:ctl:wavelength-min'              : 1460.,
+                       'laser1:ctl:wavelength-max'              : 1570.,
+                       'laser1:dl:pc:voltage-set'               : piezo_offset,
+                       'laser1:dl:pc:voltage-act'               : piezo_offset,
+                       'laser1:dl:pc:voltage-min'               : 0.,
+                       'laser1:dl:pc:voltage-max'               : 140.,
+                       'laser1:ctl:scan:wavelength-begin'       : 1500.,
+                       'laser1:ctl:scan:wavelength-end'         : 1550.,
+                       'laser1:ctl:scan:speed'                  : 5.,
+                       'laser1:ctl:scan:speed-min'              : 0.001,
+                       'laser1:ctl:scan:speed-max'              : 200.,
+                       'laser1:ctl:scan:trigger:output-enabled' : '#f',
+                       'laser1:ctl:scan:trigger:output-threshold' : 1500.}
+        self.motor_wavelength = wavelength #nm, position of the motor
+        self.motor_error = 0. #nm
+        self.motion = None #(start time, start wavelength, end wavelength, speed, state while moving, next motion)
+        self._pushed = {}
+
+    #--------SERVERS----------
+    def start(self):
+        self.running = True
+        for attr, handler in (('port', _commandLineHandler), ('monitor_port', _monitoringLineHandler)):
+            server = _server((self.host, getattr(self, attr)), handler)
+            server.emulator = self
+            setattr(self, attr, server.server_address[1]) #port 0: any free port
+            threading.Thread(target = server.serve_forever, daemon = True).start()
+            self._servers.append(server)
+        threading.Thread(target = self._run, name = 'DLC pro emulator', daemon = True).start()
+
+    def stop(self):
+        self.running = False
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def _add_monitor(self, handler):
+        with self._lock:
+            self._monitors.append(handler)
+
+    def _remove_monitor(self, handler):
+        with self._lock:
+            if handler in self._monitors:
+                self._monitors.remove(handler)
+
+    #--------PROTOCOL----------
+    def execute(self, command):
+        self.commands += 1
+        if not (command.startswith('(') and command.endswith(')')):
+            return 'Error: -2 parse error'
+        fields = command[1:-1].split(' ', 2)
+        if len(fields) < 2 or not fields[1].startswith("'"):
+            return 'Error: -2 parse error'
+        name = fields[1][1:]
+        with self._lock:
+            if fields[0] == 'param-ref':
+                if name not in self.params:
+                    return 'Error: -1 unknown parameter'
+                return self._format(self.get(name))
+            if fields[0] == 'param-set!':
+                if len(fields) < 3:
+                    return 'Error: -2 parse error'
+                return self.set(name, fields[2].strip())
+            if fields[0] == 'exec':
+                return self.exec(name)
+        return 'Error: -2 unknown command'
+
+    @staticmethod
+    def _format(value):
+        return '{:f}'.format(value) if isinstance(value, float) else str(value)
+
+    def _push_line(self, name, value):
+        return "({} '{} {})\n".format(int(time.time()*1000), name, self._format(value))
+
+    def get(self, name):
+        with self._lock:
+            self._update(time.monotonic())
+            return self.params[name]
+
+    def set(self, name, value):
+        if name not in self.params:
+            return 'Error: -1 unknown parameter'
+        if name in READ_ONLY:
+            return 'Error: -6 parameter is read-only'
+        if isinstance(self.params[name], float):
+            try:
+                value = float(value)
+            except ValueError:
+                return 'Error: -3 wrong type'
+        if name == 'laser1:ctl:wavelength-set':
+            if not self.params['laser1:ctl:wavelength-min'] <= value <= self.params['laser1:ctl:wavelength-max']:
+                return 'Error: -7 value out of range'
+            self._move(value)
+        elif name == 'laser1:dl:pc:voltage-set':
+            if not self.params['laser1:dl:pc:voltage-min'] <= value <= self.params['laser1:dl:pc:voltage-max']:
+                return 'Error: -7 value out of range'
+            self.params['laser1:dl:pc:voltage-act'] = value
+        self.params[name] = value
+        self._update(time.monotonic())
+        return '0'
+
+    def exec(self, name):
+        if name == 'laser1:ctl:scan:start':
+            begin = self.params['laser1:ctl:scan:wavelength-begin']
+            end = self.params['laser1:ctl:scan:wavelength-end']
+            scan = (None, begin, end, self.params['laser1:ctl:scan:speed'], '3', None)
+            self._move(begin, state = '2', then = scan)
+        elif name == 'laser1:ctl:scan:stop':
+            self._update(time.monotonic())
+            self.motion = None
+            self.params['laser1:ctl:state'] = '0'
+        else:
+            return 'Error: -1 unknown command'
+        return '()'
+
+    #--------LASER----------
+    def _move(self, target, state = '1', then = None):
+        self._update(time.monotonic())
+        self.motor_error = self.rng.gauss(0., self.coarse_error)*(target*1e-9)**2/SPEED_OF_LIGHT*1e15 #nm
+        start = time.monotonic() + self.motor_settle_time
+        self.motion = (start, self.motor_wavelength, target, self.motor_speed, state, then)
+        self.params['laser1:ctl:state'] = state
+
+    def _update(self, now):
+        #position of the motor and actual wavelength at time now
+        while self.motion is not None:
+            start, begin, end, speed, state, then = self.motion
+            self.params['laser1:ctl:state'] = state
+            if now < start:
+                break
+            duration = abs(end - begin)/speed
+            if now - start < duration:
+                self.motor_wavelength = begin + (end - begin)*(now - start)/duration
+                break
+            self.motor_wavelength = end
+            if then is not None:
+                #next part of the motion (the scan itself) starts when this one ends
+                then = (start + duration,) + then[1:]
+            self.motion = then
+            if then is None:
+                self.params['laser1:ctl:state'] = '0'
+        error = self.motor_error if self.motion is None else 0.
+        wavelength = self.motor_wavelength + error
+        shift = self.piezo_mhz_per_volt*(self.params['laser1:dl:pc:voltage-act'] - self.piezo_offset) #MHz
+        frequency = SPEED_OF_LIGHT/(wavelength*1e-9)/1e6 + shift
+        self.params['laser1:ctl:wavelength-act'] = SPEED_OF_LIGHT/(frequency*1e6)*1e9
+
+    def wavelength(self):
+        #actual wavelength (nm), e.g. for a simulated wavemeter
+        return self.get('laser1:ctl:wavelength-act')
+
+    def _run(self):
+        #push the changes of the subscribed parameters
+        while self.running:
+            with self._lock:
+                self._update(time.monotonic())
+                monitors = list(self._monitors)
+                values = dict(self.params)
+            for handler in monitors:
+                lines = []
+                for name in list(handler.subscriptions):
+                    key = (id(handler), name)
+                    if self._pushed.get(key) != values[name]:
+                        self._pushed[key] = values[name]
+                        lines.append(self._push_line(name, values[name]))
+                if lines:
+                    handler.push(lines)
+            time.sleep(self.tick)
+
+
+if __name__ == '__main__':
+    #run the file to have an emulated controller on this machine
+    host = '127.0.0.1'
+    latency = 0.002    #s, round trip of the network to emulate
+
+    emulator = dlcProEmulator(host = host, latency = latency)
+    emulator.start()
+    print(f'DLC pro emulator on {host}, command line port {emulator.port}, monitoring port {emulator.monitor_port}')
+    while True:
+        time.sleep(1.)
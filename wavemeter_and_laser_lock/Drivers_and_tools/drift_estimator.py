@@ -0,0 +1,101 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Kalman filter of the frequency drift of a laser, used in laserWLMLock to correct the drift between the
+wavemeter slots (see laserWLMLock.enable_estimator).
+
+The state is the free running frequency offset of the laser from the setpoint (MHz, without the feedback)
+and its drift rate (MHz/s), both random walks. Every wavemeter reading measures the offset as the
+frequency error minus the known piezo response (mhz_per_volt*feedback). Between the readings the
+filter predicts the drift and feed_forward gives the feedback change (V) that cancels it, applied at
+the rate of the lock instead of the rate of the wavemeter slots.
+
+    example of usage:
+        kf = driftKalmanFilter(mhz_per_volt = 400.)
+        kf.update(t, error_MHz, feedback)            #at every new reading
+        feedback += kf.feed_forward(t)               #between the readings
+
+'''
+
+import numpy as np
+
+
+class driftKalmanFilter():
+    def __init__(self, mhz_per_volt, reading_noise = 2., drift_noise = 2., drift_rate_noise = 0.05, \
+                 max_feed_forward = 50.):
+        self.mhz_per_volt = mhz_per_volt #piezo response of the laser, MHz/V
+        self.reading_noise = reading_noise #MHz, standard deviation of a reading
+        self.drift_noise = drift_noise #MHz/sqrt(s), random walk of the frequency
+        self.drift_rate_noise = drift_rate_noise #MHz/s/sqrt(s), random walk of the drift rate
+        self.max_feed_forward = max_feed_forward #MHz, largest correction between two readings
+        self.initialized = False
+        self.reset()
+
+    def reset(self, keep_rate = False):
+        #restart the filter, keep_rate to only forget the offset (e.g. after a setpoint change)
+        if keep_rate and self.initialized:
+            self.x = np.array([0., self.x[1]])
+            self.P = np.diag([1e6, self.P[1, 1]])
+        else:
+            self.x = np.zeros(2)
+            self.P = np.diag([1e6, 1.])
+        self.initialized = False
+        self.last_time = None
+        self.feed_forward_time = None
+        self.feed_forward_MHz = 0.
+
+    @property
+    def drift_rate(self):
+        return self.x[1]
+
+    def _predict(self, t):
+        #state and covariance propagated to time t
+        dt = max(t - self.last_time, 0.)
+        F = np.array([[1., dt], [0., 1.]])
+        Q = np.diag([self.drift_noise**2*dt, self.drift_rate_noise**2*dt])
+        return F @ self.x, F @ self.P @ F.T + Q
+
+    def predict(self, t):
+        #predicted free running offset (MHz) at time t
+        if not self.initialized:
+            return None
+        return self._predict(t)[0][0]
+
+    def update(self, t, error_MHz, feedback):
+        '''
+        new reading at time t: frequency error from the setpoint (MHz) with the feedback (V) acting on the laser
+        '''
+        offset = error_MHz - self.mhz_per_volt*feedback
+        if not self.initialized:
+            self.x = np.array([offset, self.x[1]])
+            self.P[0, 0] = self.reading_noise**2
+            self.initialized = True
+        else:
+            x, P = self._predict(t)
+            S = P[0, 0] + self.reading_noise**2
+            K = P[:, 0]/S
+            self.x = x + K*(offset - x[0])
+            self.P = P - np.outer(K, P[0, :])
+        self.last_time = t
+        self.feed_forward_time = t
+        self.feed_forward_MHz = 0.
+
+    def feed_forward(self, t):
+        '''
+        feedback change (V) that cancels the drift predicted since the last call (or the last reading),
+        0 before the first reading and once max_feed_forward MHz were corrected since the last reading
+        '''
+        if not self.initialized or self.mhz_per_volt == 0:
+            return 0.
+        drift = self.x[1]*max(t - self.feed_forward_time, 0.)
+        drift = np.clip(drift, -self.max_feed_forward - self.feed_forward_MHz, self.max_feed_forward - self.feed_forward_MHz)
+        self.feed_forward_time = t
+        self.feed_forward_MHz += drift
+        return -drift/self.mhz_per_volt
@@ -0,0 +1,118 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Background writer of the feedback of a laser, used in laserWLMLock so the lock never waits for the laser
+(e.g. a qcodes parameter set over telnet for the Toptica).
+
+    - write(value) only stores the value and returns, a thread applies it with laser.apply_feedback
+    - values written while the laser is busy are coalesced, only the latest one is applied
+    - values closer than deadband (V) to the last applied one are not sent (below the resolution of the piezo)
+    - get_stats() gives the number of writes, coalesced and skipped values, and the latency of the writes
+
+    example of usage:
+        writer = feedbackWriter(laser, deadband = 1e-4)
+        writer.write(0.123)
+        writer.flush()    #wait until the laser has the last value, e.g. before disconnecting it
+
+'''
+
+import time
+import threading
+
+
+class feedbackWriter():
+    def __init__(self, laser, deadband = 1e-4):
+        self.laser = laser
+        self.deadband = deadband #V
+
+        self._condition = threading.Condition()
+        self._pending = None #(value, time of the write call)
+        self._busy = False
+        self.last_written = None
+
+        self.clear_stats()
+        self._thread = threading.Thread(target = self._run, name = f'feedback writer {laser.name}', daemon = True)
+        self._thread.start()
+
+    def write(self, value):
+        #returns immediately, the value replaces the one still waiting to be applied
+        with self._condition:
+            if self._pending is not None:
+                self.stats['coalesced'] += 1
+            self._pending = (value, time.monotonic())
+            self._condition.notify_all()
+
+    def flush(self, timeout = 5.):
+        #wait until the last value is applied, False on timeout
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def discard(self):
+        #drop the value waiting to be applied (e.g. the feedback is reset when stopping the lock)
+        with self._condition:
+            self._pending = None
+            self._condition.notify_all()
+
+    def reset(self):
+        #the feedback of the laser was changed directly (coarse setting, disconnection), always send the next value
+        with self._condition:
+            self.last_written = None
+
+    def clear_stats(self):
+        self.stats = {'writes'          : 0,
+                      'coalesced'       : 0,
+                      'skipped'         : 0,
+                      'errors'          : 0,
+                      'last_error'      : None,
+                      'mean_write_time' : 0., #s, time of laser.apply_feedback
+                      'max_write_time'  : 0.,
+                      'max_latency'     : 0.} #s, from the write call to the value applied
+
+    def get_stats(self):
+        with self._condition:
+            stats = dict(self.stats)
+            stats['pending'] = self._pending is not None
+            stats['last_written'] = self.last_written
+        return stats
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None)
+                value, call_time = self._pending
+                self._pending = None
+                if self.last_written is not None and abs(value - self.last_written) < self.deadband:
+                    self.stats['skipped'] += 1
+                    self._condition.notify_all()
+                    continue
+                self._busy = True
+
+            start = time.monotonic()
+            try:
+                self.laser.apply_feedback(value)
+                error = None
+            except Exception as e:
+                print(f'WARNING: could not apply feedback {value:.4f} to {self.laser.name}')
+                print(e)
+                error = str(e)
+            end = time.monotonic()
+
+            with self._condition:
+                self._busy = False
+                if error is None:
+                    self.last_written = value
+                    n = self.stats['writes'] = self.stats['writes'] + 1
+                    self.stats['mean_write_time'] += (end - start - self.stats['mean_write_time'])/n
+                    self.stats['max_write_time'] = max(self.stats['max_write_time'], end - start)
+                    self.stats['max_latency'] = max(self.stats['max_latency'], end - call_time)
+                else:
+                    self.stats['errors'] += 1
+                    self.stats['last_error'] = error
+                self._condition.notify_all()
@@ -20,16 +20,30 @@ import pyqtgraph as pg
 import numpy as np
 from PyQt5 import QtCore, QtGui
 from laser_lock_gui import Ui_Dialog
+from lock_control import laserLockControl, detuned_setpoint
+from server_library.pyro_metrics import rpc_metrics
 
 
 class laserLockGUI(QtGui.QDialog):
-    def __init__(self, lock, parent=None):
+    #emitted from the lock engine thread after every update, delivered in the GUI thread
+    lock_updated = QtCore.pyqtSignal(object)
+    #emitted by remote_lock_access when the settings are changed remotely
+    remote_settings = QtCore.pyqtSignal(object)
+    #emitted from the lock engine thread when a lock started from the GUI could not start
+    start_failed = QtCore.pyqtSignal(object)
+
+    def __init__(self, lock, engine=None, parent=None):
         """
         Locking GUI for a laser
+        If a lockEngine is given the lock runs in the engine thread and the GUI only sends commands and shows the lock,
+        otherwise the lock is updated by the GUI timer
         """
         # QtGui.QDialog.__init__(self, None, QtCore.Qt.WindowStaysOnTopHint)
         super(laserLockGUI, self).__init__(parent)
         self.lock = lock
+        self.engine = engine
+        #set by remote_lock_access, kept up to date with the settings changed from the GUI
+        self.control = None
 
         self.speed_of_light = 299792458
 
@@ -81,8 +95,17 @@ class laserLockGUI(QtGui.QDialog):
         self.timer = QtCore.QTimer()
         self.timer.timeout.connect(self.update_lock)
         self.timer.setSingleShot(True)
+
+        if self.engine is not None:
+            self.lock_updated.connect(self.show_lock_update)
+            self.engine.add_listener(self.lock_updated.emit)
+        self.remote_settings.connect(self.apply_remote_settings)
+        self.start_failed.connect(self.show_start_failure)
         
         self.is_running = False
+        self.last_engine_update = 0
+        #last update of the lock run by the timer, as in lockEngine.get_state
+        self.timer_state = {'feedback' : 0., 'wavelength' : 0., 'timestamp' : 0., 'lock_time' : 0., 'updates' : 0}
 
     def spin_box_update(self):
         self.lock_detuning_wo_slider = self.lock_detuning
@@ -103,7 +126,12 @@ class laserLockGUI(QtGui.QDialog):
 
         self.lock_setpoint = 1 / ((1 / self.lock_input_wavelength) + (self.lock_detuning / self.speed_of_light))  #all in GHZ & nm
 
-        self.lock.change_pid_setpt(self.lock_setpoint)
+        if self.control is not None:
+            self.control.detuning = self.lock_detuning
+        if self.engine is not None:
+            self.engine.change_setpoint(self.lock_setpoint)
+        else:
+            self.lock.change_pid_setpt(self.lock_setpoint)
 
     def enable_gui(self, ebl, clearplot = True):
         
@@ -149,6 +177,22 @@ class laserLockGUI(QtGui.QDialog):
         self.lock_input_wavelength = float( self.ui.wl_lineedit.text() )
         self.lock_detuning_wo_slider = float( self.ui.det_lineedit.text() )
         self.lock_setpoint = round( 1/((1/self.lock_input_wavelength) + (self.lock_detuning_wo_slider/self.speed_of_light)) , 5)
+        if self.control is not None:
+            self.control.laser_name = laser
+            self.control.wavelength_setpoint = self.lock_input_wavelength
+            self.control.detuning = self.lock_detuning_wo_slider
+
+        if self.engine is not None:
+            if self.lock_setpoint < self.lock.available_lasers[laser].wl_min or self.lock_setpoint > self.lock.available_lasers[laser].wl_max:
+                print("Check wavelength")
+                return 0
+            self.enable_gui(False, clearplot = True)
+            self.last_engine_update = 0
+            self.engine.set_update_interval(float(self.ui.update_lineedit.text()))
+            #the coarse setting and the lock run in the engine thread, the GUI is updated by show_lock_update
+            self.is_running = True
+            self.engine.start_lock(laser, self.lock_setpoint).add_done_callback(self._lock_started)
+            return 1
 
         self.lock.initialize_lock(laser, self.lock_setpoint)
 
@@ -163,6 +207,7 @@ class laserLockGUI(QtGui.QDialog):
 
         #coarse wavelength sucessfully set
         self.start_time = time.time()
+        self.timer_state = {'feedback' : 0., 'wavelength' : 0., 'timestamp' : 0., 'lock_time' : 0., 'updates' : 0}
         self.timer.setInterval(int(float(self.ui.update_lineedit.text())*1000))  # in millisec
         self.timer.start() 
         print('timer started')
@@ -171,14 +216,40 @@ class laserLockGUI(QtGui.QDialog):
         
         return 1
 
+    def _lock_started(self, future):
+        #called in the engine thread after the coarse setting
+        error = future.exception()
+        if error is not None:
+            self.start_failed.emit(error)
+        elif future.result() == -1:
+            self.start_failed.emit('coarse wavelength not reached')
+
+    def show_start_failure(self, error):
+        print(f"ERROR: lock not started, {error}")
+        self.ui.out_label.setText(f"Out: 0 V")
+        self.enable_gui(True, clearplot = False)
+        self.is_running = False
+
     def update_lock(self):
 
         feedback_val, wl = self.lock.update_piezo((time.time()-self.start_time))
+        self.timer_state.update({'feedback' : feedback_val, 'wavelength' : wl, 'timestamp' : time.time(),
+                                 'lock_time' : time.time() - self.start_time, 'updates' : self.timer_state['updates'] + 1})
         
         self.timer.start() #because of the singleShot
+        self.add_to_track(feedback_val, wl, time.time() - self.start_time)
+
+    def show_lock_update(self, state):
+        #called in the GUI thread with the state of the lock engine, only new updates are added to the plot
+        if not state['running'] or not self.is_running or state['updates'] == self.last_engine_update:
+            return
+        self.last_engine_update = state['updates']
+        self.add_to_track(state['feedback'], state['wavelength'], state['lock_time'])
+
+    def add_to_track(self, feedback_val, wl, t):
         self.ui.out_label.setText(f"Out: {feedback_val:.1f} V")
         self.lock_track_wl = np.append(self.lock_track_wl, wl)
-        self.lock_track_t = np.append(self.lock_track_t, time.time() - self.start_time)
+        self.lock_track_t = np.append(self.lock_track_t, t)
 
         if self.lock_track_len > self.max_lock_track_len:
             self.lock_track_t = np.delete(self.lock_track_t, 0)
@@ -192,7 +263,10 @@ class laserLockGUI(QtGui.QDialog):
 
     def stop_lock(self):
         self.timer.stop()
-        self.lock.terminate_lock()
+        if self.engine is not None:
+            self.engine.stop_lock()
+        else:
+            self.lock.terminate_lock()
         print('timer stopped')
         self.ui.out_label.setText(f"Out: 0 V")
         self.enable_gui(True, clearplot = True)
@@ -201,80 +275,142 @@ class laserLockGUI(QtGui.QDialog):
 
     def pause_lock(self):
         self.timer.stop()
-        self.lock.pause_lock()
+        if self.engine is not None:
+            self.engine.pause_lock()
+        else:
+            self.lock.pause_lock()
         print('timer stopped')
 
         self.enable_gui(True, clearplot = False)
         
         self.is_running = False
     
+    def apply_remote_settings(self, settings):
+        #show the settings changed with remote_lock_access, the lock itself is already handled by the engine
+        idx = self.ui.comboBox.findText(settings['laser'] or '')
+        if idx >= 0:
+            self.ui.comboBox.setCurrentIndex(idx)
+        self.ui.wl_lineedit.setText(str(settings['wavelength_setpoint']))
+        self.ui.det_lineedit.setText(str(settings['detuning']))
+
+        self.lock_input_wavelength = settings['wavelength_setpoint']
+        self.lock_detuning_wo_slider = settings['detuning']
+        self.lock_detuning = settings['detuning']
+        self.lock_setpoint = settings['setpoint']
+        self.ui.horizontalSlider.blockSignals(True)
+        self.ui.horizontalSlider.setValue(0)
+        self.ui.horizontalSlider.blockSignals(False)
+
+        if settings['started']:
+            self.enable_gui(False, clearplot = True)
+            self.last_engine_update = 0
+            self.is_running = True
+        elif settings['stopped']:
+            if settings['clearplot']:
+                self.ui.out_label.setText(f"Out: 0 V")
+            self.enable_gui(True, clearplot = settings['clearplot'])
+            self.is_running = False
+
     def get_is_runnning_console(self):
         return self.is_running
     
-class remote_lock_access:
+@rpc_metrics
+class remote_lock_access(laserLockControl):
     """
     remote access to the laser lock
-    Here most of the function mimic a click on the mouse to the GUI, so the laser lock need to running with the GUI open
+    The commands act directly on the lock engine (see laserLockControl), the GUI only shows the new settings
+    through the remote_settings signal, so the lock can be used remotely also while the GUI is busy.
+    If the lock is updated by the timer of the GUI (laserLockGUI without engine) the lock is started, stopped
+    and paused through the GUI and the other commands call the lock directly, the Pyro requests are handled
+    in the GUI thread (qt5_pyro_integration) between the updates of the lock.
 
     """
     
-    def __init__(self,laser_lock,laser_lock_gui):
+    def __init__(self, laser_lock, laser_lock_gui, engine = None):
+        engine = engine if engine is not None else laser_lock_gui.engine
+
+        #start from the settings shown in the GUI
+        ui = laser_lock_gui.ui
+        super().__init__(laser_lock, engine, laser_name = ui.comboBox.currentText() or None,
+                         wavelength_setpoint = float(ui.wl_lineedit.text()), detuning = float(ui.det_lineedit.text()))
         self.laser_lock = laser_lock
         self.laser_lock_gui = laser_lock_gui
+        self.laser_lock_gui.control = self
 
-    def set_wavelength_setpoint(self,wavelength_nm):
-        self.laser_lock_gui.ui.wl_lineedit.setText(str(wavelength_nm))
-        
-    def remote_start(self):
-        self.laser_lock_gui.ui.btn_start.clicked.emit()
+    #----lock updated by the timer of the GUI----
+
+    def start(self, wavelength_nm = None, detuning_GHz = None, wait = False):
+        if self.engine is not None:
+            return super().start(wavelength_nm, detuning_GHz, wait)
+        if self.get_is_running():
+            print(f"Lock of {self.laser_name} already running")
+            return 0
+        if wavelength_nm is not None:
+            self.wavelength_setpoint = float(wavelength_nm)
+        if detuning_GHz is not None:
+            self.detuning = float(detuning_GHz)
+        #the GUI starts the lock with the settings shown, the coarse setting blocks until the lock is running
+        self._settings_changed()
+        return self.laser_lock_gui.start_lock()
+
+    def stop(self):
+        if self.engine is not None:
+            return super().stop()
+        self.laser_lock_gui.stop_lock()
+        return 1
+
+    def pause(self):
+        if self.engine is not None:
+            return super().pause()
+        self.laser_lock_gui.pause_lock()
+        return 1
+
+    def change_detuning(self, detuning_GHz):
+        if self.engine is not None:
+            return super().change_detuning(detuning_GHz)
+        self.detuning = float(detuning_GHz)
+        self.laser_lock.change_pid_setpt(detuned_setpoint(self.wavelength_setpoint, self.detuning))
+        self._settings_changed()
+        return 1
 
-    def remote_stop(self):
-        self.laser_lock_gui.ui.btn_stop.clicked.emit()
-        
     def get_is_running(self):
-        return self.laser_lock_gui.ui.btn_stop.isEnabled()
-        
-    def remote_pause(self):
-        self.laser_lock_gui.ui.btn_pause.clicked.emit()
-        
-    def get_wavelength_setpoint(self):
-        return float(self.laser_lock_gui.ui.wl_lineedit.text())
-    
-    def set_detuning(self,detuning_GHz):
-        """
-        Use to set the detuning prior to starting the lock
-        """
-        self.laser_lock_gui.ui.det_lineedit.setText(str(detuning_GHz))
-        
-    def get_detuning(self):
-        return float(self.laser_lock_gui.ui.det_lineedit.text())
-    
-    def change_detuning(self,detuning):
-        """
-        Use to set the detuning while laser lock is already running (limited range!)
-        """
-        self.laser_lock_gui.lock_detuning = detuning
-        
-        self.laser_lock_gui.ui.det_lineedit.setText(str(self.laser_lock_gui.lock_detuning))
+        if self.engine is not None:
+            return super().get_is_running()
+        return self.laser_lock_gui.is_running
 
-        self.laser_lock_gui.lock_setpoint = 1 / ((1 / self.laser_lock_gui.lock_input_wavelength) + (self.laser_lock_gui.lock_detuning / self.laser_lock_gui.speed_of_light))  #all in GHZ & nm
+    def get_update_interval(self):
+        if self.engine is not None:
+            return super().get_update_interval()
+        return float(self.laser_lock_gui.ui.update_lineedit.text())
 
-        self.laser_lock.change_pid_setpt(self.laser_lock_gui.lock_setpoint)
-        
-        
-        
-    def get_wavelength(self):
-        if len(self.laser_lock_gui.lock_track_wl)==0:
-            return None
-        return self.laser_lock_gui.lock_track_wl[-1]    
-
-    def snapshot(self):
-        snapshot = {}
-        snapshot['current_wavelength'] = self.get_wavelength()
-        snapshot['wavelength_setpoint'] = self.get_wavelength_setpoint()
-        snapshot['detuning'] = self.get_detuning()
-        snapshot['running'] = self.get_is_running()
-        return snapshot
+    def get_lock_state(self):
+        if self.engine is not None:
+            return super().get_lock_state()
+        gui = self.laser_lock_gui
+        state = dict(gui.timer_state)
+        state.update({'laser' : self.laser_name, 'running' : gui.is_running, 'setpoint' : gui.lock_setpoint, 'missed_updates' : 0})
+        return state
+
+    #----remote access----
+
+    def remote_start(self):
+        return self.start()
+
+    def remote_stop(self):
+        return self.stop()
+
+    def remote_pause(self):
+        return self.pause()
     
     def get_is_running_remote(self):
-        return self.laser_lock_gui.get_is_runnning_console()
\ No newline at end of file
+        return self.get_is_running()
+
+    def _settings_changed(self, started = False, stopped = False, clearplot = False):
+        settings = {'laser'               : self.laser_name,
+                    'wavelength_setpoint' : self.wavelength_setpoint,
+                    'detuning'            : self.detuning,
+                    'setpoint'            : detuned_setpoint(self.wavelength_setpoint, self.detuning),
+                    'started'             : started,
+                    'stopped'             : stopped,
+                    'clearplot'           : clearplot}
+        self.laser_lock_gui.remote_settings.emit(settings)
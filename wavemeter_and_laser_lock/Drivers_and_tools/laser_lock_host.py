@@ -0,0 +1,108 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Lock host to lock several lasers from a single process, used in multi_laser_lock.
+
+Instead of running laser_lock.py once per laser (one python process, Qt application,
+Pyro daemon and nameserver registration per laser), the host keeps one laserWLMLock per
+laser, each one run by its own lockEngine, and exposes all of them on a single Pyro daemon:
+    - laser_lock_<name> : a laserLockControl object to control a single laser
+    - laser_lock_host   : the laserLockHost itself, for coordinated operations on several lasers
+
+The nameserver lookup of the wavemeter server is done once and shared by all the locks, as the
+calibrationStore of the lasers, and the PID controllers of all the lasers are rows of a single PIDBank.
+Every lock keeps its own proxy to the wavemeter server, because calls on a single Pyro proxy
+are serialized and query_wavelength waits for the slot of the laser.
+
+    example of usage (see multi_laser_lock.py):
+        host = laserLockHost(ctl1, ctl2, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX')
+        daemon = Pyro4.Daemon(host='localhost')
+        host.register_on_daemon(daemon, 'localhost')
+        host.start_all({'CTL1' : 1550.1, 'CTL2' : 1551.3})
+        daemon.requestLoop()
+
+'''
+
+import Pyro4
+
+from laser_lock_wlm import laserWLMLock
+from lock_engine import lockEngine
+from lock_control import laserLockControl
+from PID_bank import PIDBank
+from calibration_store import calibrationStore
+from server_library import pyro_tools
+from server_library.pyro_metrics import rpc_metrics
+
+
+#the per-laser control objects are exposed as they are
+Pyro4.expose(laserLockControl)
+
+
+@Pyro4.expose
+@rpc_metrics
+class laserLockHost():
+    """
+    Host for the locks of several lasers in a single process
+    """
+
+    def __init__(self, *lasers, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX', update_interval = 0.2):
+        #resolve the nameserver entry only once for all the locks
+        if wlm_address.startswith('PYRONAME'):
+            wlm_address = str(Pyro4.resolve(wlm_address))
+        self.wlm_address = wlm_address
+
+        #one store for all the locks, they share the calibration file
+        self.calibration_store = calibrationStore()
+        #the PID controllers of all the lasers are kept in one bank, every lock uses its own row
+        self.pid_bank = PIDBank(len(lasers))
+        self.controls = {}
+        for i, laser in enumerate(lasers):
+            lock = laserWLMLock(laser, wlm_address = wlm_address, calibration_store = self.calibration_store)
+            lock.pid = self.pid_bank.controller(i)
+            engine = lockEngine(lock, update_interval)
+            self.controls[laser.name] = laserLockControl(lock, engine, laser.name)
+
+    def get_available_lasers(self):
+        return list(self.controls.keys())
+
+    def register_on_daemon(self, daemon, host, nameserver = True):
+        #expose the host and a control object per laser on the same daemon
+        uris = {'laser_lock_host' : daemon.register(self)}
+        for name, control in self.controls.items():
+            uris['laser_lock_'+name] = daemon.register(control)
+        if nameserver:
+            for share_name, uri in uris.items():
+                pyro_tools.register_on_nameserver(host, share_name, uri, existing_name_behaviour='replace')
+        return uris
+
+    def start_all(self, setpoints, detunings = None):
+        #setpoints (and optionally detunings in GHz) as dict with the laser names as keys
+        detunings = detunings or {}
+        #the coarse wavelengths are set in parallel by the engines
+        return {name : self.controls[name].start(wl, detunings.get(name, 0.)) for name, wl in setpoints.items()}
+
+    def stop_all(self):
+        return {name : control.stop() for name, control in self.controls.items()}
+
+    def pause_all(self):
+        return {name : control.pause() for name, control in self.controls.items()}
+
+    def change_detunings(self, detunings):
+        return {name : self.controls[name].change_detuning(det) for name, det in detunings.items()}
+
+    def get_states(self):
+        return {name : control.get_state() for name, control in self.controls.items()}
+
+    def get_pid_states(self):
+        #gains, integrators and outputs of all the lasers, read from the PID bank at once
+        bank = self.pid_bank
+        return {name : {'setpoint' : float(bank.SetPoint[i]), 'Kp' : float(bank.Kp[i]), 'Ki' : float(bank.Ki[i]),
+                        'ITerm' : float(bank.ITerm[i]), 'output' : float(bank.output[i])}
+                for i, name in enumerate(self.controls)}
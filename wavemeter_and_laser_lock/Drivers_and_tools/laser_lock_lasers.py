@@ -0,0 +1,68 @@
+'''
+Created on 
+
+@author: A.Wallucks
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Classes of the lasers that can be locked with laserWLMLock, following the templateLaser described in laser_lock.py.
+Kept separate from laser_lock.py so that they can be used without the GUI (e.g. in multi_laser_lock.py).
+
+'''
+
+
+from qcodes import Instrument
+from Drivers_and_tools.TopticaDLCPro import TopticaDLCPro #needs the qcodes repository
+
+
+class lockTopticaCTL():
+    def __init__(self, name, ip_address, pid_p = 0., pid_i = -1000., \
+                 min_out = -10., max_out = 10., coarse_setting_accuracy = 500.):    
+        #--------PARAMETERS----------
+
+        self.name = name
+        self.ip_address = ip_address
+        self.pid_p = pid_p
+        self.pid_i = pid_i
+        self.min_out = min_out
+        self.max_out = max_out
+        self.wl_min = 1460.
+        self.wl_max = 1570.
+        self.coarse_setting_accuracy = coarse_setting_accuracy  #MHz - how close the coarse setting needs to be
+        self.piezo_offset = 70.
+
+    def connect_laser(self):
+        try:
+             self.laser = Instrument.find_instrument(self.name)
+        except KeyError:
+            self.laser = TopticaDLCPro(self.name, self.ip_address)
+        #state and wavelength pushed by the controller, the coarse setting does not poll the state
+        #(returns at once if the monitoring of the controller already failed, the state is then polled)
+        if not self.laser.is_monitored('laser1:ctl:state'):
+            self.laser.subscribe()
+
+    def disconnect_laser(self, reset_feedback = False):
+        if reset_feedback:
+            self.laser.piezo_voltage_setting(self.piezo_offset)
+        self.laser.close()
+        
+    def set_wavelength_coarse(self, set_wavelength):
+        self.laser.piezo_voltage_setting(self.piezo_offset)
+        self.wavelength = set_wavelength
+        since = self.laser.monitor.update_count('laser1:ctl:state')
+        self.laser.wavelength(self.wavelength)
+        if not self.laser.wait_for_idle(since, timeout = 5.):
+            return -1
+        return 1
+
+    def correct_wavelength_offset(self, set_wavelength, actual_wavelength):
+        self.wavelength += set_wavelength - actual_wavelength
+        self.set_wavelength_coarse(self.wavelength)
+        return 1
+
+
+    def apply_feedback(self, value):
+        self.laser.piezo_voltage_setting(self.piezo_offset + value)
@@ -17,10 +17,17 @@ import datetime
 import numpy as np
 import Pyro4
 from PID import PID
+from calibration_store import calibrationStore
+from coarse_tuning import coarseTuningModel
+from outlier_filter import hampelFilter
+from drift_estimator import driftKalmanFilter
+from feedback_writer import feedbackWriter
+import pid_autotune
 
 
 class laserWLMLock():
-    def __init__(self, *available_lasers, wlm_address = 'PYRONAME:ws6server@192.168.1.XXX'):
+    def __init__(self, *available_lasers, wlm_address = 'PYRONAME:ws6server@192.168.1.XXX', calibration_store = None, \
+                 wlm = None, time_source = time.time, sleep = time.sleep, feedback_writer = True):
         # --------CONSTANTS----------
         
         self.wlm_address = wlm_address 
@@ -29,29 +36,89 @@ class laserWLMLock():
         
         self.intial_time_wait_check = 30 #seconds
         self.max_diff_consecutive_reading = 500 #MHz, to avoid to apply feedback if a huge -false- jump happens. In case the wavemeter reads a wrong value
+        self.max_coarse_iterations = 10 #motor moves to reach coarse_setting_accuracy before giving up
+
+        #filter of the wavemeter readings, to avoid to apply feedback on single wrong readings (overexposed, other laser...)
+        self.outlier_filter = hampelFilter(window_length = 11, n_sigmas = 5., min_threshold = 20.) #MHz
+        self.outlier_bypass_readings = 20 #readings not filtered after the coarse setting and setpoint changes, the laser is moving
+
+        #calibrations of the lasers kept across sessions
+        self.calibration_store = calibration_store if calibration_store is not None else calibrationStore()
+        self.coarse_models = {}
         
         self.available_lasers = {}
         for l in available_lasers:
             self.available_lasers[l.name] = l
         
-        # WLM        
-        self.connect_wavemeter()
+        # WLM, a wavemeter object can be given directly (e.g. lock_simulation.simulatedWavemeter)
+        if wlm is not None:
+            self.wlm = wlm
+        else:
+            self.connect_wavemeter()
         
         
-        self.pid = PID()
+        #clock used by the lock, replaced by a virtual clock in simulations
+        self.time_source = time_source
+        self.sleep = sleep
+        self.pid = PID(time_source = time_source)
+        #only update the PID with new wavemeter readings (see set_sample_mode)
+        self.skip_stale_readings = False
+        self.last_sequence = None
+        self.stale_readings = 0
+        self.stamped_readings = None #True if the wavemeter server has query_wavelength_stamped
+        #drift estimator, corrects the drift between the wavemeter slots (see enable_estimator)
+        self.estimator = None
+        self.query_timeout = 10. #s, waiting time for the slot of the laser before the wavemeter server gives up
+        self.estimator_query_timeout = 0.1 #s, in update_piezo with the estimator, to correct the drift while waiting
+        #use the gains found by autotune_pid (saved in the calibration store) instead of the ones of the laser class
+        self.use_stored_gains = True
+        #jump to the feedback predicted with the piezo calibration after the coarse setting and on setpoint changes
+        self.use_piezo_preload = True
+        #apply the feedback from a background thread (see feedback_writer), one writer per laser
+        self.use_feedback_writer = feedback_writer
+        self.feedback_writers = {}
+        self.feedback_writer = None
+        #True between initialize_lock and terminate_lock, the feedback is only applied to a connected laser
+        self.laser_connected = False
         self.speed_of_light = 299792458
 
     def connect_wavemeter(self):
+        if self.wlm_address is None:
+            #wavemeter given directly, nothing to reconnect
+            return
         self.wlm = Pyro4.Proxy(self.wlm_address)
+        self.stamped_readings = None
         
-    def get_wavelengt(self):
+    def get_wavelengt(self, timeout = None):
+        #0 if it is not the slot of the laser within timeout (query_timeout by default)
+        timeout = self.query_timeout if timeout is None else timeout
+        return self._query_wlm(lambda: self.wlm.query_wavelength(self.laser.name, timeout))
+
+    def get_stamped_wavelength(self, timeout = None):
+        #wavelength and sequence number of the reading, (None, None) if the wavemeter can not be reached
+        timeout = self.query_timeout if timeout is None else timeout
+        reading = self._query_wlm(lambda: self._query_stamped(timeout))
+        if reading is None:
+            return None, None
+        return reading[0], reading[2]
+
+    def _query_stamped(self, timeout):
+        if self.stamped_readings is None:
+            self.stamped_readings = hasattr(self.wlm, 'query_wavelength_stamped')
+        if self.stamped_readings:
+            return self.wlm.query_wavelength_stamped(self.laser.name, timeout)
+        #older servers, a repeated reading has exactly the same value
+        act_wl = self.wlm.query_wavelength(self.laser.name, timeout)
+        return act_wl, None, act_wl
+
+    def _query_wlm(self, query):
         connection_failed = False
         for i in range(self.wlm_reconnect_tries):
             try: 
                 if connection_failed:
                     self.connect_wavemeter()
                     self.wlm.register_user(self.laser.name)
-                return self.wlm.query_wavelength(self.laser.name)
+                return query()
             except Exception as e: #TODO put correct exception class here 
                 print(f'WARNING: could not get laser {self.laser.name} wavelength. Try {i:d}/{self.wlm_reconnect_tries:d}')
                 print(e)
@@ -67,45 +134,194 @@ class laserWLMLock():
         self.laser = self.available_lasers[laser_name]
         print(f"Switched to lock for {laser_name}")
         self.laser.connect_laser()
+        self.laser_connected = True
+        self.feedback_writer = self.get_feedback_writer(laser_name)
         self.pid.change_setpoint(setpoint)
         self.pid.setKp(self.laser.pid_p)
         self.pid.setKi(self.laser.pid_i)
+        stored_gains = self.calibration_store.get(laser_name, 'pid_gains')
+        #gains tuned for the other sample mode of the PID are not valid
+        if self.use_stored_gains and stored_gains is not None \
+                and stored_gains.get('true_interval', False) == self.pid.true_interval:
+            print(f"Using the gains tuned on {stored_gains['date']}: pid_p {stored_gains['pid_p']}, pid_i {stored_gains['pid_i']:.1f}")
+            self.pid.setKp(stored_gains['pid_p'])
+            self.pid.setKi(stored_gains['pid_i'])
+            self.pid.setWindup(stored_gains['windup_guard'])
+        self.outlier_filter.reset()
+        self.last_sequence = None
+        if self.estimator is not None:
+            self.estimator.reset()
 
         self.wlm.register_user(self.laser.name)
 
 
     def set_coarse_wavelength(self, setpoint):
-        act_wl = self.get_wavelengt()
+        #the coarse setting moves the piezo directly
+        self.flush_feedback(reset = True)
+        #the lock pulls the laser in from the coarse wavelength, the first readings are not filtered
+        self.outlier_filter.reset(bypass = self.outlier_bypass_readings)
+        for i in range(self.max_coarse_iterations):
+            act_wl = self.get_wavelengt()
+            if act_wl is not None and act_wl > 0:
+                break
+        else:
+            #no slot (0), wavemeter not reachable (None) or user not registered (-1)
+            print(f"WARNING: no valid wavemeter reading of {self.laser.name} for the coarse setting")
+            return -1
         freq_diff = -(self.speed_of_light/(act_wl*1e-9) - (self.speed_of_light/(setpoint*1e-9)) )/1e6
         if np.fabs(freq_diff) < self.laser.coarse_setting_accuracy:
             #check if we are good already (e.g. we paused & restarted the lock)
             print("Coarse WL set immediately")
+            self.preload_feedback(-freq_diff)
             return 1
         
-        #Set the wavelength initially. 
-        self.laser.set_wavelength_coarse(setpoint)
+        #Set the wavelength initially, correcting for the offset measured in the previous settings
+        model = self.get_coarse_model(self.laser.name)
+        command = model.predict_command(setpoint)
+        self.laser.set_wavelength_coarse(command)
+        ret = self._correct_coarse_wavelength(setpoint, model, command)
+        #the points of all the steps are written to the calibration file at once
+        model.save()
+        return ret
 
-        #Check if there is an offset from the laser wavelength to the WLM reading
-        while True:
+    def _correct_coarse_wavelength(self, setpoint, model, command):
+        #Correct the remaining offset from the laser wavelength to the WLM reading with a secant update
+        previous = None
+        for i in range(self.max_coarse_iterations):
             act_wl = self.get_wavelengt()
             print(f"Current wavelength {act_wl}")
+            if act_wl is None or act_wl <= 0:
+                #no valid reading, try again with the same command
+                continue
+            model.add_point(command, act_wl)
             freq_diff = -(self.speed_of_light/(act_wl*1e-9) - (self.speed_of_light/(setpoint*1e-9)) )/1e6
             print(f"freq_diff {freq_diff}")
-            if np.fabs(freq_diff) > self.laser.coarse_setting_accuracy:
-                self.laser.correct_wavelength_offset(setpoint, act_wl)
-            else:
-                print(f"Done setting wavelength to accuracy {freq_diff:.0f} MHz")
+            if np.fabs(freq_diff) <= self.laser.coarse_setting_accuracy:
+                print(f"Done setting wavelength to accuracy {freq_diff:.0f} MHz in {i+1} steps")
                 if hasattr(self.laser,'coarse_setting_done'):
                     self.laser.coarse_setting_done()
                     print('laser coarse done')
-                break
-            
-            
-        return 1
+                self.preload_feedback(-freq_diff)
+                return 1
+
+            #slope of the measured vs commanded wavelength, 1 unless two different commands are available
+            slope = 1.
+            if previous is not None and np.fabs(command - previous[0]) > 1e-6:
+                slope = np.clip((act_wl - previous[1])/(command - previous[0]), 0.5, 2.)
+            previous = (command, act_wl)
+            command = command + (setpoint - act_wl)/slope
+            self.laser.set_wavelength_coarse(command)
+
+        print(f"WARNING: coarse wavelength of {self.laser.name} not within {self.laser.coarse_setting_accuracy} MHz after {self.max_coarse_iterations} steps")
+        return -1
+
+    def get_coarse_model(self, laser_name):
+        if laser_name not in self.coarse_models:
+            self.coarse_models[laser_name] = coarseTuningModel(self.calibration_store, laser_name)
+        return self.coarse_models[laser_name]
+
+
+    def autotune_pid(self, step_voltage = 1., apply = True, reading_interval = 0.2):
+        '''
+        Find the PID gains of the current laser from a step response (see pid_autotune).
+        The laser needs to be at the coarse wavelength (after initialize_lock and set_coarse_wavelength), the lock not running.
+        The gains and the identified piezo response are saved in the calibration store for the next locks.
+        None if the tuning failed, the gains are not changed.
+        '''
+        setpoint = self.pid.SetPoint
+        self.pid.clear()
+        self.pid.change_setpoint(setpoint)
+        result = pid_autotune.autotune(self, step_voltage, reading_interval = reading_interval)
+        if result is None:
+            print(f"WARNING: PID gains of {self.laser.name} not tuned")
+            return None
+        print(f"{self.laser.name}: piezo {result['mhz_per_volt']:.1f} MHz/V, delay {result['delay']:.2f} s, "
+              f"sampling {result['sample_interval']:.2f} s -> pid_i {result['pid_i']:.1f}, settling {result['settling_time']:.1f} s")
+        if apply:
+            self.pid.setKp(result['pid_p'])
+            self.pid.setKi(result['pid_i'])
+            self.pid.setWindup(result['windup_guard'])
+            self.calibration_store.set(self.laser.name, 'pid_gains', result)
+            self.calibration_store.set(self.laser.name, 'piezo', {'mhz_per_volt' : result['mhz_per_volt'], 'date' : result['date']})
+        return result
+
+    def calibrate_piezo(self, voltages = (-2., -1., 0., 1., 2.), n_readings = 4, reading_interval = 0.2):
+        '''
+        Measure the piezo response (MHz/V) of the current laser (see pid_autotune.measure_piezo_response)
+        and save it in the calibration store, used by preload_feedback and the drift estimator.
+        The laser needs to be at the coarse wavelength, the lock not running. None if the measurement failed.
+        '''
+        result = pid_autotune.measure_piezo_response(self, voltages, n_readings, reading_interval = reading_interval)
+        if result is None:
+            print(f"WARNING: piezo response of {self.laser.name} not calibrated")
+            return None
+        print(f"{self.laser.name}: piezo {result['mhz_per_volt']:.1f} MHz/V, drift {result['drift_rate']:.2f} MHz/s, "
+              f"residual {result['residual']:.1f} MHz")
+        self.calibration_store.set(self.laser.name, 'piezo', result)
+        return result
+
+    def get_piezo_response(self, laser_name = None):
+        #MHz/V from the calibration store, None if the laser was never calibrated
+        laser_name = self.laser.name if laser_name is None else laser_name
+        piezo = self.calibration_store.get(laser_name, 'piezo')
+        if piezo is None:
+            return None
+        return piezo['mhz_per_volt']
 
+    def preload_feedback(self, error_MHz):
+        '''
+        Jump to the feedback that cancels the frequency error (MHz, laser - setpoint) with the calibrated
+        piezo response, instead of waiting for the integrator. The PID continues from the new feedback.
+        With the lock stopped or paused only the PID is moved, the next start continues from it.
+        '''
+        mhz_per_volt = self.get_piezo_response()
+        if not self.use_piezo_preload or not mhz_per_volt:
+            return self.pid.output
+        target = np.clip(self.pid.output - error_MHz/mhz_per_volt, self.laser.min_out, self.laser.max_out)
+        feedback_val = self.pid.feedForward(target - self.pid.output)
+        if not self.laser_connected:
+            return feedback_val
+        self.apply_feedback(feedback_val)
+        print(f"Feedback preloaded to {feedback_val:.3f} V for an error of {error_MHz:.0f} MHz")
+        return feedback_val
+
+    def get_feedback_writer(self, laser_name):
+        if not self.use_feedback_writer:
+            return None
+        if laser_name not in self.feedback_writers:
+            self.feedback_writers[laser_name] = feedbackWriter(self.available_lasers[laser_name])
+        return self.feedback_writers[laser_name]
+
+    def apply_feedback(self, value):
+        #with the feedback writer the value is applied in the background, the lock does not wait for the laser
+        if self.feedback_writer is None:
+            self.laser.apply_feedback(value)
+        else:
+            self.feedback_writer.write(value)
+
+    def flush_feedback(self, discard = False, reset = False):
+        '''
+        wait for the feedback writer before using the laser directly,
+        discard: drop the value not applied yet, reset: the next value is always sent
+        '''
+        if self.feedback_writer is None:
+            return
+        if discard:
+            self.feedback_writer.discard()
+        if not self.feedback_writer.flush():
+            print(f"WARNING: feedback of {self.laser.name} still being written")
+        if reset:
+            self.feedback_writer.reset()
+
+    def get_feedback_stats(self):
+        if self.feedback_writer is None:
+            return None
+        return self.feedback_writer.get_stats()
 
     def terminate_lock(self, reset_feedback = True):
+        self.laser_connected = False
         try:
+            self.flush_feedback(discard = reset_feedback, reset = True)
             if reset_feedback:
                 self.pid.clear()
             self.wlm.deregister_user(self.laser.name)
@@ -121,16 +337,95 @@ class laserWLMLock():
         self.terminate_lock(reset_feedback = False)
         
     def change_pid_setpt(self, new_setpt):
+        old_setpt = self.pid.SetPoint
         self.pid.change_setpoint(new_setpt)
+        if old_setpt > 0 and new_setpt > 0 and getattr(self, 'laser', None) is not None:
+            #the frequency error changes by the setpoint change
+            self.preload_feedback(-(self.speed_of_light/(new_setpt*1e-9) - self.speed_of_light/(old_setpt*1e-9))/1e6)
+        #the laser is going to move, do not compare the next readings with the old ones
+        self.outlier_filter.reset(bypass = self.outlier_bypass_readings)
+        if self.estimator is not None:
+            self.estimator.reset(keep_rate = True)
+
+    def set_sample_mode(self, true_interval = True, max_sample_interval = 1.):
+        '''
+        true_interval: the PID is only updated with new wavemeter readings and integrates over the real
+        time between them (up to max_sample_interval), so the integral gain is per second and does not depend
+        on how many lasers share the wavemeter. The gains of the default mode (at most 0.1 s per update)
+        are not valid in this mode, tune them again with autotune_pid.
+        '''
+        self.pid.setTrueInterval(true_interval, max_sample_interval)
+        self.skip_stale_readings = true_interval
+        self.last_sequence = None
+
+    def enable_estimator(self, mhz_per_volt = None, query_timeout = 0.1, **kwargs):
+        '''
+        Correct the drift of the laser between the wavemeter slots with a Kalman filter (see drift_estimator).
+        The lock queries the wavemeter with query_timeout, so every update without a new reading applies the
+        predicted drift correction. mhz_per_volt is the piezo response, by default the one measured by autotune_pid.
+        kwargs are passed to driftKalmanFilter (reading_noise, drift_noise ...)
+        '''
+        if mhz_per_volt is None:
+            mhz_per_volt = self.get_piezo_response()
+            if mhz_per_volt is None:
+                print(f"No piezo response of {self.laser.name}, run calibrate_piezo or give mhz_per_volt")
+                return False
+        self.estimator = driftKalmanFilter(mhz_per_volt, **kwargs)
+        self.estimator_query_timeout = query_timeout
+        return True
+
+    def disable_estimator(self):
+        self.estimator = None
+
+    def feed_forward(self):
+        #between the readings, apply the drift correction predicted by the estimator
+        if self.estimator is None:
+            return self.pid.output
+        correction = self.estimator.feed_forward(self.time_source())
+        if correction != 0.:
+            self.apply_feedback(self.pid.feedForward(correction))
+        return self.pid.output
+
+    def set_outlier_filter(self, window_length = 11, n_sigmas = 5., min_threshold = 20.):
+        self.outlier_filter = hampelFilter(window_length = window_length, n_sigmas = n_sigmas, min_threshold = min_threshold)
+
+    def get_outlier_stats(self):
+        return self.outlier_filter.get_stats()
+
+    def reading_is_valid(self, act_wl):
+        #reject the readings that are not a wavelength (timeout, error codes of the wavemeter) and the outliers
+        if act_wl is None or act_wl <= 0:
+            self.outlier_filter.add_invalid()
+            return False
+        return self.outlier_filter.check(self.speed_of_light/(act_wl*1e-9)/1e6) #MHz
 
     def update_piezo(self, time_diff):
         '''
         To update the value used to change the laser waeleght (in general a piezo) with the value calculated from teh PID 
         '''
-        act_wl = self.get_wavelengt()
+        new_reading = True
+        timeout = self.query_timeout if self.estimator is None else self.estimator_query_timeout
+        if self.skip_stale_readings or self.estimator is not None:
+            act_wl, sequence = self.get_stamped_wavelength(timeout)
+            if act_wl is not None and sequence == self.last_sequence:
+                #the reading used in the last update, nothing new for the PID and the estimator
+                new_reading = False
+                self.stale_readings += 1
+                if self.skip_stale_readings:
+                    return self.feed_forward(), act_wl
+            self.last_sequence = sequence
+        else:
+            act_wl = self.get_wavelengt(timeout)
+        if self.estimator is not None and act_wl == 0:
+            #not the slot of the laser within query_timeout
+            return self.feed_forward(), act_wl
+        if not self.reading_is_valid(act_wl):
+            #keep the last feedback, one wrong reading should not move the laser
+            return self.pid.output, act_wl
+
         if time_diff < self.intial_time_wait_check: #to let the laser go to the set wavelength
             feedback_val = self.pid.update(act_wl)
-            self.laser.apply_feedback(feedback_val)
+            self.apply_feedback(feedback_val)
         else:
             try:
                 freq_diff = -(self.speed_of_light/(act_wl*1e-9) - (self.speed_of_light/(self.pid.SetPoint*1e-9)) )/1e6 #in MHz, the slider updates the setpoint
@@ -139,8 +434,10 @@ class laserWLMLock():
                     feedback_val = 0 #just to return a value for the GUI
                     print(f'Jump in wavelength! {freq_diff:.1f} MHz, {now.strftime("%H:%M:%S")}')
                 else:
+                    if self.estimator is not None and new_reading:
+                        self.estimator.update(self.time_source(), -freq_diff, self.pid.output)
                     feedback_val = self.pid.update(act_wl)
-                    self.laser.apply_feedback(feedback_val)
+                    self.apply_feedback(feedback_val)
             except:
                 print(f"actual wavelength measured : {act_wl:f}")
                 feedback_val = 0
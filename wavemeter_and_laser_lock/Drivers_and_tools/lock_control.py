@@ -0,0 +1,257 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Typed control API of a laser lock running in a lockEngine, used for the remote access to the lock.
+
+The settings (laser, wavelength setpoint, detuning) are kept here as numbers and the commands go
+directly to the lock engine, no GUI is needed. remote_lock_access (laser_lock_gui_and_remote_access)
+adds the synchronisation of the GUI on top of this class, laserLockHost uses it as it is.
+Without an engine (engine = None) the commands call the lock directly in the calling thread, used by
+remote_lock_access when the lock is updated by the timer of the GUI.
+
+    example of usage:
+        control = laserLockControl(lock, engine, 'CTL2')
+        control.start(1550.1, 0.5)   #wavelength in nm, detuning in GHz
+        control.get_state()          #setpoint, last reading, lock error, feedback, timestamps...
+        control.change_detuning(0.6)
+        control.stop()
+
+'''
+
+import concurrent.futures
+from server_library.pyro_metrics import rpc_metrics
+
+
+SPEED_OF_LIGHT = 299792458
+
+
+def detuned_setpoint(wavelength_nm, detuning_GHz):
+    #setpoint in nm of a laser detuned by detuning_GHz from wavelength_nm, as in the GUI
+    return 1/((1/wavelength_nm) + (detuning_GHz/SPEED_OF_LIGHT))
+
+
+@rpc_metrics
+class laserLockControl():
+    def __init__(self, lock, engine, laser_name = None, wavelength_setpoint = 1550., detuning = 0.):
+        self.lock = lock
+        self.engine = engine
+
+        self.laser_name = laser_name
+        self.wavelength_setpoint = wavelength_setpoint #nm, without detuning
+        self.detuning = detuning #GHz
+
+        #maximum waiting times for the engine, the commands wait for the update or coarse setting running before them
+        self.command_timeout = 30. #s
+        self.start_timeout = 300. #s, coarse setting
+        self.calibration_timeout = 600. #s, autotune and piezo calibration
+
+    #----settings----
+
+    def get_available_lasers(self):
+        return self.lock.get_available_lasers()
+
+    def set_laser(self, laser_name):
+        if laser_name not in self.lock.available_lasers:
+            print(f"Unknown laser {laser_name}")
+            return 0
+        self.laser_name = laser_name
+        self._settings_changed()
+        return 1
+
+    def get_laser(self):
+        return self.laser_name
+
+    def set_wavelength_setpoint(self, wavelength_nm):
+        self.wavelength_setpoint = float(wavelength_nm)
+        self._settings_changed()
+        return 1
+
+    def get_wavelength_setpoint(self):
+        return self.wavelength_setpoint
+
+    def set_detuning(self, detuning_GHz):
+        """
+        Use to set the detuning prior to starting the lock
+        """
+        self.detuning = float(detuning_GHz)
+        self._settings_changed()
+        return 1
+
+    def get_detuning(self):
+        return self.detuning
+
+    def get_setpoint(self):
+        return round(detuned_setpoint(self.wavelength_setpoint, self.detuning), 5)
+
+    #----lock----
+
+    def start(self, wavelength_nm = None, detuning_GHz = None, wait = False):
+        """
+        Start the lock with the current settings (or the ones given)
+        The coarse wavelength is set in the engine thread, use wait = True to return only when the lock is running
+        """
+        if self.get_is_running():
+            print(f"Lock of {self.laser_name} already running")
+            return 0
+        if self.laser_name not in self.lock.available_lasers:
+            print("Select laser")
+            return 0
+        if wavelength_nm is not None:
+            self.wavelength_setpoint = float(wavelength_nm)
+        if detuning_GHz is not None:
+            self.detuning = float(detuning_GHz)
+
+        setpoint = self.get_setpoint()
+        laser = self.lock.available_lasers[self.laser_name]
+        if setpoint < laser.wl_min or setpoint > laser.wl_max:
+            print(f"Check wavelength of {self.laser_name}")
+            return 0
+
+        self._settings_changed(started = True)
+        future = self.engine.start_lock(self.laser_name, setpoint)
+        future.add_done_callback(self._lock_started)
+        if wait:
+            return self._wait(future, self.start_timeout)
+        return 1
+
+    def _lock_started(self, future):
+        #called in the engine thread after the coarse setting, a lock that did not start is shown as stopped
+        if future.exception() is not None or future.result() == -1:
+            self._settings_changed(stopped = True)
+
+    def stop(self):
+        ret = self._wait(self.engine.stop_lock(), self.command_timeout)
+        self._settings_changed(stopped = True, clearplot = True)
+        return ret
+
+    def pause(self):
+        ret = self._wait(self.engine.pause_lock(), self.command_timeout)
+        self._settings_changed(stopped = True, clearplot = False)
+        return ret
+
+    def change_detuning(self, detuning_GHz):
+        """
+        Use to set the detuning while laser lock is already running (limited range!)
+        """
+        self.detuning = float(detuning_GHz)
+        setpoint = detuned_setpoint(self.wavelength_setpoint, self.detuning)
+        ret = self._wait(self.engine.change_setpoint(setpoint), self.command_timeout)
+        self._settings_changed()
+        return ret
+
+    def autotune(self, wavelength_nm = None, step_voltage = 1.):
+        """
+        Tune the PID gains of the laser at the wavelength (lock stopped), the gains are used by the next locks
+        """
+        return self._calibrate(wavelength_nm, self.lock.autotune_pid, step_voltage,
+                               reading_interval = self.get_update_interval())
+
+    def calibrate_piezo(self, wavelength_nm = None, voltages = (-2., -1., 0., 1., 2.)):
+        """
+        Measure the piezo response of the laser at the wavelength (lock stopped), used to preload the feedback
+        """
+        return self._calibrate(wavelength_nm, self.lock.calibrate_piezo, tuple(voltages),
+                               reading_interval = self.get_update_interval())
+
+    def _calibrate(self, wavelength_nm, calibration, *args, **kwargs):
+        #run the calibration at the coarse wavelength on the thread of the engine
+        if self.get_is_running():
+            print("Stop the lock before the calibration")
+            return None
+        if wavelength_nm is not None:
+            self.wavelength_setpoint = float(wavelength_nm)
+        setpoint = self.get_setpoint()
+
+        def calibrate():
+            self.lock.initialize_lock(self.laser_name, setpoint)
+            self.lock.set_coarse_wavelength(setpoint)
+            result = calibration(*args, **kwargs)
+            self.lock.terminate_lock()
+            return result
+        return self._call(calibrate, timeout = self.calibration_timeout, error = None)
+
+    def set_sample_mode(self, true_interval = True, max_sample_interval = 1.):
+        """
+        PID on the real interval between new wavemeter readings (see laserWLMLock.set_sample_mode)
+        """
+        return self._call(self.lock.set_sample_mode, true_interval, max_sample_interval)
+
+    def enable_estimator(self, mhz_per_volt = None, query_timeout = 0.1):
+        """
+        Correct the drift between the wavemeter slots (see laserWLMLock.enable_estimator)
+        """
+        return self._call(self.lock.enable_estimator, mhz_per_volt, query_timeout, error = False)
+
+    def disable_estimator(self):
+        return self._call(self.lock.disable_estimator)
+
+    def _call(self, function, *args, timeout = None, error = -1):
+        #function of the lock run between two updates, directly without an engine
+        if self.engine is None:
+            return function(*args)
+        timeout = self.command_timeout if timeout is None else timeout
+        return self._wait(self.engine.call(function, *args), timeout, error)
+
+    def _wait(self, future, timeout, error = -1):
+        #result of an engine command, error if the engine did not run it within timeout (the command stays queued)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            print(f"WARNING: lock engine of {self.laser_name} busy, command not done after {timeout:.1f} s")
+            return error
+
+    def get_is_running(self):
+        return self.engine.is_running
+
+    def get_update_interval(self):
+        return self.engine.update_interval
+
+    def get_lock_state(self):
+        #last update of the lock, see lockEngine.get_state
+        return self.engine.get_state()
+
+    def get_wavelength(self):
+        state = self.get_lock_state()
+        if state['updates'] == 0:
+            return None
+        return state['wavelength']
+
+    def get_state(self):
+        #settings and the last update of the lock in one call
+        state = self.get_lock_state()
+        state['laser'] = self.laser_name
+        state['wavelength_setpoint'] = self.wavelength_setpoint
+        state['detuning'] = self.detuning
+        wl = state['wavelength']
+        if state['updates'] > 0 and wl > 0 and state['setpoint'] > 0:
+            state['lock_error'] = -(SPEED_OF_LIGHT/(wl*1e-9) - SPEED_OF_LIGHT/(state['setpoint']*1e-9))/1e6 #MHz
+        else:
+            state['lock_error'] = None
+        state['outlier_filter'] = self.lock.get_outlier_stats()
+        state['stale_readings'] = self.lock.stale_readings
+        state['feedback_writer'] = self.lock.get_feedback_stats()
+        estimator = self.lock.estimator
+        state['drift_rate'] = float(estimator.drift_rate) if estimator is not None and estimator.initialized else None #MHz/s
+        return state
+
+    def get_outlier_stats(self):
+        return self.lock.get_outlier_stats()
+
+    def snapshot(self):
+        snapshot = {}
+        snapshot['current_wavelength'] = self.get_wavelength()
+        snapshot['wavelength_setpoint'] = self.get_wavelength_setpoint()
+        snapshot['detuning'] = self.get_detuning()
+        snapshot['running'] = self.get_is_running()
+        return snapshot
+
+    def _settings_changed(self, started = False, stopped = False, clearplot = False):
+        #called after every change of the settings, to be used by subclasses to update a viewer
+        pass
@@ -0,0 +1,207 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Headless lock engine running the lock of a laserWLMLock in its own thread, independently of any GUI.
+
+The lock is updated at a fixed rate: the time of the next update is incremented by the update
+interval at every update, so the time spent in update_piezo (waiting for the wavemeter slot,
+writing the feedback) does not accumulate as drift. If an update takes longer than the interval
+the missed updates are skipped (and counted) instead of being run back to back.
+
+All the operations on the lock (start, stop, setpoint changes, ...) are put in a command queue and
+executed by the engine thread, so they can be called from any thread (GUI, Pyro, console).
+Every command returns a concurrent.futures.Future with the result of the command.
+
+Viewers (e.g. laserLockGUI) register a listener that is called from the engine thread with the
+state of the lock after every update and every command.
+
+    example of usage:
+        lock = laserWLMLock(ctl2, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX')
+        engine = lockEngine(lock, update_interval = 0.2)
+        engine.start_lock('CTL2', 1550.1).result()  #wait for the coarse wavelength to be set, -1 if it failed
+        engine.get_state()
+        engine.stop_lock()
+
+'''
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class lockEngine():
+    def __init__(self, lock, update_interval = 0.2):
+        self.lock = lock
+        self.update_interval = update_interval #s
+
+        self.commands = queue.Queue()
+        self.listeners = []
+
+        self.is_running = False
+        self.start_time = 0.
+        self._next_update = 0.
+        self._state_lock = threading.Lock()
+        self._state = {'laser'        : None,
+                       'running'      : False,
+                       'setpoint'     : 0.,
+                       'wavelength'   : 0.,
+                       'feedback'     : 0.,
+                       'timestamp'    : 0.,
+                       'lock_time'    : 0.,
+                       'updates'      : 0,
+                       'missed_updates' : 0}
+
+        self._thread = threading.Thread(None, self._run, 'lock_engine', daemon=True)
+        self._thread.start()
+
+    #----commands, thread safe----
+
+    def start_lock(self, laser_name, setpoint):
+        return self._put(self._start_lock, laser_name, setpoint)
+
+    def stop_lock(self):
+        return self._put(self._end_lock, True)
+
+    def pause_lock(self):
+        return self._put(self._end_lock, False)
+
+    def change_setpoint(self, setpoint):
+        return self._put(self._change_setpoint, setpoint)
+
+    def set_update_interval(self, update_interval):
+        return self._put(self._set_update_interval, update_interval)
+
+    def call(self, function, *args, **kwargs):
+        #run any function in the engine thread, between two updates of the lock
+        return self._put(function, *args, **kwargs)
+
+    def shutdown(self):
+        future = self._put(self._shutdown)
+        self._thread.join()
+        return future
+
+    def add_listener(self, callback):
+        #callback(state) called in the engine thread after every update of the lock
+        self.listeners.append(callback)
+
+    def get_state(self):
+        with self._state_lock:
+            return dict(self._state)
+
+    #----engine thread----
+
+    def _put(self, function, *args, **kwargs):
+        future = Future()
+        self.commands.put((future, function, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            if self.is_running:
+                timeout = max(0., self._next_update - time.monotonic())
+            else:
+                timeout = None
+            try:
+                future, function, args, kwargs = self.commands.get(timeout=timeout)
+            except queue.Empty:
+                self._update()
+                continue
+
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            if function == self._shutdown:
+                return
+            self._notify()
+
+    def _update(self):
+        try:
+            feedback_val, wl = self.lock.update_piezo(time.time() - self.start_time)
+        except Exception as e:
+            print(f'ERROR in lock update: {e}')
+            feedback_val, wl = self._state['feedback'], self._state['wavelength']
+
+        with self._state_lock:
+            self._state['feedback'] = feedback_val
+            self._state['wavelength'] = wl
+            self._state['timestamp'] = time.time()
+            self._state['lock_time'] = time.time() - self.start_time
+            self._state['updates'] += 1
+
+        #fixed rate: skip the updates that could not be done in time instead of accumulating delay
+        self._next_update += self.update_interval
+        now = time.monotonic()
+        if now > self._next_update:
+            missed = int((now - self._next_update)/self.update_interval) + 1
+            self._next_update += missed*self.update_interval
+            with self._state_lock:
+                self._state['missed_updates'] += missed
+
+        self._notify()
+
+    def _notify(self):
+        state = self.get_state()
+        for callback in self.listeners:
+            try:
+                callback(state)
+            except Exception as e:
+                print(f'ERROR in lock listener: {e}')
+
+    def _start_lock(self, laser_name, setpoint):
+        if self.is_running:
+            self._end_lock(False)
+        self.lock.initialize_lock(laser_name, setpoint)
+        print(f"Starting Lock for {laser_name} with setpt {setpoint} nm")
+        if self.lock.set_coarse_wavelength(setpoint) == -1:
+            #too far from the setpoint for the PID, the lock is not started
+            print(f"Lock for {laser_name} not started, coarse wavelength not reached")
+            self.lock.terminate_lock()
+            return -1
+
+        self.start_time = time.time()
+        self._next_update = time.monotonic() + self.update_interval
+        self.is_running = True
+        with self._state_lock:
+            self._state.update({'laser' : laser_name, 'running' : True, 'setpoint' : setpoint,
+                                'feedback' : 0., 'lock_time' : 0., 'updates' : 0, 'missed_updates' : 0})
+        return 1
+
+    def _end_lock(self, reset_feedback):
+        if not self.is_running:
+            return 0
+        self.is_running = False
+        if reset_feedback:
+            self.lock.terminate_lock()
+        else:
+            self.lock.pause_lock()
+        with self._state_lock:
+            self._state['running'] = False
+            if reset_feedback:
+                self._state['feedback'] = 0.
+        return 1
+
+    def _change_setpoint(self, setpoint):
+        self.lock.change_pid_setpt(setpoint)
+        with self._state_lock:
+            self._state['setpoint'] = setpoint
+        return 1
+
+    def _set_update_interval(self, update_interval):
+        self.update_interval = update_interval
+        self._next_update = time.monotonic() + update_interval
+        return 1
+
+    def _shutdown(self):
+        self._end_lock(False)
+        return 1
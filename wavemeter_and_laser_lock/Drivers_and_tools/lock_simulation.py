@@ -0,0 +1,237 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Simulated hardware to run laserWLMLock without laser, wavemeter or switch, on a virtual clock.
+
+    - virtualClock: time that only moves when advanced, used as time source of the PID
+    - simulatedLaser: laser following the templateLaser of laser_lock.py, with frequency drift,
+      coarse setting offset and piezo response (MHz/V, with delay)
+    - simulatedWavemeter: same interface as the WS6Server (register_user, query_wavelength ...),
+      time multiplexed between n_users, with reading noise and occasional wrong readings. As on the
+      server the wavemeter is read every reading_interval, queries in between get the same reading
+
+Waiting for the wavemeter slot only advances the virtual clock, so hours of lock run in a fraction
+of a second, and with the same seed the run is exactly reproducible. The lock applies the feedback
+synchronously (feedback_writer = False), so that it follows the virtual clock too.
+
+    example of usage:
+        clock = virtualClock()
+        laser = simulatedLaser('SIM', clock, seed = 1)
+        wlm = simulatedWavemeter(clock, laser, n_users = 3, seed = 2)
+        lock = laserWLMLock(laser, wlm_address = None, wlm = wlm, time_source = clock.time, sleep = clock.sleep,
+                            calibration_store = calibrationStore(None), feedback_writer = False)
+        trace = run_simulated_lock(lock, clock, 'SIM', 1550.1, duration = 3600.)
+        np.std(trace['error'])   #MHz
+
+'''
+
+from collections import deque
+import numpy as np
+
+
+SPEED_OF_LIGHT = 299792458
+
+
+def wavelength_to_frequency(wavelength_nm):
+    #MHz
+    return SPEED_OF_LIGHT/(wavelength_nm*1e-9)/1e6
+
+def frequency_to_wavelength(frequency_MHz):
+    #nm
+    return SPEED_OF_LIGHT/(frequency_MHz*1e6)*1e9
+
+
+class virtualClock():
+    def __init__(self, start = 0.):
+        self.t = start
+
+    def time(self):
+        return self.t
+
+    def advance(self, dt):
+        self.t += dt
+
+    def sleep(self, dt):
+        self.advance(dt)
+
+
+class simulatedLaser():
+    def __init__(self, name, clock, pid_p = 0., pid_i = -1000., min_out = -10., max_out = 10., \
+                 coarse_setting_accuracy = 500., mhz_per_volt = 400., piezo_delay = 0.05, \
+                 drift_rate = 0.5, drift_noise = 2., coarse_offset = 0.003, coarse_error = 0.001, \
+                 coarse_time = 2., seed = None):
+        #--------PARAMETERS (as the real lasers)----------
+        self.name = name
+        self.pid_p = pid_p
+        self.pid_i = pid_i
+        self.min_out = min_out
+        self.max_out = max_out
+        self.wl_min = 1460.
+        self.wl_max = 1570.
+        self.coarse_setting_accuracy = coarse_setting_accuracy  #MHz
+
+        #--------SIMULATION----------
+        self.clock = clock
+        self.rng = np.random.default_rng(seed)
+        self.mhz_per_volt = mhz_per_volt #frequency change per volt of feedback
+        self.piezo_delay = piezo_delay #s, time for the feedback to act on the frequency
+        self.drift_rate = drift_rate #MHz/s, linear drift
+        self.drift_noise = drift_noise #MHz/sqrt(s), random walk
+        self.coarse_offset = coarse_offset #nm, systematic offset between set and actual wavelength
+        self.coarse_error = coarse_error #nm, random error of every coarse setting
+        self.coarse_time = coarse_time #s, time for the motor to move
+
+        self.base_frequency = wavelength_to_frequency(1550.)
+        self.drift = 0.
+        self._last_time = clock.time()
+        self.feedback_history = deque([(-np.inf, 0.)])
+        self.connected = False
+
+    def connect_laser(self):
+        self.connected = True
+
+    def disconnect_laser(self, reset_feedback = False):
+        if reset_feedback:
+            self.apply_feedback(0.)
+        self.connected = False
+
+    def set_wavelength_coarse(self, set_wavelength):
+        self.clock.advance(self.coarse_time)
+        actual = set_wavelength + self.coarse_offset + self.rng.normal(0., self.coarse_error)
+        self.base_frequency = wavelength_to_frequency(actual)
+        self.drift = 0.
+        self._last_time = self.clock.time()
+        self.apply_feedback(0.)
+        return 1
+
+    def correct_wavelength_offset(self, set_wavelength, actual_wavelength):
+        return 1
+
+    def apply_feedback(self, value):
+        value = min(max(value, self.min_out), self.max_out)
+        self.feedback_history.append((self.clock.time(), value))
+
+    def get_feedback(self, t = None):
+        #feedback acting on the laser at time t, taking into account the piezo delay
+        t = self.clock.time() if t is None else t
+        while len(self.feedback_history) > 1 and self.feedback_history[1][0] + self.piezo_delay <= t:
+            self.feedback_history.popleft()
+        return self.feedback_history[0][1]
+
+    def frequency(self):
+        #MHz, the drift is integrated up to the current time
+        t = self.clock.time()
+        dt = t - self._last_time
+        if dt > 0:
+            self.drift += self.drift_rate*dt + self.drift_noise*np.sqrt(dt)*self.rng.normal()
+            self._last_time = t
+        return self.base_frequency + self.drift + self.mhz_per_volt*self.get_feedback(t)
+
+    def wavelength(self):
+        return frequency_to_wavelength(self.frequency())
+
+
+class simulatedWavemeter():
+    def __init__(self, clock, *lasers, n_users = 1, slot_length = 0.5, switch_time = 0.2, \
+                 reading_noise = 0.5, outlier_probability = 0.002, outlier_size = 300., reading_interval = 0.1, seed = None):
+        self.clock = clock
+        self.lasers = {l.name : l for l in lasers}
+        self.users = {}
+        self.rng = np.random.default_rng(seed)
+
+        #the lasers share the wavemeter with n_users-1 other users, every user gets a slot in turn
+        self.n_users = max(n_users, len(lasers))
+        self.slot_length = slot_length #s
+        self.switch_time = switch_time #s
+        self.reading_noise = reading_noise #MHz
+        self.outlier_probability = outlier_probability
+        self.outlier_size = outlier_size #MHz
+        self.reading_interval = reading_interval #s
+        self.reading = (0., 0., -1)
+
+    def register_user(self, name, slot_length = 0.5):
+        if name not in self.lasers:
+            return -1
+        self.users[name] = [slot_length, self.clock.time(), np.nan]
+        return 1
+
+    def deregister_user(self, name):
+        if name not in self.users:
+            return 0
+        del self.users[name]
+        return 1
+
+    def query_users(self):
+        return list(self.users.keys())
+
+    def slot_period(self):
+        return self.n_users*(self.slot_length + self.switch_time)
+
+    def wait_for_slot(self, name, timeout = 10.):
+        #advance the clock to the slot of the user (if not in it already), False if it does not start within timeout
+        period = self.slot_period()
+        slot_start = list(self.lasers.keys()).index(name)*(self.slot_length + self.switch_time) + self.switch_time
+        phase = (self.clock.time() - slot_start) % period
+        if phase >= self.slot_length:
+            if period - phase > timeout:
+                self.clock.advance(timeout)
+                return False
+            self.clock.advance(period - phase)
+        return True
+
+    def query_wavelength(self, usr, timeout = 10.):
+        return self.query_wavelength_stamped(usr, timeout)[0]
+
+    def query_wavelength_stamped(self, usr, timeout = 10.):
+        if usr not in self.users:
+            return (-1, 0., -1)
+        if not self.wait_for_slot(usr, timeout):
+            return (0, 0., -1)
+        sequence = int(self.clock.time()//self.reading_interval)
+        if sequence != self.reading[2]:
+            frequency = self.lasers[usr].frequency() + self.rng.normal(0., self.reading_noise)
+            if self.rng.random() < self.outlier_probability:
+                frequency += self.outlier_size*self.rng.choice([-1., 1.])
+            self.reading = (frequency_to_wavelength(frequency), self.clock.time(), sequence)
+        self.users[usr][1] = self.clock.time()
+        self.users[usr][2] = self.reading[0]
+        return self.reading
+
+
+def run_simulated_lock(lock, clock, laser_name, setpoint, duration, update_interval = 0.2):
+    '''
+    run the lock on simulated hardware for duration seconds of the virtual clock,
+    returns the time, wavemeter reading (0 if no reading), error of the reading (MHz), feedback (V) and
+    actual frequency error of the laser (MHz) of every update
+    '''
+    lock.initialize_lock(laser_name, setpoint)
+    lock.set_coarse_wavelength(setpoint)
+
+    laser = lock.available_lasers[laser_name]
+    t, wavelength, feedback, laser_error = [], [], [], []
+    start_time = clock.time()
+    while clock.time() - start_time < duration:
+        feedback_val, act_wl = lock.update_piezo(clock.time() - start_time)
+        t.append(clock.time() - start_time)
+        wavelength.append(act_wl)
+        feedback.append(feedback_val)
+        laser_error.append(laser.frequency() - wavelength_to_frequency(setpoint))
+        clock.advance(update_interval)
+
+    lock.terminate_lock()
+    wavelength = np.array(wavelength, dtype = float)
+    error = np.full(len(wavelength), np.nan)
+    read = wavelength > 0
+    error[read] = wavelength_to_frequency(wavelength[read]) - wavelength_to_frequency(setpoint)
+    return {'t'           : np.array(t),
+            'wavelength'  : wavelength,
+            'error'       : error,
+            'feedback'    : np.array(feedback),
+            'laser_error' : np.array(laser_error)}
@@ -0,0 +1,130 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Streaming Hampel filter to reject wrong wavemeter readings before they reach the PID, used in laserWLMLock.
+
+A reading is rejected if it is further than n_sigmas*scale (and at least min_threshold) from the median
+of the last window_length accepted readings. The window is kept sorted (bisect), so the median is a
+lookup and every sample costs a binary search and a short list insert/delete, constant for the small
+windows used here. The scale is an exponentially weighted mean of the absolute deviations from the
+median of the accepted readings (converted to a standard deviation), updated in O(1) per sample.
+
+If max_consecutive_rejections readings in a row are rejected the laser really moved (e.g. mode hop),
+the window is restarted from the last reading instead of holding the lock forever.
+When the laser is expected to move (coarse setting, setpoint change) the window is restarted with
+reset(bypass = n): the next n readings are accepted without check and the scale follows the move.
+
+    example of usage:
+        f = hampelFilter(window_length = 11)
+        for freq in readings_MHz:
+            if f.check(freq):
+                feedback = pid.update(...)
+        f.get_stats()
+
+'''
+
+import bisect
+from collections import deque
+
+
+class hampelFilter():
+    def __init__(self, window_length = 11, n_sigmas = 5., min_threshold = 20., max_consecutive_rejections = 5):
+        self.window_length = window_length
+        self.n_sigmas = n_sigmas
+        self.min_threshold = min_threshold #same units as the values, MHz in laserWLMLock
+        self.max_consecutive_rejections = max_consecutive_rejections
+        self.min_samples = 3 #readings accepted without check when the window is (re)started
+
+        #mean absolute deviation to standard deviation for gaussian noise
+        self.mad_to_sigma = 1.2533
+        self.alpha = 2./(window_length+1)
+
+        self.clear_stats()
+        self.reset()
+
+    def reset(self, bypass = 0):
+        #restart the window, e.g. after a setpoint change, the next bypass readings are accepted without check
+        self.window = deque()
+        self.sorted_window = []
+        self.scale = 0.
+        self.consecutive_rejections = 0
+        self.bypass = bypass
+
+    def clear_stats(self):
+        self.stats = {'accepted'            : 0,
+                      'rejected'            : 0,
+                      'invalid'             : 0,
+                      'restarts'            : 0,
+                      'bypassed'            : 0,
+                      'last_rejected'       : None,
+                      'last_rejected_deviation' : None,
+                      'max_rejected_deviation'  : 0.}
+
+    def median(self):
+        n = len(self.sorted_window)
+        if n % 2:
+            return self.sorted_window[n//2]
+        return 0.5*(self.sorted_window[n//2-1] + self.sorted_window[n//2])
+
+    def get_threshold(self):
+        return max(self.n_sigmas*self.scale, self.min_threshold)
+
+    def check(self, value):
+        #return True if the value is accepted (and add it to the window)
+        if len(self.window) < self.min_samples:
+            self._add(value)
+            return True
+        if self.bypass > 0:
+            #the laser is moving, follow it
+            self.bypass -= 1
+            self.stats['bypassed'] += 1
+            self.scale += self.alpha*(self.mad_to_sigma*abs(value - self.median()) - self.scale)
+            self._add(value)
+            return True
+
+        deviation = abs(value - self.median())
+        if deviation > self.get_threshold():
+            self.consecutive_rejections += 1
+            if self.consecutive_rejections < self.max_consecutive_rejections:
+                self.stats['rejected'] += 1
+                self.stats['last_rejected'] = value
+                self.stats['last_rejected_deviation'] = deviation
+                self.stats['max_rejected_deviation'] = max(self.stats['max_rejected_deviation'], deviation)
+                return False
+            #too many rejections in a row, the readings are right and the laser moved
+            self.stats['restarts'] += 1
+            self.reset()
+            self._add(value)
+            return True
+
+        self.consecutive_rejections = 0
+        self.scale += self.alpha*(self.mad_to_sigma*deviation - self.scale)
+        self._add(value)
+        return True
+
+    def add_invalid(self):
+        #count a reading that could not even be converted (e.g. wavemeter error codes)
+        self.stats['invalid'] += 1
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        n = stats['accepted'] + stats['rejected']
+        stats['rejected_fraction'] = stats['rejected']/n if n else 0.
+        stats['threshold'] = self.get_threshold()
+        stats['window_length'] = self.window_length
+        return stats
+
+    def _add(self, value):
+        self.stats['accepted'] += 1
+        self.window.append(value)
+        bisect.insort(self.sorted_window, value)
+        if len(self.window) > self.window_length:
+            old = self.window.popleft()
+            del self.sorted_window[bisect.bisect_left(self.sorted_window, old)]
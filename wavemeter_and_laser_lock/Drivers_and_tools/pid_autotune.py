@@ -0,0 +1,211 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Automatic tuning of the PID gains of a laser lock, used in laserWLMLock.autotune_pid.
+
+    1 - step response: a voltage step is applied with lock.apply_feedback while reading the wavemeter
+    2 - identification: the piezo to frequency gain (MHz/V, the drift measured before the step is removed)
+        and the delay between the step and the first reading that shows it (wavemeter sampling + piezo)
+    3 - gains: starting from the IMC (lambda tuning) integral gain of a static plant with delay, the
+        integral gains around it are simulated with a PIDBank and the one with the shortest settling
+        time after a frequency step is chosen. The PID of the lock is an integrator on a static plant,
+        so pid_p is 0 as in the hand tuned lasers, and the windup guard is set so that the integrator
+        can cover the whole output range of the laser.
+
+measure_piezo_response is a slower and more accurate measurement of the piezo gain alone, used in
+laserWLMLock.calibrate_piezo: the wavemeter is read at several feedback voltages and the frequencies
+are fitted with the piezo gain and a linear drift of the laser.
+
+A measurement with too few readings, or a piezo response below MIN_MHZ_PER_VOLT or within the noise of
+the readings (wavemeter not reading the laser, piezo not connected ...) is rejected: the functions
+return None instead of gains, and nothing is saved by laserWLMLock.
+
+Works on a real laser or on the simulated hardware of lock_simulation.
+
+'''
+
+import datetime
+import numpy as np
+
+from PID_bank import settling_times
+
+
+SPEED_OF_LIGHT = 299792458
+
+MIN_READINGS = 3 #valid readings needed before and after the step
+MIN_MHZ_PER_VOLT = 1. #smaller piezo responses are not a plant to tune on
+
+
+def _read_frequencies(lock, n_readings, reading_interval, max_tries = 3):
+    #n_readings valid wavemeter readings, reading_interval apart as in the lock, as (time, frequency in MHz)
+    readings = []
+    tries = 0
+    while len(readings) < n_readings and tries < max_tries*n_readings:
+        tries += 1
+        lock.sleep(reading_interval)
+        act_wl = lock.get_wavelengt()
+        if act_wl is None or act_wl <= 0:
+            continue
+        readings.append((lock.time_source(), SPEED_OF_LIGHT/(act_wl*1e-9)/1e6))
+    return np.array(readings).reshape(-1, 2)
+
+
+def _apply_feedback(lock, value):
+    #through the feedback writer of the lock (if any), and wait until the laser has the value
+    lock.apply_feedback(value)
+    lock.flush_feedback()
+
+
+def measure_step_response(lock, step_voltage = 1., n_baseline = 6, n_step = 10, base_voltage = 0., reading_interval = 0.2):
+    '''
+    readings before and after a step of the feedback from base_voltage to base_voltage+step_voltage,
+    the feedback is set back to base_voltage at the end
+    '''
+    #a preload can still be written, wait for it before the measurement
+    lock.flush_feedback(reset = True)
+    _apply_feedback(lock, base_voltage)
+    baseline = _read_frequencies(lock, n_baseline, reading_interval)
+    step_time = lock.time_source()
+    _apply_feedback(lock, base_voltage + step_voltage)
+    step = _read_frequencies(lock, n_step, reading_interval)
+    _apply_feedback(lock, base_voltage)
+    return {'baseline' : baseline, 'step' : step, 'step_time' : step_time, 'step_voltage' : step_voltage}
+
+
+def measure_piezo_response(lock, voltages = (-2., -1., 0., 1., 2.), n_readings = 4, base_voltage = 0., reading_interval = 0.2):
+    '''
+    piezo gain (MHz/V) from n_readings at every feedback voltage around base_voltage, fitted together with
+    the drift of the laser. The first reading after every change of the voltage is not used (piezo delay)
+    '''
+    lock.flush_feedback(reset = True)
+    rows, frequencies = [], []
+    for v in voltages:
+        _apply_feedback(lock, base_voltage + v)
+        for t, f in _read_frequencies(lock, n_readings + 1, reading_interval)[1:]:
+            rows.append([1., v, t])
+            frequencies.append(f)
+    _apply_feedback(lock, base_voltage)
+
+    if len(set(row[1] for row in rows)) < 2 or len(rows) < MIN_READINGS:
+        print(f"WARNING: piezo response not measured, {len(rows)} valid readings")
+        return None
+    rows = np.array(rows)
+    rows[:,2] -= rows[0,2]
+    frequencies = np.array(frequencies)
+    coefficients = np.linalg.lstsq(rows, frequencies, rcond = None)[0]
+    residual = frequencies - rows @ coefficients
+    if abs(coefficients[1]) < MIN_MHZ_PER_VOLT:
+        print(f"WARNING: piezo response of {coefficients[1]:.2f} MHz/V, the laser does not follow the feedback")
+        return None
+    return {'mhz_per_volt' : float(coefficients[1]),
+            'drift_rate'   : float(coefficients[2]), #MHz/s
+            'residual'     : float(np.std(residual)), #MHz
+            'n_readings'   : len(frequencies),
+            'date'         : datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+
+
+def identify_plant(response):
+    '''
+    piezo gain (MHz/V), delay (s and number of readings), mean and longest interval between the readings (s) from a step response,
+    None if the step is not seen (too few readings, response below MIN_MHZ_PER_VOLT or within 3 times the reading noise)
+    '''
+    baseline, step = response['baseline'], response['step']
+    if len(baseline) < MIN_READINGS or len(step) < MIN_READINGS:
+        print(f"WARNING: step response not usable, {len(baseline)} readings before and {len(step)} after the step")
+        return None
+    #remove the drift of the laser, fitted on the readings before the step
+    drift = np.polyfit(baseline[:,0], baseline[:,1], 1)
+    noise = np.std(baseline[:,1] - np.polyval(drift, baseline[:,0]))
+    change = step[:,1] - np.polyval(drift, step[:,0])
+
+    #final value from the second half of the readings after the step
+    final = np.mean(change[len(change)//2:])
+    mhz_per_volt = final/response['step_voltage']
+    if abs(mhz_per_volt) < MIN_MHZ_PER_VOLT or abs(final) < 3*noise:
+        print(f"WARNING: step response not usable, {final:.1f} MHz for {response['step_voltage']} V with {noise:.1f} MHz noise")
+        return None
+
+    #first reading that moved by more than half of the final change
+    moved = np.nonzero(np.abs(change) > 0.5*abs(final))[0]
+    first = moved[0] if len(moved) else 0
+    delay = step[first,0] - response['step_time']
+
+    times = np.concatenate([baseline[:,0], step[:,0]])
+    #mean, the readings come in bursts during the slot of the laser
+    sample_interval = float(np.mean(np.diff(times)))
+    max_interval = float(np.max(np.diff(times)))
+    return {'mhz_per_volt'    : float(mhz_per_volt),
+            'delay'           : float(delay),
+            'delay_samples'   : int(first) + 1,
+            'sample_interval' : sample_interval,
+            'max_interval'    : max_interval}
+
+
+def tune_gains(plant, setpoint_wavelength, min_out = -10., max_out = 10., max_update_time = 0.1, \
+               step_MHz = 100., n_samples = 100, true_interval = False):
+    '''
+    integral gain and windup guard with the shortest settling time for the identified plant,
+    None if none of the candidates settles
+    true_interval: gains for the PID in true interval mode, integrating over the real time between the readings
+    up to max_update_time (the max_sample_interval of the PID). Tuned as if every reading came after the longest
+    interval the PID integrates, so the gains stay stable when more users share the wavemeter
+    '''
+    T = plant['sample_interval']
+    if true_interval:
+        T = max(plant['max_interval'], max_update_time)
+    #gain of the plant in nm/V, the PID works on the wavelength
+    nm_per_volt = -(setpoint_wavelength*1e-9)**2*plant['mhz_per_volt']*1e6/SPEED_OF_LIGHT*1e9
+    #PID integrates the error over min(T, max_update_time) at every reading
+    dt = min(T, max_update_time)
+    #in readings, the readings are not evenly spaced (slots of the wavemeter)
+    delay_samples = plant['delay_samples']
+
+    #IMC integral gain for a static plant with dead time, closed loop time constant equal to the dead time
+    dead_time = delay_samples*T
+    ki_imc = T/(dt*nm_per_volt*2*dead_time)
+
+    ki = ki_imc*np.linspace(0.2, 3., 57)
+    output_range = max(abs(min_out), abs(max_out))
+    windup = output_range/np.abs(ki)
+    #all the candidates simulated at once
+    settling = settling_times(np.zeros(len(ki)), ki, step_MHz, n_samples, T, plant['mhz_per_volt'],
+                              setpoint_wavelength = setpoint_wavelength, delay_samples = delay_samples,
+                              windup_guard = windup, min_out = min_out, max_out = max_out,
+                              max_update_time = max_update_time)
+    if not np.isfinite(settling).any():
+        print(f"WARNING: no integral gain settles within {n_samples} readings, plant of {plant['mhz_per_volt']:.1f} MHz/V")
+        return None
+    best = int(np.argmin(settling))
+    return {'pid_p'         : 0.,
+            'pid_i'         : float(ki[best]),
+            'windup_guard'  : float(windup[best]),
+            'settling_time' : float(settling[best])}
+
+
+def autotune(lock, step_voltage = 1., n_baseline = 6, n_step = 10, reading_interval = 0.2):
+    '''
+    step response, identification and gains for the laser of the lock (connected and at the coarse wavelength)
+    reading_interval should be the update interval used by the lock
+    None if the plant could not be identified or no gains settle
+    '''
+    response = measure_step_response(lock, step_voltage, n_baseline, n_step, reading_interval = reading_interval)
+    plant = identify_plant(response)
+    if plant is None:
+        return None
+    max_update_time = lock.pid.max_sample_interval if lock.pid.true_interval else lock.pid.max_update_time
+    gains = tune_gains(plant, lock.pid.SetPoint, lock.laser.min_out, lock.laser.max_out,
+                       max_update_time = max_update_time, true_interval = lock.pid.true_interval)
+    if gains is None:
+        return None
+    result = dict(plant)
+    result.update(gains)
+    result['true_interval'] = bool(lock.pid.true_interval)
+    result['date'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    return result
@@ -0,0 +1,167 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Wavelength scan of a Toptica DLC pro recorded with the wavemeter.
+
+The wavemeter is reserved for the laser during the whole scan (WS6Server.reserve_user): the server reads it
+every reading_interval and keeps every reading, so the capture has no gap even if the readings are fetched
+only from time to time. Meanwhile the actual wavelength of the DLC pro (motor encoder) is read every
+laser_interval, with the state of the laser in the same round trip (TopticaDLCPro.get_status). All the
+samples go in preallocated numpy arrays.
+
+The wavemeter readings calibrate the wavelength of the DLC pro: the difference between the two during the
+scan itself (state 3, not the move to the start) is fitted with a polynomial of the DLC pro wavelength, and
+the calibrated trace has the rate of the DLC pro readings.
+The times are the times of the wavemeter server (the offset of the clocks is measured before the scan).
+
+    example of usage:
+        capture = scanCapture(laser, wlm, 'CTL2')    #TopticaDLCPro, proxy of the WS6Server, user of the laser
+        trace = capture.run(1540., 1550., speed = 5.)
+        plt.plot(trace['time'], trace['wavelength'])
+
+'''
+
+import time
+import numpy as np
+
+
+class scanCapture():
+    def __init__(self, laser, wlm, user, reading_interval = 0.02, laser_interval = 0.01, fetch_interval = 0.5, \
+                 motor_speed = 10.):
+        self.laser = laser #TopticaDLCPro
+        self.wlm = wlm #WS6Server (or a Pyro proxy of it)
+        self.user = user
+        self.reading_interval = reading_interval #s, wavemeter
+        self.laser_interval = laser_interval #s, actual wavelength of the DLC pro
+        self.fetch_interval = fetch_interval #s, between two transfers of the wavemeter readings
+        self.motor_speed = motor_speed #nm/s, to estimate the time to reach the start of the scan
+        self.settle_time = 2. #s, added to the estimated duration of the scan
+
+    def clock_offset(self, n = 5):
+        #time of the wavemeter server - time of this machine, from the call with the shortest round trip
+        best = None
+        for i in range(n):
+            t0 = time.time()
+            server_time = self.wlm.query_server_time()
+            t1 = time.time()
+            if best is None or t1 - t0 < best[0]:
+                best = (t1 - t0, server_time - (t0 + t1)/2)
+        return best[1]
+
+    def estimate_duration(self, start, stop, speed):
+        current = float(self.laser.wavelength())
+        return abs(start - current)/self.motor_speed + abs(stop - start)/speed + self.settle_time
+
+    def run(self, start, stop, speed = 5., extra = 1., timeout = None, deg = 1):
+        '''
+        scan from start to stop (nm) at speed (nm/s), returns the calibrated trace (see calibrate),
+        None if the wavemeter could not be reserved
+        '''
+        duration = self.estimate_duration(start, stop, speed)
+        if timeout is None:
+            timeout = 1.5*duration + 5.
+        offset = self.clock_offset()
+
+        #a user registered only for the scan leaves the slots of the wavemeter after it
+        registered = self.user not in self.wlm.query_users()
+        self.wlm.register_user(self.user)
+        if self.wlm.reserve_user(self.user, timeout, self.reading_interval) != 1:
+            print(f'WARNING: could not reserve the wavemeter for {self.user}')
+            if registered:
+                self.wlm.deregister_user(self.user)
+            return None
+
+        n_laser = int(timeout/self.laser_interval) + 10
+        laser_times, laser_wavelengths = np.zeros(n_laser), np.zeros(n_laser)
+        scanning = np.zeros(n_laser, dtype = bool)
+        n = 0
+        wlm_times, wlm_wavelengths = np.zeros(0), np.zeros(0)
+
+        try:
+            self.laser.scan_wavelength(start, stop, speed, extra)
+            st = time.time()
+            last_fetch = st
+            started = complete = False
+            while time.time() - st < timeout:
+                t0 = time.time()
+                status = self.laser.get_status()
+                t1 = time.time()
+                if n == len(laser_times):
+                    laser_times, laser_wavelengths, scanning = _grow(laser_times), _grow(laser_wavelengths), _grow(scanning)
+                laser_times[n] = (t0 + t1)/2 + offset
+                laser_wavelengths[n] = status['wavelength']
+                scanning[n] = status['state'] == '3'
+                n += 1
+
+                if status['state'] != '0':
+                    started = True
+                elif started:
+                    complete = True
+                    break
+
+                if t1 - last_fetch > self.fetch_interval:
+                    wlm_times, wlm_wavelengths = self._fetch(wlm_times, wlm_wavelengths)
+                    last_fetch = t1
+                time.sleep(max(self.laser_interval - (time.time() - t0), 0.))
+        finally:
+            self.wlm.release_user(self.user)
+            if registered:
+                self.wlm.deregister_user(self.user)
+        #the readings of the reservation are kept after the release
+        wlm_times, wlm_wavelengths = self._fetch(wlm_times, wlm_wavelengths)
+
+        trace = self.calibrate(laser_times[:n], laser_wavelengths[:n], wlm_times, wlm_wavelengths, deg, scanning[:n])
+        trace['complete'] = complete
+        trace['clock_offset'] = offset
+        if not complete:
+            print(f'WARNING: scan of {self.user} not finished after {timeout:.1f} s')
+        return trace
+
+    def _fetch(self, times, wavelengths):
+        #readings of the wavemeter since the last transfer
+        new_times, new_wavelengths = self.wlm.query_capture(self.user, len(times))
+        if not new_times:
+            return times, wavelengths
+        return np.concatenate((times, new_times)), np.concatenate((wavelengths, new_wavelengths))
+
+    @staticmethod
+    def calibrate(laser_times, laser_wavelengths, wlm_times, wlm_wavelengths, deg = 1, scanning = None):
+        '''
+        wavelength of the DLC pro corrected with the wavemeter: wlm - laser fitted with a polynomial of degree deg
+        of the laser wavelength, only with the valid wavemeter readings during the laser readings marked as
+        scanning (all of them if None)
+        '''
+        trace = {'time'              : laser_times,
+                 'laser_wavelength'  : laser_wavelengths,
+                 'scanning'          : scanning,
+                 'wlm_time'          : wlm_times,
+                 'wlm_wavelength'    : wlm_wavelengths,
+                 'max_wlm_gap'       : float(np.max(np.diff(wlm_times))) if len(wlm_times) > 1 else None}
+        valid = wlm_wavelengths > 0
+        window = laser_times if scanning is None or not np.any(scanning) else laser_times[scanning]
+        if len(window) > 1:
+            valid &= (wlm_times >= window[0]) & (wlm_times <= window[-1])
+        if len(laser_times) < 2 or np.count_nonzero(valid) <= deg:
+            print('WARNING: not enough wavemeter readings to calibrate the scan')
+            trace.update({'wavelength' : laser_wavelengths.copy(), 'correction' : None, 'residual_rms' : None})
+            return trace
+        laser_at_wlm = np.interp(wlm_times[valid], laser_times, laser_wavelengths)
+        difference = wlm_wavelengths[valid] - laser_at_wlm
+        correction = np.polyfit(laser_at_wlm, difference, deg)
+        residuals = difference - np.polyval(correction, laser_at_wlm)
+        trace.update({'wavelength'   : laser_wavelengths + np.polyval(correction, laser_wavelengths),
+                      'correction'   : correction,
+                      'residual_rms' : float(np.sqrt(np.mean(residuals**2)))}) #nm
+        return trace
+
+
+def _grow(array):
+    #twice the size, the scan took longer than expected
+    return np.concatenate((array, np.zeros(len(array), dtype = array.dtype)))
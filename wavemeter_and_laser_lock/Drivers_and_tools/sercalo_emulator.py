@@ -0,0 +1,193 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Emulator of a Sercalo 1xN switch on a pseudo terminal (Linux), to run SercaloSwitch and the switching of the
+WS6Server without the switch and its FTDI cable.
+
+    - protocol of the driver: \\xEF\\xEF requests and \\xfe\\xfe replies with checksum, product info, get channel,
+      set channel and reset, with the error codes of the switch (invalid command, invalid parameter, command
+      fail, checksum error)
+    - switching_delay (s) before the reply to a set channel, reply_delay (s) before every reply
+    - faults: inject(fault, count) for the next replies, or fault_probabilities for random ones
+        'garbage'  : random bytes before the reply
+        'timeout'  : no reply
+        'partial'  : only the first half of the reply
+        'checksum' : wrong checksum in the reply
+        'fail'     : the command fails (error 3)
+
+    example of usage:
+        emulator = sercaloEmulator(switching_delay = 0.005)
+        emulator.start()
+        sw = SercaloSwitch(emulator.port)    #e.g. /dev/pts/3
+        emulator.inject('garbage')
+        sw.set_channel(3)
+        emulator.stop()
+
+'''
+
+import os
+import pty
+import tty
+import time
+import random
+import select
+import threading
+
+
+REQUEST_PRE = b'\xEF\xEF'
+REPLY_PRE = b'\xfe\xfe'
+
+FAULTS = ('garbage', 'timeout', 'partial', 'checksum', 'fail')
+
+
+class sercaloEmulator():
+    def __init__(self, number_of_channels = 8, switching_delay = 0.01, reply_delay = 0., channel = 1, \
+                 fault_probabilities = None, serial_number = 'EMU0001', seed = None):
+        self.number_of_channels = number_of_channels
+        self.switching_delay = switching_delay #s
+        self.reply_delay = reply_delay #s
+        self.initial_channel = channel
+        self.channel = channel
+        self.fault_probabilities = fault_probabilities if fault_probabilities is not None else {}
+        self.serial_number = serial_number
+        self.rng = random.Random(seed)
+
+        self.port = None #path of the terminal to open with SercaloSwitch
+        self.running = False
+        self._master = self._slave = None
+        self._faults = []
+        self._lock = threading.Lock()
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.stats = {'requests' : 0, 'switches' : 0, 'errors' : 0, 'faults' : 0}
+
+    def start(self):
+        self._master, self._slave = pty.openpty()
+        tty.setraw(self._slave) #binary frames, no echo or line editing
+        self.port = os.ttyname(self._slave)
+        self.running = True
+        threading.Thread(target = self._run, name = 'Sercalo emulator', daemon = True).start()
+
+    def stop(self):
+        self.running = False
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+        self._master = self._slave = None
+
+    def inject(self, fault, count = 1):
+        #the next count replies have the fault
+        if fault not in FAULTS:
+            raise ValueError(f'Unknown fault {fault}, use one of {FAULTS}')
+        with self._lock:
+            self._faults += [fault]*count
+
+    def _next_fault(self):
+        with self._lock:
+            if self._faults:
+                return self._faults.pop(0)
+        for fault, probability in self.fault_probabilities.items():
+            if self.rng.random() < probability:
+                return fault
+        return None
+
+    #--------PROTOCOL----------
+    @staticmethod
+    def _checksum(m):
+        return sum(m) & 0xFF
+
+    def _reply(self, address, command, error, data = b''):
+        body = bytes((address, command, error)) + data
+        m = REPLY_PRE + bytes((len(body) + 1,)) + body
+        return m + bytes((self._checksum(m),))
+
+    def _product_info(self):
+        vendor = 'SERCALO'.ljust(10, ';').encode()
+        s_type = f'RSC1x{self.number_of_channels}'.ljust(10, ';').encode()
+        #unused byte, hardware and firmware version, production date (YY yy MM DD)
+        numbers = bytes((0, 1, 0, 2, 5, 20, 26, 1, 1))
+        return vendor + s_type + numbers + self.serial_number.ljust(10, ';').encode()
+
+    def handle(self, request):
+        '''
+        reply to one request frame (with the \\xEF\\xEF header), and the delay before it
+        '''
+        self.stats['requests'] += 1
+        address, command, data = request[3], request[4], request[5:-1]
+        if self._checksum(request[:-1]) != request[-1]:
+            return self._reply(address, command, 4), self.reply_delay
+        if command == 0x01:
+            return self._reply(address, command, 0, self._product_info()), self.reply_delay
+        if command == 0x02:
+            return self._reply(address, command, 0, bytes((self.channel,))), self.reply_delay
+        if command == 0x03:
+            self.channel = self.initial_channel
+            return self._reply(address, command, 0), self.reply_delay + self.switching_delay
+        if command == 0x04:
+            if len(data) != 1 or not 1 <= data[0] <= self.number_of_channels:
+                return self._reply(address, command, 2), self.reply_delay
+            self.channel = data[0]
+            self.stats['switches'] += 1
+            return self._reply(address, command, 0), self.reply_delay + self.switching_delay
+        return self._reply(address, command, 1), self.reply_delay
+
+    def _apply_fault(self, fault, reply):
+        self.stats['faults'] += 1
+        if fault == 'timeout':
+            return b''
+        if fault == 'garbage':
+            return bytes(self.rng.randrange(256) for i in range(self.rng.randint(1, 8))) + reply
+        if fault == 'partial':
+            return reply[:len(reply)//2]
+        if fault == 'checksum':
+            return reply[:-1] + bytes(((reply[-1] + 1) & 0xFF,))
+        #fail: the command is answered with error 3
+        return self._reply(reply[3], reply[4], 3)
+
+    def _run(self):
+        buffer = b''
+        while self.running:
+            try:
+                ready, _, _ = select.select([self._master], [], [], 0.1)
+                if not ready:
+                    continue
+                buffer += os.read(self._master, 1024)
+            except (OSError, ValueError, TypeError):
+                break
+            while True:
+                #drop anything before the header of a request
+                start = buffer.find(REQUEST_PRE)
+                if start < 0:
+                    buffer = buffer[-1:] if buffer.endswith(REQUEST_PRE[:1]) else b''
+                    break
+                buffer = buffer[start:]
+                if len(buffer) < 3 or len(buffer) < 3 + buffer[2]:
+                    break
+                if buffer[2] < 3:
+                    #too short for address, command and checksum
+                    buffer = buffer[2:]
+                    continue
+                request, buffer = buffer[:3 + buffer[2]], buffer[3 + buffer[2]:]
+                reply, delay = self.handle(request)
+                if reply[5]:
+                    self.stats['errors'] += 1
+                fault = self._next_fault()
+                if fault is not None:
+                    reply = self._apply_fault(fault, reply)
+                if delay > 0:
+                    time.sleep(delay)
+                if reply:
+                    try:
+                        os.write(self._master, reply)
+                    except OSError:
+                        break
@@ -0,0 +1,155 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Lock running on the wavemeter server (server side lock mode of WS6Server.register_lock).
+
+The PID is updated by the server as soon as a new reading of the laser arrives and only the feedback
+is pushed to the feedbackActuator of the laser (see server_lock_client.py), with a oneway Pyro call.
+The lock loop does not wait for a query of the client anymore, nor for a network round trip.
+The calls are made by a push thread of the lock, which only keeps the latest feedback: the thread
+reading the wavemeter never waits for the laser side, and if the actuator can not be reached the
+reconnections are spaced by a growing delay (up to max_retry_delay).
+
+The update rules are the same as in laserWLMLock.update_piezo: readings that are not wavelengths, outliers
+(Hampel filter) and jumps larger than max_diff_consecutive_reading are not used.
+
+'''
+
+import time
+import threading
+import Pyro4
+
+from Drivers_and_tools.PID import PID
+from Drivers_and_tools.outlier_filter import hampelFilter
+
+
+SPEED_OF_LIGHT = 299792458
+
+
+class serverSideLock():
+    def __init__(self, name, setpoint, actuator_uri, pid_p, pid_i, windup_guard = 0.01, min_out = -10., max_out = 10., \
+                 initial_output = 0., mhz_per_volt = None, true_interval = False, max_sample_interval = 1.):
+        self.name = name
+        self.actuator_uri = actuator_uri
+        self.min_retry_delay = 0.5 #s, after a failed push, doubled at every failure
+        self.max_retry_delay = 30. #s
+        self._lock = threading.Lock() #the setpoint is changed from the Pyro threads
+        self.min_out = min_out
+        self.max_out = max_out
+        self.mhz_per_volt = mhz_per_volt #piezo response, to preload the feedback on setpoint changes
+        self.max_diff_consecutive_reading = 500 #MHz
+
+        self.pid = PID(pid_p, pid_i)
+        self.pid.setWindup(windup_guard)
+        self.pid.setTrueInterval(true_interval, max_sample_interval)
+        self.pid.change_setpoint(setpoint)
+        #continue from the feedback the laser has when the lock is handed over to the server
+        self.pid.feedForward(initial_output)
+
+        self.outlier_filter = hampelFilter(window_length = 11, n_sigmas = 5., min_threshold = 20.) #MHz
+        self.outlier_bypass_readings = 20 #readings not filtered after a setpoint change, the laser is moving
+        self.last_sequence = None
+        self.state = {'laser'       : name,
+                      'setpoint'    : setpoint,
+                      'wavelength'  : None,
+                      'feedback'    : float(self.pid.output),
+                      'lock_error'  : None, #MHz
+                      'timestamp'   : None,
+                      'updates'     : 0,
+                      'rejected'    : 0,
+                      'push_errors' : 0}
+
+        #latest feedback not pushed yet, sent by the push thread
+        self._pending = None
+        self._running = True
+        self._push_condition = threading.Condition()
+        threading.Thread(target = self._push_loop, name = f'push {name}', daemon = True).start()
+
+    def close(self):
+        #stop the push thread, the lock is not used anymore
+        with self._push_condition:
+            self._running = False
+            self._push_condition.notify()
+
+    def change_setpoint(self, setpoint):
+        with self._lock:
+            old_setpoint = self.pid.SetPoint
+            self.pid.change_setpoint(setpoint)
+            self.outlier_filter.reset(bypass = self.outlier_bypass_readings)
+            self.state['setpoint'] = setpoint
+            if not self.mhz_per_volt:
+                return
+            change = (SPEED_OF_LIGHT/(setpoint*1e-9) - SPEED_OF_LIGHT/(old_setpoint*1e-9))/1e6
+            target = min(max(self.pid.output + change/self.mhz_per_volt, self.min_out), self.max_out)
+            feedback = float(self.pid.feedForward(target - self.pid.output))
+        #preload now instead of waiting for the next slot
+        self._push(feedback)
+
+    def update(self, wavelength, sequence):
+        '''
+        new reading of the laser (wavelength, sequence number of the reading), returns the feedback or None if not used
+        '''
+        if sequence == self.last_sequence:
+            return None
+        self.last_sequence = sequence
+        with self._lock:
+            if wavelength is None or wavelength <= 0 or not self.outlier_filter.check(SPEED_OF_LIGHT/(wavelength*1e-9)/1e6):
+                self.state['rejected'] += 1
+                return None
+            error = (SPEED_OF_LIGHT/(wavelength*1e-9) - SPEED_OF_LIGHT/(self.pid.SetPoint*1e-9))/1e6 #MHz
+            if abs(error) > self.max_diff_consecutive_reading:
+                self.state['rejected'] += 1
+                return None
+            #floats, numpy values can not be sent by Pyro
+            feedback = float(min(max(self.pid.update(wavelength), self.min_out), self.max_out))
+        self._push(feedback)
+        self.state.update({'wavelength' : float(wavelength),
+                           'feedback'   : feedback,
+                           'lock_error' : float(error),
+                           'timestamp'  : time.time(),
+                           'updates'    : self.state['updates'] + 1})
+        return feedback
+
+    def get_state(self):
+        return dict(self.state)
+
+    def _push(self, feedback):
+        #returns immediately, the feedback replaces the one not pushed yet
+        with self._push_condition:
+            self._pending = feedback
+            self._push_condition.notify()
+
+    def _push_loop(self):
+        actuator = None #proxy owned by this thread
+        retry_delay = 0.
+        while True:
+            with self._push_condition:
+                self._push_condition.wait_for(lambda: self._pending is not None or not self._running)
+                if not self._running:
+                    break
+                feedback, self._pending = self._pending, None
+            try:
+                if actuator is None:
+                    actuator = Pyro4.Proxy(self.actuator_uri)
+                    actuator._pyroTimeout = 1.
+                actuator.apply_feedback(feedback)
+                retry_delay = 0.
+            except Exception as e:
+                #the laser side is gone or restarting, wait before trying again with a new connection
+                print(f'Could not push the feedback to {self.name}', e)
+                self.state['push_errors'] += 1
+                if actuator is not None:
+                    actuator._pyroRelease()
+                actuator = None
+                retry_delay = min(max(2*retry_delay, self.min_retry_delay), self.max_retry_delay)
+                with self._push_condition:
+                    self._push_condition.wait_for(lambda: not self._running, retry_delay)
+        if actuator is not None:
+            actuator._pyroRelease()
@@ -0,0 +1,100 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Laser side of the server side lock mode (see server_lock.py and WS6Server.register_lock).
+
+    - feedbackActuator: Pyro object receiving the feedback pushed by the wavemeter server (oneway calls),
+      applied to the laser through the laserWLMLock (and its feedback writer)
+    - serverLockClient: sets the laser at the coarse wavelength with the laserWLMLock, then hands the lock
+      over to the server with the gains, limits and current feedback of the laserWLMLock; when stopped the
+      laserWLMLock continues from the last feedback of the server
+
+    example of usage:
+        lock = laserWLMLock(ctl2, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX')
+        client = serverLockClient(lock, host = '192.168.1.YYY')    #IP of this machine, reachable by the server
+        client.start('CTL2', 1550.1)
+        client.get_state()
+        client.change_setpoint(1550.1001)
+        client.stop()
+
+'''
+
+import time
+import threading
+import Pyro4
+
+
+@Pyro4.expose
+class feedbackActuator():
+    def __init__(self, lock):
+        self.lock = lock
+        self.updates = 0
+        self.last_feedback = None
+        self.last_update = None
+
+    @Pyro4.oneway
+    def apply_feedback(self, value):
+        self.lock.apply_feedback(value)
+        self.updates += 1
+        self.last_feedback = value
+        self.last_update = time.time()
+
+    def get_state(self):
+        return {'updates'       : self.updates,
+                'last_feedback' : self.last_feedback,
+                'last_update'   : self.last_update}
+
+
+class serverLockClient():
+    def __init__(self, lock, host = 'localhost', daemon = None):
+        self.lock = lock
+        self.laser_name = None
+        self.actuator = feedbackActuator(lock)
+
+        #the server connects back to the actuator, on the given daemon or on one of this client
+        if daemon is None:
+            daemon = Pyro4.Daemon(host = host)
+            threading.Thread(target = daemon.requestLoop, daemon = True).start()
+        self.daemon = daemon
+        self.actuator_uri = daemon.register(self.actuator)
+
+    def start(self, laser_name, setpoint):
+        self.lock.initialize_lock(laser_name, setpoint)
+        if self.lock.set_coarse_wavelength(setpoint) < 0:
+            print(f"Coarse setting of {laser_name} failed, not starting the server side lock")
+            return -1
+        self.laser_name = laser_name
+        pid = self.lock.pid
+        laser = self.lock.laser
+        ret = self.lock.wlm.register_lock(laser_name, setpoint, str(self.actuator_uri), float(pid.Kp), float(pid.Ki),
+                                          float(pid.windup_guard), laser.min_out, laser.max_out, float(pid.output),
+                                          self.lock.get_piezo_response(), bool(pid.true_interval),
+                                          float(pid.max_sample_interval))
+        if ret < 0:
+            print(f"The wavemeter server did not accept the lock of {laser_name}")
+        return ret
+
+    def change_setpoint(self, setpoint):
+        self.lock.pid.change_setpoint(setpoint)
+        return self.lock.wlm.change_lock_setpoint(self.laser_name, setpoint)
+
+    def get_state(self):
+        state = self.lock.wlm.query_lock_state(self.laser_name)
+        if state is not None:
+            state['actuator'] = self.actuator.get_state()
+        return state
+
+    def stop(self, reset_feedback = True):
+        state = self.lock.wlm.deregister_lock(self.laser_name)
+        if state is not None and not reset_feedback:
+            #continue from the feedback of the server, e.g. if the lock is restarted by the laserWLMLock
+            self.lock.pid.feedForward(state['feedback'] - self.lock.pid.output)
+        self.lock.terminate_lock(reset_feedback)
+        return state
@@ -0,0 +1,112 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Cadence aware order of the wavemeter slots, used in WS6Server._toggle_usrs.
+
+The clients query the wavemeter on their own rhythm (QTimer of the GUI, update interval of the lock engine),
+so with a fixed round robin a query often waits for almost a whole cycle, or the slot ends before the query.
+The scheduler learns the period and phase of the queries of every user and gives the next slot to the user
+expected to query first: a user already waiting, or the one with the earliest predicted query. If nobody is
+waiting and the next query is expected later, the slot is started lead_time before it (the switch and the
+wavemeter need that long). Every user still gets one slot per cycle.
+
+Queries of a user closer than merge_window to the previous one (e.g. the queries of a lock during its slot)
+are one arrival, the period is an exponentially weighted mean of the time between the arrivals.
+
+The wait of every query (from the call to the reading) is kept separately with and without the cadence
+scheduling, get_stats() reports the reduction. The daemon of WS6Server serves one call at a time, so at
+most one query waits for its slot and the time of a query is when the daemon takes it, after the calls
+queued before it.
+
+'''
+
+
+class cadenceScheduler():
+    def __init__(self, lead_time = 0.25, merge_window = 0.3, alpha = 0.2, max_idle = 1.):
+        self.lead_time = lead_time #s, switch + settling of the wavemeter
+        self.merge_window = merge_window #s
+        self.alpha = alpha
+        self.max_idle = max_idle #s, longest wait for an expected query before giving the slot to the next user
+        self.enabled = True
+
+        self.cadence = {} #user: {'last_arrival', 'last_query', 'period'}
+        self.waiting = {} #user: time of the call, for the queries waiting for their slot
+        self.served = set() #users that had their slot in the current cycle
+        self.clear_stats()
+
+    def clear_stats(self):
+        self.waits = {True : [0, 0.], False : [0, 0.]} #cadence scheduling on/off: number of queries, total wait
+
+    def remove_user(self, user):
+        self.cadence.pop(user, None)
+        self.waiting.pop(user, None)
+        self.served.discard(user)
+
+    def query_started(self, user, t):
+        c = self.cadence.setdefault(user, {'last_arrival' : None, 'last_query' : None, 'period' : None})
+        if c['last_query'] is None or t - c['last_query'] > self.merge_window:
+            if c['last_arrival'] is not None:
+                period = t - c['last_arrival']
+                c['period'] = period if c['period'] is None else c['period'] + self.alpha*(period - c['period'])
+            c['last_arrival'] = t
+        c['last_query'] = t
+        self.waiting[user] = t
+
+    def query_done(self, user, start, end):
+        self.waiting.pop(user, None)
+        if user in self.cadence:
+            self.cadence[user]['last_query'] = end
+        n, total = self.waits[self.enabled]
+        self.waits[self.enabled] = [n + 1, total + end - start]
+
+    def expected_query(self, user, now):
+        #time of the next query of the user, now if it is waiting or unknown
+        if user in self.waiting:
+            return self.waiting[user]
+        c = self.cadence.get(user)
+        if c is None or c['period'] is None or c['period'] <= 0:
+            return now
+        expected = c['last_arrival'] + c['period']
+        if expected < now:
+            #late, the client may have stopped querying: do not make it wait
+            return now
+        return expected
+
+    def next_user(self, users, now, last_index = 0):
+        '''
+        user of the next slot and the time to wait before switching to it (s), the user is only marked as
+        served by slot_started, once it really gets the slot
+        last_index is used for the round robin when the cadence scheduling is disabled
+        '''
+        if not self.enabled:
+            return users[(last_index + 1) % len(users)], 0.
+        remaining = [u for u in users if u not in self.served]
+        if not remaining:
+            self.served.clear()
+            remaining = list(users)
+        user = min(remaining, key = lambda u: self.expected_query(u, now))
+        idle = min(max(self.expected_query(user, now) - self.lead_time - now, 0.), self.max_idle)
+        return user, idle
+
+    def slot_started(self, user):
+        self.served.add(user)
+
+    def get_stats(self):
+        stats = {'enabled' : self.enabled}
+        for enabled, name in ((True, 'cadence'), (False, 'round_robin')):
+            n, total = self.waits[enabled]
+            stats[f'{name}_queries'] = n
+            stats[f'{name}_mean_wait'] = total/n if n else None
+        if stats['cadence_mean_wait'] is not None and stats['round_robin_mean_wait']:
+            stats['wait_reduction'] = 1. - stats['cadence_mean_wait']/stats['round_robin_mean_wait']
+        else:
+            stats['wait_reduction'] = None
+        stats['periods'] = {u : c['period'] for u, c in self.cadence.items()}
+        return stats
@@ -24,7 +24,7 @@ Code to run a laser lock server that allows to lock single lasers using the read
 The laser can be controlled remotely via the laser_lock server on other consoles or machines, and via the GUI.
 To lock multiple lasers in 'parallel' just run the script multiple times in separate consoles (the reading from the wavementer will be in series, so the lock of multiple lasers will be toggling between them in series continuosly).
 
-In this code 1 example class for a TOPTICA DCL pro used in our labs, lockTopticaCTL().
+In Drivers_and_tools/laser_lock_lasers.py 1 example class for a TOPTICA DCL pro used in our labs, lockTopticaCTL().
 Add a laser creating a class following the templateLaser().
 The lasers here can be added to the locking via the lasers list in the main.
 
@@ -52,10 +52,13 @@ class templateLaser():
         #disconnect from laser & feedback channel
         #reset_feedback = False is used to pause the lock but maintain DC feedback
     def set_wavelength_coarse(self, set_wavelength):
-        #Initially set the coarse wavelength (e.g. by motor)
+        #Set the coarse wavelength (e.g. by motor)
+        #laserWLMLock calls it again with a corrected wavelength until the wlm reading is within coarse_setting_accuracy,
+        #the measured offsets are saved in the calibration store to start closer the next time
     def correct_wavelength_offset(self, set_wavelength, actual_wavelength):
         #Correct for an offset between the laser wavelength setpoint and the wlm reading
         #i.e. laser.set_wavelength_coarse(set_wavelength) produced a wlm reading of {actual_wavelength}
+        #(optional, not used by laserWLMLock anymore)
     def apply_feedback(self, value):
         #apply feedback e.g. to piezo. This is called repeatedly during the locking!
         #{value} is the feedback value calculated by the PID
@@ -69,64 +72,16 @@ import visa
 from PyQt5 import QtGui, QtCore
 import Pyro4
 
-from qcodes import Instrument
 from Drivers_and_tools.laser_lock import laserWLMLock
 from Drivers_and_tools.laser_lock_gui_5_0 import laserLockGUI, remote_lock_access
-from Drivers_and_tools.TopticaDLCPro import TopticaDLCPro #needs the qcodes repository
+from Drivers_and_tools.laser_lock_lasers import lockTopticaCTL #needs the qcodes repository
+from Drivers_and_tools.lock_engine import lockEngine
 import Drivers_and_tools.ppcl550driver as pp
 from Drivers_and_tools.Tl6800control import TL6800
 
 from server_library import pyro_tools,qt5_pyro_integration
 Pyro4.expose(remote_lock_access)
 
-class lockTopticaCTL():
-    def __init__(self, name, ip_address, pid_p = 0., pid_i = -1000., \
-                 min_out = -10., max_out = 10., coarse_setting_accuracy = 500.):    
-        #--------PARAMETERS----------
-
-        self.name = name
-        self.ip_address = ip_address
-        self.pid_p = pid_p
-        self.pid_i = pid_i
-        self.min_out = min_out
-        self.max_out = max_out
-        self.wl_min = 1460.
-        self.wl_max = 1570.
-        self.coarse_setting_accuracy = coarse_setting_accuracy  #MHz - how close the coarse setting needs to be
-        self.piezo_offset = 70.
-
-    def connect_laser(self):
-        try:
-             self.laser = Instrument.find_instrument(self.name)
-        except KeyError:
-            self.laser = TopticaDLCPro(self.name, self.ip_address)
-
-    def disconnect_laser(self, reset_feedback = False):
-        if reset_feedback:
-            self.laser.piezo_voltage_setting(self.piezo_offset)
-        self.laser.close()
-        
-    def set_wavelength_coarse(self, set_wavelength):
-        self.laser.piezo_voltage_setting(self.piezo_offset)
-        self.wavelength = set_wavelength
-        self.laser.wavelength(self.wavelength)
-        st = time.time()
-        while not self.laser.get_laser_state() == '0':
-            time.sleep(.1)
-            if time.time() - st > 5.:
-                return -1
-        return 1
-
-    def correct_wavelength_offset(self, set_wavelength, actual_wavelength):
-        self.wavelength += set_wavelength - actual_wavelength
-        self.set_wavelength_coarse(self.wavelength)
-        return 1
-
-
-    def apply_feedback(self, value):
-        self.laser.piezo_voltage_setting(self.piezo_offset + value)
-
-
 if __name__ == '__main__': 
     '''
     Example of usage
@@ -149,7 +104,9 @@ if __name__ == '__main__':
     
     #use the IP of the machine running the wavementer server    
     lock = laserWLMLock(*lasers, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX')
-    Window = laserLockGUI(lock)
+    #the lock runs in the engine thread, the GUI is only used to control and show it (use laserLockGUI(lock) to have the lock updated by the GUI timer)
+    engine = lockEngine(lock)
+    Window = laserLockGUI(lock, engine)
     if cur_laser is not None:
         Window.ui.comboBox.setCurrentIndex(laser_idx+1)
         Window.setWindowTitle("Laser Lock " + cur_laser)
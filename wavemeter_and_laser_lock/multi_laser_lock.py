@@ -0,0 +1,62 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+___________________________________________________________________________________________________
+
+Code to lock several lasers from a single process, without GUI.
+
+Same as running laser_lock.py once per laser, but all the lock loops run in this process
+and share one Pyro daemon. Every laser is controlled remotely as with laser_lock.py:
+    ctl2_lock = Pyro4.Proxy('PYRONAME:laser_lock_CTL2@192.168.1.XXX')
+    ctl2_lock.start(1550.1, 0.)   #wavelength in nm, detuning in GHz
+    ctl2_lock.get_state()
+    ctl2_lock.stop()
+and all the lasers together via the host:
+    host = Pyro4.Proxy('PYRONAME:laser_lock_host@192.168.1.XXX')
+    host.start_all({'CTL1' : 1550.1, 'CTL2' : 1551.3})
+    host.get_states()
+    host.stop_all()
+
+The lasers are defined as in laser_lock.py (see templateLaser there and Drivers_and_tools/laser_lock_lasers.py).
+__________________________________________________________________________________________________
+
+Needs to have:
+    - qcodes enviroment (https://docs.conda.io/projects/conda/en/latest/user-guide/tasks/manage-environments.html)
+    - Pyro4 (conda install Pyro4)
+
+'''
+
+import Pyro4
+
+from Drivers_and_tools.laser_lock_lasers import lockTopticaCTL
+from Drivers_and_tools.laser_lock_host import laserLockHost
+
+
+if __name__ == '__main__':
+    '''
+    Example of usage
+    '''
+    #initialise the lasers, use the IP addresses and classes of the lasers used in the lab
+    ctl1 = lockTopticaCTL('CTL1', '192.168.1.XXX')
+    ctl2 = lockTopticaCTL('CTL2', '192.168.1.XXX')
+
+    #use the IP of the machine running the wavementer server
+    lock_host = laserLockHost(ctl1, ctl2, wlm_address = 'PYRONAME:wsserver@192.168.1.XXX')
+
+    #IP address of the machine where it will run, or 'localhost' to run it in the local machine
+    host = 'localhost'
+    daemon = Pyro4.Daemon(host=host)
+    lock_host.register_on_daemon(daemon, host)
+
+    print('Starting lock host loop')
+    try:
+        daemon.requestLoop()
+    finally:
+        lock_host.stop_all()
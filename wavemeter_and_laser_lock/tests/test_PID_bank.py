@@ -0,0 +1,72 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Tests of PID_bank: the rows of a PIDBank updated from several threads (as the lock engines of
+laserLockHost do) must end in the same state as scalar PIDs updated with the same values.
+
+'''
+
+import os
+import sys
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Drivers_and_tools'))
+from PID import PID
+from PID_bank import PIDBank
+
+
+def test_concurrent_updates_of_the_rows():
+    n_lasers, n_updates, dt = 8, 2000, 0.1
+    kp, ki = np.linspace(0., 100., n_lasers), np.linspace(-2000., -200., n_lasers)
+    rng = np.random.default_rng(0)
+    readings = 1550. + rng.normal(0., 1e-4, (n_lasers, n_updates))
+
+    bank = PIDBank(n_lasers, kp, ki, windup_guard=1.)
+    controllers = [bank.controller(i) for i in range(n_lasers)]
+    for c in controllers:
+        c.change_setpoint(1550.)
+    start = threading.Barrier(n_lasers)
+
+    def run(i):
+        start.wait()
+        for k in range(n_updates):
+            controllers[i].update(readings[i, k], dt)
+            if k % 100 == 0:
+                controllers[i].feedForward(1e-3)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n_lasers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    for i in range(n_lasers):
+        pid = PID(kp[i], ki[i])
+        pid.setWindup(1.)
+        pid.change_setpoint(1550.)
+        for k in range(n_updates):
+            pid.update(readings[i, k], dt)
+            if k % 100 == 0:
+                pid.feedForward(1e-3)
+        assert np.isclose(bank.output[i], pid.output)
+        assert np.isclose(bank.ITerm[i], pid.ITerm)
+        assert np.isclose(bank.last_error[i], pid.last_error)
+
+
+def test_masked_update_leaves_the_other_rows():
+    bank = PIDBank(3, 1., -1000.)
+    bank.SetPoint[:] = 1550.
+    bank.update(1550.001, 0.1)
+    before = bank.output.copy()
+    out = bank.update([0., 1550.002, 0.], 0.1, mask=[False, True, False])
+    assert len(out) == 1
+    assert bank.output[0] == before[0] and bank.output[2] == before[2]
+    assert bank.output[1] != before[1]
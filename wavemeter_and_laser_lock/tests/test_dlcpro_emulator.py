@@ -0,0 +1,121 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Tests of the DLC pro clients against the local emulator (dlcpro_emulator): the pipelined command session,
+the monitoring line and the concurrent coarse setting of the asyncio client, without a controller.
+The tests of TopticaDLCPro need qcodes and TelnetInstrument and are skipped without them.
+
+'''
+
+import os
+import sys
+import time
+import asyncio
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, os.path.join(HERE, '..', 'Drivers_and_tools'))
+from dlcpro_emulator import dlcProEmulator
+from TopticaDLCPro_async import AsyncDLCPro, set_wavelengths_coarse
+
+STATE = 'laser1:ctl:state'
+WAVELENGTH = 'laser1:ctl:wavelength-act'
+
+
+@pytest.fixture
+def emulator():
+    emulator = dlcProEmulator(port=0, monitor_port=0, motor_settle_time=0.1, motor_speed=5., coarse_error=0., seed=0)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def dlcpro():
+    return pytest.importorskip('Drivers_and_tools.TopticaDLCPro')
+
+
+def test_session_pipelines_the_commands(emulator, dlcpro):
+    emulator.latency = 0.1
+    session = dlcpro.DLCProSession('127.0.0.1', emulator.port)
+    session.execute(["(param-ref 'fw-ver)"])
+    names = ['serial-number', 'fw-ver', STATE, 'laser1:ctl:wavelength-min', 'laser1:ctl:wavelength-max']
+    st = time.time()
+    values = session.execute(["(param-ref '{})".format(name) for name in names])
+    #one round trip for the whole batch, 5 with one command at a time
+    assert time.time() - st < 3*emulator.latency
+    assert values == ['"EMU-0001"', '"2.5.0"', '0', '1460.000000', '1570.000000']
+    session.close()
+
+
+def test_session_error_replies(emulator, dlcpro):
+    session = dlcpro.DLCProSession('127.0.0.1', emulator.port)
+    with pytest.raises(RuntimeError, match='unknown parameter'):
+        session.execute(["(param-ref 'laser1:nothing)", "(param-ref 'fw-ver)"])
+    with pytest.raises(RuntimeError, match='read-only'):
+        session.execute(["(param-set! 'laser1:ctl:state 1)"])
+    #the replies after an error are still matched to their commands
+    assert session.execute(["(param-ref 'fw-ver)", "(param-set! 'laser1:ctl:scan:speed 2.5)",
+                            "(param-ref 'laser1:ctl:scan:speed)"]) == ['"2.5.0"', '0', '2.500000']
+    session.close()
+
+
+def test_monitor_subscribe_and_wait_for(emulator, dlcpro):
+    monitor = dlcpro.DLCProMonitor('127.0.0.1', emulator.monitor_port)
+    assert monitor.subscribe([STATE, WAVELENGTH])
+    #the current values are there once subscribed
+    assert monitor.update_count(STATE) == 1 and monitor.get(STATE) == '0'
+    assert float(monitor.get(WAVELENGTH)) == pytest.approx(1550.)
+
+    since = monitor.update_count(STATE)
+    session = dlcpro.DLCProSession('127.0.0.1', emulator.port)
+    session.execute(["(param-set! 'laser1:ctl:wavelength-set 1551.)"])
+    assert monitor.wait_for(STATE, lambda value: True, 1., since) == '1'
+    assert monitor.wait_for(STATE, lambda value: value == '0', 5.) == '0'
+    assert float(monitor.get(WAVELENGTH)) == pytest.approx(1551., abs=1e-4)
+    #nothing changes anymore
+    assert monitor.wait_for(STATE, lambda value: True, 0.2, monitor.update_count(STATE)) is None
+
+    monitor.close()
+    assert monitor.wait_for(STATE, lambda value: value == '0', 1.) is None
+    session.close()
+
+
+def test_concurrent_coarse_settings():
+    emulators = [dlcProEmulator(port=0, monitor_port=0, motor_settle_time=0.2, motor_speed=1., coarse_error=0., seed=i)
+                 for i in range(3)]
+    for emulator in emulators:
+        emulator.start()
+    targets = [1550.5, 1551., 1550.2]
+
+    async def run():
+        lasers = [AsyncDLCPro('CTL{}'.format(i), '127.0.0.1', e.port, e.monitor_port) for i, e in enumerate(emulators)]
+        await asyncio.gather(*[laser.connect() for laser in lasers])
+        try:
+            st = time.time()
+            results = await set_wavelengths_coarse(lasers, targets)
+            duration = time.time() - st
+            wavelengths = [await laser.get_wavelength() for laser in lasers]
+            out_of_range = await set_wavelengths_coarse(lasers[:1], [1600.])
+        finally:
+            await asyncio.gather(*[laser.close() for laser in lasers])
+        return results, duration, wavelengths, out_of_range
+
+    try:
+        results, duration, wavelengths, out_of_range = asyncio.run(run())
+    finally:
+        for emulator in emulators:
+            emulator.stop()
+    assert results == [1, 1, 1]
+    #as long as the longest move (0.2 s + 1 s), not the sum of the three
+    assert duration < 2.
+    assert wavelengths == pytest.approx(targets, abs=1e-4)
+    assert isinstance(out_of_range[0], ValueError)
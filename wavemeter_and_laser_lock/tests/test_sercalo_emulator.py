@@ -0,0 +1,89 @@
+'''
+Created on 2026
+
+@author: GroeblacherLab
+
+This work is licensed under the GNU Affero General Public License v3.0
+
+Copyright (c) 2021, GroeblacherLab
+All rights reserved.
+
+Tests of SercaloSwitch against the emulator of the switch (sercalo_emulator, pseudo terminal, Linux only):
+recovery from every fault of the emulator, tracking of the channel and the switching from the thread of
+the switch (set_channel_async).
+
+'''
+
+import os
+import sys
+import pytest
+
+if not sys.platform.startswith('linux'):
+    pytest.skip('the emulator of the switch runs on a pseudo terminal', allow_module_level=True)
+pytest.importorskip('serial')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Drivers_and_tools'))
+from sercalo_emulator import sercaloEmulator, FAULTS
+from Sercalo_1xN_switch import SercaloSwitch
+
+
+@pytest.fixture
+def emulator():
+    emulator = sercaloEmulator(switching_delay=0.002, seed=0)
+    emulator.start()
+    yield emulator
+    emulator.stop()
+
+
+@pytest.fixture
+def switch(emulator):
+    switch = SercaloSwitch(emulator.port, timeout=0.2)
+    yield switch
+    switch.close()
+
+
+@pytest.mark.parametrize('fault', FAULTS)
+def test_recovery_from_fault(emulator, switch, fault):
+    assert switch.set_channel(2)
+    switch.clear_switch_stats()
+    emulator.inject(fault)
+    assert switch.set_channel(5)
+    assert switch.channel == 5 and emulator.channel == 5
+    stats = switch.get_switch_stats()
+    assert (stats['switches'], stats['resyncs'], stats['failures']) == (1, 1, 0)
+    #nothing left of the bad reply
+    assert switch.get_channel() == 5
+    assert switch.set_channel(3) and emulator.channel == 3
+
+
+def test_failure_after_the_retries(emulator, switch):
+    emulator.inject('timeout', count=2*(switch.retries + 1))
+    assert not switch.set_channel(4)
+    assert switch.channel is None
+    stats = switch.get_switch_stats()
+    assert (stats['resyncs'], stats['failures']) == (switch.retries + 1, 1)
+    #the driver works again without opening the port
+    assert switch.set_channel(4) and emulator.channel == 4
+
+
+def test_channel_tracking(emulator, switch):
+    assert switch.set_channel(6)
+    switches = emulator.stats['switches']
+    assert switch.set_channel(6)
+    assert emulator.stats['switches'] == switches
+    assert switch.get_switch_stats()['skipped'] == 1
+    #a fault leaves the channel unknown, the next command is sent
+    emulator.inject('checksum')
+    assert switch.get_channel() is None
+    assert switch.set_channel(6)
+    assert emulator.stats['switches'] == switches + 1
+
+
+def test_set_channel_async(emulator, switch):
+    futures = [switch.set_channel_async(channel) for channel in (1, 2, 3, 4)]
+    assert [future.result(5.) for future in futures] == [True]*4
+    assert switch.channel == 4 and emulator.channel == 4
+    emulator.inject('garbage')
+    assert switch.set_channel_async(7).result(5.)
+    assert switch.channel == 7 and emulator.channel == 7
+    assert switch.get_switch_stats()['resyncs'] == 1
@@ -22,12 +22,33 @@ WS6 server to allow multiple users (lasers) to be locked to the WS6 wavelength m
         wlm = Pyro4.Proxy(uri)
         wlm.register_user(laser)  #optional slot_length = 2.
         wlm.query_wavelength(laser)
+        wlm.query_wavelength_stamped(laser)  #(wavelength, time, sequence number) of the reading
         wlm.deregister_user(laser)
 
     Users initially register, the server then handles all connections and passes
     the WLM reading to make sure errors on the user side do not affect the server.
     It is possible to request a longer slot time than the standard time set on
     the server side while registering.
+    The wavemeter is read every 0.1 s, a user querying more often gets the same reading again:
+    the sequence number of query_wavelength_stamped changes only with a new reading.
+
+    Server side lock: a registered user can also register a lock (register_lock, see Drivers_and_tools/server_lock.py
+    and server_lock_client.py), the server then updates the PID of the laser as soon as a new reading
+    arrives in the slot of the laser and pushes the feedback to the actuator of the laser.
+
+    The order of the slots follows the rhythm of the queries of the users (see Drivers_and_tools/slot_scheduler.py),
+    so a slot starts just before the query of its user; set_cadence_scheduling(False) goes back to the
+    round robin and query_wait_stats() compares the waiting time of the queries in both cases.
+
+    The switch command runs in the thread of the switch (SercaloSwitch.set_channel_async): while the switch moves
+    the server kicks the inactive users and sets the exposure of the wavemeter to the last one of the next user,
+    so the first reading of the slot does not wait for the automatic exposure (set_exposure_preload(False) to stop).
+    Scan capture: reserve_user(laser, duration) gives the wavemeter to one user for a whole scan, the wavemeter
+    is then read every reading_interval and all the readings are kept (query_capture(laser, start_index) returns
+    the ones from start_index) until release_user(laser) or the end of the reservation (see
+    Drivers_and_tools/scan_capture.py). The other users get no reading meanwhile: their queries return 0 at once
+    (the daemon serves one call at a time, a waiting query would hold the calls of the scan), as when their slot
+    does not come in time; query_reservation() tells them who has the wavemeter and for how long.
     The server closes the connection to the users after self.max_inactivity_time.
 """
 
@@ -50,13 +71,17 @@ import threading
 import Pyro4
 
 from server_library import pyro_tools
+from server_library.pyro_metrics import rpc_metrics, METRICS_ENABLED
 #import the used wavemeter
 from Drivers_and_tools.HighFinesse_WS6 import Wavelengthmeter
 #import the optical switch used to toggle the users
 from Drivers_and_tools.Sercalo_1xN_switch import SercaloSwitch
+from Drivers_and_tools.server_lock import serverSideLock
+from Drivers_and_tools.slot_scheduler import cadenceScheduler
 
 @Pyro4.expose
 @Pyro4.behavior(instance_mode="single")
+@rpc_metrics
 class WS6Server:
     def __init__(self):
         #timeout after which users are automatically disconnected
@@ -82,8 +107,27 @@ class WS6Server:
 
         #User that is currently allowed to read the WLM
         self.current_user = ''
+        self.slot_start_time = 0.
+
+        #server side locks, with the user as key
+        self.locks = {}
+
+        #order of the slots following the queries of the users
+        self.scheduler = cadenceScheduler()
+
+        #user having the wavemeter for a scan, with all the readings of the scan
+        self.reservation = None
+
+        #last exposure of every user, set before its slot
+        self.exposures = {}
+        self.exposure_slot = 0. #slot_start_time of the slot whose exposure was saved
+        self.exposure_preload = True
 
         self.wavelength = 0.
+        #last reading as (wavelength, time, sequence number), replaced as a whole so it is always consistent
+        self.reading = (0., 0., 0)
+        #start of the read of the last reading and the reading, the users only get readings started in their slot
+        self.last_read = (0., self.reading)
 
         #start threads to read the WLM continuously and toggle between the active users
         threading.Thread(None, self._read_wls, None).start()
@@ -113,6 +157,8 @@ class WS6Server:
             return 0 #not there
 
         del self.users[name]
+        self._remove_lock(name)
+        self.scheduler.remove_user(name)
 
         t = datetime.now().strftime("%H:%M:%S")
         print(f"{t}: Disconnected {name}")
@@ -134,29 +180,195 @@ class WS6Server:
 
     def query_wavelength(self, usr, timeout = 10.):
         #return wavelength once it is the turn of the user
+        return self.query_wavelength_stamped(usr, timeout)[0]
+
+    def query_wavelength_stamped(self, usr, timeout = 10.):
+        #return (wavelength, time, sequence number) of the last reading once it is the turn of the user,
+        #the sequence number tells the user if the reading is new or one it already had
         st = time.time()
         if not usr in self.users:
-            return -1
+            return (-1, 0., -1)
 
         self._reset_query_time(usr) #log initial request time so the user is not kicked while waiting
+        if self._reserved_user() not in (None, usr):
+            #no slot before the end of the reservation, do not hold the daemon
+            return (0, 0., -1)
+        self.scheduler.query_started(usr, st)
         while True:
-            if usr == self.current_user:
+            read_start, reading = self.last_read
+            if usr == self.current_user and read_start > self.slot_start_time:
                 self._reset_query_time(usr)   #log tranmittance time
-                return self.wavelength
+                self.scheduler.query_done(usr, st, time.time())
+                return reading
 
-            if time.time() - st > timeout:
-                return 0
+            if time.time() - st > timeout or self._reserved_user() not in (None, usr):
+                self.scheduler.query_done(usr, st, time.time())
+                return (0, 0., -1)
             #dead time to let the switch to toggle user and not have reading of a laser associated with the wrong laser
             time.sleep(0.02) 
 
 
+    def set_cadence_scheduling(self, enable):
+        #False for the plain round robin between the users
+        self.scheduler.enabled = enable
+        self.scheduler.served.clear()
+        return 1
+
+    def query_wait_stats(self):
+        #mean waiting time of the queries with and without cadence scheduling, and the reduction
+        return self.scheduler.get_stats()
+
+    def clear_wait_stats(self):
+        self.scheduler.clear_stats()
+
+    def set_exposure_preload(self, enable):
+        self.exposure_preload = enable
+        return 1
+
+    def query_switch_stats(self):
+        #number of switches and time of a switch (s)
+        return self.sw.get_switch_stats()
+
+    def query_server_time(self):
+        #to align the clock of a client with the time of the readings
+        return time.time()
+
+    def reserve_user(self, name, duration, reading_interval = 0.02):
+        #only the user reads the wavemeter for duration (s), every reading_interval, and all the readings are kept
+        #the queries of the other users return 0 at once until the end of the reservation
+        if not name in self.users:
+            return -1
+        res = self.reservation
+        if res is not None and res['user'] != name and time.time() < res['end']:
+            return 0 #reserved by another user
+        n = int(duration/reading_interval*1.2) + 10
+        self.reservation = {'user'        : name,
+                            'end'         : time.time() + duration,
+                            'interval'    : reading_interval,
+                            'times'       : np.zeros(n),
+                            'wavelengths' : np.zeros(n),
+                            'n'           : 0}
+        t = datetime.now().strftime("%H:%M:%S")
+        print(f"{t}: Wavemeter reserved by {name} for {duration:.1f} s")
+        return 1
+
+    def release_user(self, name):
+        #end the reservation, the readings can still be queried until the next reservation
+        res = self.reservation
+        if res is None or res['user'] != name:
+            return -1
+        res['end'] = 0.
+        return res['n']
+
+    def query_capture(self, name, start = 0):
+        #(times, wavelengths) of the readings of the reservation from index start
+        res = self.reservation
+        if res is None or res['user'] != name:
+            return ([], [])
+        if name in self.users:
+            self._reset_query_time(name)
+        n = res['n']
+        #lists of floats, numpy arrays can not be sent by Pyro
+        return (res['times'][start:n].tolist(), res['wavelengths'][start:n].tolist())
+
+    def query_reservation(self):
+        #(user, remaining time in s) of the running reservation, ('', 0.) without one
+        reserved = self._reserved_user()
+        if reserved is None:
+            return ('', 0.)
+        return (reserved, float(max(self.reservation['end'] - time.time(), 0.)))
+
+    def _reserved_user(self):
+        res = self.reservation
+        if res is not None and time.time() < res['end'] and res['user'] in self.users:
+            return res['user']
+        return None
+
+    def _capture(self, read_start):
+        #keep the reading if it belongs to the reserved user
+        res = self.reservation
+        if res is None or res['user'] != self.current_user or read_start <= self.slot_start_time \
+           or read_start > res['end']:
+            return
+        n = res['n']
+        if n == len(res['times']):
+            #longer than expected, never drop readings
+            res['times'] = np.concatenate((res['times'], np.zeros(n)))
+            res['wavelengths'] = np.concatenate((res['wavelengths'], np.zeros(n)))
+        res['times'][n] = (read_start + self.reading[1])/2 #the laser moves during the scan, middle of the reading
+        res['wavelengths'][n] = self.reading[0]
+        res['n'] = n + 1
+
+    def register_lock(self, name, setpoint, actuator_uri, pid_p, pid_i, windup_guard = 0.01, min_out = -10., max_out = 10., \
+                      initial_output = 0., mhz_per_volt = None, true_interval = False, max_sample_interval = 1.):
+        #lock the laser of a registered user on the server, the feedback is pushed to the Pyro object at actuator_uri
+        if not name in self.users:
+            return -1
+        self._remove_lock(name)
+        self.locks[name] = serverSideLock(name, setpoint, actuator_uri, pid_p, pid_i, windup_guard, min_out, max_out,
+                                          initial_output, mhz_per_volt, true_interval, max_sample_interval)
+        t = datetime.now().strftime("%H:%M:%S")
+        print(f"{t}: Server side lock of {name} at {setpoint} nm")
+        return 1
+
+    def change_lock_setpoint(self, name, setpoint):
+        if not name in self.locks:
+            return -1
+        self.locks[name].change_setpoint(setpoint)
+        return 1
+
+    def deregister_lock(self, name):
+        #stop the server side lock, returns its last state (with the feedback to continue from)
+        lock = self._remove_lock(name)
+        if lock is None:
+            return None
+        return lock.get_state()
+
+    def _remove_lock(self, name):
+        lock = self.locks.pop(name, None)
+        if lock is not None:
+            lock.close()
+        return lock
+
+    def query_lock_state(self, name):
+        if not name in self.locks:
+            return None
+        return self.locks[name].get_state()
+
     def _read_wls(self):
         #looped continuously in own thread to read the wavelength
+        sequence = 0
         while True:
+            read_start = time.time()
             self.wavelength = self.wlm.getWL()
-            if self.current_user in self.users:
-                self.users[self.current_user][2]  = self.wavelength    
-            time.sleep(0.1)
+            sequence += 1
+            self.reading = (self.wavelength, time.time(), sequence)
+            self.last_read = (read_start, self.reading)
+            user = self.current_user
+            slot_start = self.slot_start_time
+            if user in self.users:
+                self.users[user][2]  = self.wavelength
+                #only readings started after the switch belong to the user
+                if user in self.locks and read_start > slot_start:
+                    self._update_lock(user)
+                #once per slot, on the first valid reading (the automatic exposure has settled)
+                if self.exposure_preload and self.wavelength > 0 and read_start > slot_start \
+                        and self.exposure_slot != slot_start:
+                    self.exposure_slot = slot_start
+                    self._save_exposure(user)
+            if self.reservation is not None:
+                self._capture(read_start)
+            reserved = self._reserved_user()
+            time.sleep(self.reservation['interval'] if reserved is not None and reserved == user else 0.1)
+
+    def _update_lock(self, user):
+        try:
+            self.locks[user].update(self.wavelength, self.reading[2])
+            self._reset_query_time(user) #the lock keeps the user active
+        except KeyError:
+            pass #lock removed meanwhile
+        except Exception as e:
+            print(f"Error in the server side lock of {user}", e)
 
     def _reset_query_time(self, user):
         #reset the time of the last query of a given user
@@ -170,6 +382,8 @@ class WS6Server:
         for key in delete:
             print(f"Kicking {key} for inactivity")
             del self.users[key]
+            self._remove_lock(key)
+            self.scheduler.remove_user(key)
         return
 
     def _toggle_usrs(self):
@@ -185,16 +399,36 @@ class WS6Server:
 
             if len(_users) > 0:
 
-                self.current_user = ''
+                #next user, from the rhythm of the queries (or toggle though the currently registered usrs)
+                _keys = list(_users.keys())
+                reserved = self._reserved_user()
+                if reserved is not None:
+                    #the wavemeter stays with the user of the scan until the end of the reservation
+                    if reserved == self.current_user:
+                        self._kick_inactive_users()
+                        continue
+                    _user_key = reserved
+                else:
+                    _user_key, idle = self.scheduler.next_user(_keys, time.time(), current_idx)
+                    if idle > 0:
+                        #nobody waiting and the next query is expected later: the current user keeps the wavemeter until then
+                        self._wait_for_query(idle)
+                        #the wait ends when another user queries, the slot goes to the user actually waiting
+                        _keys = list(_users.keys())
+                        if not _keys:
+                            continue
+                        _user_key, idle = self.scheduler.next_user(_keys, time.time(), current_idx)
+                current_idx = _keys.index(_user_key)
 
-                #toggle though the currently registered usrs
-                current_idx = (current_idx+1) % len(_users)
-                #convert index to key
-                _user_key = list(_users.keys())[current_idx]
+                self.current_user = ''
 
-                #switch (and wait a moment to let the wlm settle)
-                self._switch_to_usr(_user_key)
-                time.sleep(0.05) #dead time to teggle between users with 10ms integration on the wavemeter              
+                #switch, with the housekeeping and the preparation of the wavemeter while the switch moves
+                switch, moved = self._start_switch(_user_key)
+                self._kick_inactive_users()
+                self._preload_exposure(_user_key)
+                #wait a moment to let the wlm settle, if the switch moved
+                if self._finish_switch(_user_key, switch, moved):
+                    time.sleep(0.05) #dead time to teggle between users with 10ms integration on the wavemeter              
                 
                 try:
                     _slot_len = _users[_user_key][0]
@@ -204,31 +438,63 @@ class WS6Server:
                     _slot_len = 0.1 
                     _user_key = ''
 
+                self.slot_start_time = time.time()
                 self.current_user = _user_key
-
-
-
-                #bit of housekeeping
-                self._kick_inactive_users()
+                if _user_key in _users:
+                    self.scheduler.slot_started(_user_key)
 
                 #wait for slot length (even if we actually just kicked the curren user)
                 time.sleep(_slot_len)
 
-    def _switch_to_usr(self, name):
+    def _wait_for_query(self, idle):
+        end = time.time() + idle
+        while time.time() < end and not [u for u in list(self.scheduler.waiting) if u != self.current_user]:
+            time.sleep(0.02)
+
+    def _start_switch(self, name):
         #print("Switching to {name}: channel{self.switch_positions[name]}")
-        switched = False
-        for i in range(3): #lets try 3 times in case st goes wrong.
-            if switched:
-                break
+        #the switch does not move if it is already on the channel and recovers from faults itself (flush and
+        #read back the channel). Returns the Future of the switch and if the channel changes
+        channel = self.switch_positions[name]
+        moved = self.sw.channel != channel
+        return self.sw.set_channel_async(channel), moved
+
+    def _finish_switch(self, name, switch, moved):
+        #wait for the switch, the port is opened again only if the switch could not recover. True if the channel changed
+        try:
+            switched = switch.result()
+        except Exception as e:
+            print(f'Error switching to {name}',e)
+            switched = False
+        if not switched:
+            print(f'Could not switch to {name}, opening the port of the switch again')
             try:
-                switched = self.sw.set_channel(self.switch_positions[name])
-            except Exception as e:
-                print(f'Error switching to {name}',e)
                 self.sw.close()
                 time.sleep(0.1)
                 self.sw.connect()
-                time.sleep(0.1)
-        time.sleep(0.1)
+                self.sw.set_channel(self.switch_positions[name])
+            except Exception as e:
+                print(f'Error switching to {name}',e)
+            moved = True
+        return moved
+
+    def _save_exposure(self, user):
+        #the errors of the wavemeter are negative, they are not an exposure to preload
+        try:
+            exposure = self.wlm.getExposure()
+        except Exception as e:
+            print(f'Could not read the exposure of {user}', e)
+            return
+        if exposure > 0:
+            self.exposures[user] = exposure
+
+    def _preload_exposure(self, user):
+        if not self.exposure_preload or user not in self.exposures:
+            return
+        try:
+            self.wlm.setExposure(self.exposures[user])
+        except Exception as e:
+            print(f'Could not set the exposure of {user}', e)
 
 if __name__ == '__main__':
 	#run the file to have the server running on the machine with the IP = host, the machine needs to be connected to the wavemeter
@@ -244,5 +510,9 @@ if __name__ == '__main__':
     if nameserver:
         pyro_tools.register_on_nameserver(host, share_name, uri)
 
+    if METRICS_ENABLED:
+        #run with PYRO_RPC_METRICS=1 to have the latency of every call printed every minute
+        ws6.start_metrics_dump(60.)
+
     print('Starting server loop')
     daemon.requestLoop()